@@ -0,0 +1,159 @@
+"""Helpers shared by benchmarks."""
+
+import json
+import platform
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import Crypto
+from encryptor import __version__
+
+Result = Dict[str, Any]
+# Fields of a result that hold measurements instead of describing the case.
+MEASUREMENTS = ("seconds", "throughput", "peak_memory")
+
+
+def new_parser(
+    repeat: Optional[int] = None, memory: bool = False, qt_platform: bool = False
+) -> ArgumentParser:
+    """Create a parser of options shared by benchmarks that write results.
+
+    Parsers take a path of results, options for a number of repetitions with a given
+    default, skipping peak memory and a Qt platform plugin are added if requested.
+    """
+
+    parser = ArgumentParser()
+    parser.add_argument(
+        "-o", "--output", dest="output", help="path of a JSON file with results"
+    )
+
+    if repeat is not None:
+        parser.add_argument(
+            "-r",
+            "--repeat",
+            dest="repeat",
+            help="number of repetitions of every case",
+            type=int,
+            default=repeat,
+        )
+
+    if memory:
+        parser.add_argument(
+            "--no-memory",
+            dest="memory",
+            help="skip measuring peak memory",
+            action="store_false",
+        )
+
+    if qt_platform:
+        parser.add_argument(
+            "--platform",
+            dest="platform",
+            help="Qt platform plugin windows are shown with",
+            default="offscreen",
+        )
+
+    return parser
+
+
+def measure(func: Callable[[], Any], min_time: float = 0.5, repeat: int = 3) -> float:
+    """Measure the best time of a single call in seconds.
+
+    Every repetition calls the function until at least `min_time` passes, so slow
+    calls are made only once per repetition.
+    """
+
+    best = float("inf")
+
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+
+        while True:
+            func()
+            calls += 1
+            elapsed = time.perf_counter() - start
+
+            if elapsed >= min_time:
+                break
+
+        best = min(best, elapsed / calls)
+
+    return best
+
+
+def peak_memory(func: Callable[[], Any]) -> int:
+    """Measure peak memory in bytes allocated by Python during a single call."""
+
+    tracemalloc.start()
+
+    try:
+        func()
+
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def parse_size(size: str) -> int:
+    """Parse a size like `16`, `64K`, `16M` or `1G` into bytes."""
+
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    size = size.strip().upper()
+
+    if size and size[-1] in units:
+        return int(size[:-1]) * units[size[-1]]
+
+    return int(size)
+
+
+def print_result(result: Result) -> None:
+    """Print a single result in a human readable form."""
+
+    case = " ".join(
+        str(value) for name, value in result.items() if name not in MEASUREMENTS
+    )
+    line = f"{case:40} {result['seconds'] * 1e3:12.3f} ms"
+
+    if "throughput" in result:
+        line += f" {result['throughput'] / 1024 ** 2:10.1f} MiB/s"
+
+    if "peak_memory" in result:
+        line += f" {result['peak_memory'] / 1024:12.1f} KiB peak"
+
+    print(line)
+
+
+def result_key(result: Result) -> str:
+    """Get a key identifying a benchmark case across runs."""
+
+    return "/".join(
+        f"{name}={result[name]}" for name in sorted(result) if name not in MEASUREMENTS
+    )
+
+
+def write_results(path: str, results: List[Result]) -> None:
+    """Write results with information about the environment to a JSON file."""
+
+    data = {
+        "encryptor": __version__,
+        "python": platform.python_version(),
+        "pycryptodome": Crypto.__version__,
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+    with open(path, "w", encoding="utf-8") as file_out:
+        json.dump(data, file_out, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Result]:
+    """Load results from a JSON file indexed by their keys."""
+
+    with open(path, encoding="utf-8") as file_in:
+        data = json.load(file_in)
+
+    return {result_key(result): result for result in data["results"]}
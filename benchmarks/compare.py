@@ -0,0 +1,52 @@
+"""Compare two benchmark results and report regressions.
+
+Run with `python -m benchmarks.compare old.json new.json`, the exit status is
+non-zero if any case got slower than the threshold allows.
+"""
+
+import sys
+from argparse import ArgumentParser
+from .common import load_results
+
+
+def main() -> None:
+    """Run the comparison."""
+
+    parser = ArgumentParser()
+    parser.add_argument("old", help="path of a JSON file with baseline results")
+    parser.add_argument("new", help="path of a JSON file with new results")
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        dest="threshold",
+        help="relative slowdown reported as a regression",
+        type=float,
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    old_results = load_results(args.old)
+    new_results = load_results(args.new)
+    regressions = 0
+
+    for key, new_result in new_results.items():
+        old_result = old_results.get(key)
+
+        if old_result is None:
+            print(f"{key:60} new")
+            continue
+
+        change = new_result["seconds"] / old_result["seconds"] - 1
+        regression = change > args.threshold
+        regressions += regression
+
+        print(f"{key:60} {change:+8.1%}{' REGRESSION' if regression else ''}")
+
+    for key in old_results.keys() - new_results.keys():
+        print(f"{key:60} missing")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Benchmark the encryption package without the GUI.
+
+Run with `python -m benchmarks.encryption -o results.json` and compare two runs
+with `python -m benchmarks.compare old.json new.json`.
+"""
+
+import os
+import tempfile
+from functools import partial
+from typing import Any, Callable, List, Tuple
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import (
+    create_keys,
+    export_public_key,
+    generate_key,
+    get_private_key,
+    get_public_key,
+    import_key,
+    KeyType,
+)
+from encryptor.encryption.mode import EncryptionMode
+from .common import (
+    measure,
+    new_parser,
+    parse_size,
+    peak_memory,
+    print_result,
+    Result,
+    write_results,
+)
+
+DEFAULT_SIZES = "16,256,4K,64K,1M,16M"
+
+
+def bench_modes(sizes: List[int], min_time: float, memory: bool) -> List[Result]:
+    """Measure throughput of `encrypt` and `decrypt` for every mode and size."""
+
+    results: List[Result] = []
+    privkey = generate_key(KeyType.RSA_2048)
+    pubkey = import_key(export_public_key(privkey))
+
+    for size in sizes:
+        data = os.urandom(size)
+
+        for mode in EncryptionMode:
+            ciphertext = crypto.encrypt(data, mode, pubkey)
+            cases: List[Tuple[str, Callable[[], Any]]] = [
+                ("encrypt", partial(crypto.encrypt, data, mode, pubkey)),
+                ("decrypt", partial(crypto.decrypt, ciphertext, mode, privkey)),
+            ]
+
+            for name, func in cases:
+                seconds = measure(func, min_time)
+                result: Result = {
+                    "name": name,
+                    "mode": str(mode),
+                    "size": size,
+                    "seconds": seconds,
+                    "throughput": size / seconds,
+                }
+
+                if memory:
+                    result["peak_memory"] = peak_memory(func)
+
+                results.append(result)
+                print_result(result)
+
+            del ciphertext
+
+    return results
+
+
+def bench_key_wrapping(min_time: float) -> List[Result]:
+    """Measure cost of wrapping and unwrapping a session key."""
+
+    results: List[Result] = []
+
+    for key_type in KeyType.available():
+        privkey = generate_key(key_type)
+        pubkey = import_key(export_public_key(privkey))
+        session_key = crypto.generate_session_key()
+        enc_session_key = crypto.wrap_key(session_key, pubkey)
+        cases: List[Tuple[str, Callable[[], Any]]] = [
+            ("wrap_key", partial(crypto.wrap_key, session_key, pubkey)),
+            ("unwrap_key", partial(crypto.unwrap_key, enc_session_key, privkey)),
+        ]
+
+        for name, func in cases:
+            result: Result = {
+                "name": name,
+                "key_type": str(key_type),
+                "seconds": measure(func, min_time),
+            }
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def bench_keys(min_time: float) -> List[Result]:
+    """Measure latency of creating keys and unlocking the private key."""
+
+    results: List[Result] = []
+
+    for key_type in KeyType.available():
+        with tempfile.TemporaryDirectory() as keys_dir:
+            cases: List[Tuple[str, Callable[[], Any]]] = [
+                ("create_keys", partial(_create_keys, keys_dir, key_type)),
+                ("get_private_key", partial(get_private_key, "passphrase", keys_dir)),
+                ("get_public_key", partial(get_public_key, keys_dir)),
+            ]
+
+            for name, func in cases:
+                result: Result = {
+                    "name": name,
+                    "key_type": str(key_type),
+                    "seconds": measure(func, min_time, repeat=1),
+                }
+                results.append(result)
+                print_result(result)
+
+    return results
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = new_parser(memory=True)
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        dest="sizes",
+        help="comma separated payload sizes, up to 1G",
+        default=DEFAULT_SIZES,
+    )
+    parser.add_argument(
+        "-t",
+        "--min-time",
+        dest="min_time",
+        help="minimum time in seconds spent on a single measurement",
+        type=float,
+        default=0.2,
+    )
+    args = parser.parse_args()
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    results = (
+        bench_modes(sizes, args.min_time, args.memory)
+        + bench_key_wrapping(args.min_time)
+        + bench_keys(args.min_time)
+    )
+
+    if args.output is not None:
+        write_results(args.output, results)
+
+
+def _create_keys(keys_dir: str, key_type: KeyType) -> None:
+    create_keys("passphrase", keys_dir, generate_key(key_type))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measure per-call overhead of encryption engines for small messages.
+
+Run with `python -m benchmarks.engines`.
+"""
+
+import timeit
+from argparse import ArgumentParser
+from functools import partial
+from typing import cast, Any, Dict
+from Crypto.Cipher import AES
+from Crypto.PublicKey import RSA
+from Crypto.Util.Padding import pad
+from encryptor.encryption import crypto
+from encryptor.encryption.mode import EncryptionMode
+
+
+def _eager_encrypt(data: bytes, key: bytes) -> bytes:
+    # Dispatch used before the engine registry, kept as a baseline.
+    ciphers: Dict[EncryptionMode, Any] = {
+        EncryptionMode.ECB: AES.new(key, AES.MODE_ECB),
+        EncryptionMode.CBC: AES.new(key, AES.MODE_CBC),
+        EncryptionMode.CFB: AES.new(key, AES.MODE_CFB),
+        EncryptionMode.OFB: AES.new(key, AES.MODE_OFB),
+    }
+    cipher_aes = ciphers[EncryptionMode.CBC]
+
+    return cast(bytes, cipher_aes.iv + cipher_aes.encrypt(pad(data, AES.block_size)))
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--count", dest="count", type=int, default=20000)
+    parser.add_argument("-s", "--size", dest="size", type=int, default=64)
+    args = parser.parse_args()
+
+    session_key = crypto.generate_session_key()
+    payload = b"x" * args.size
+
+    def report(name: str, seconds: float, count: int) -> None:
+        print(f"{name:40} {seconds / count * 1e6:10.2f} us/call")
+
+    report(
+        "eager dispatch (CBC)",
+        timeit.timeit(partial(_eager_encrypt, payload, session_key), number=args.count),
+        args.count,
+    )
+
+    for mode in EncryptionMode:
+        ciphertext = crypto.encrypt_with_key(payload, mode, session_key)
+        report(
+            f"encrypt_with_key ({mode})",
+            timeit.timeit(
+                partial(crypto.encrypt_with_key, payload, mode, session_key),
+                number=args.count,
+            ),
+            args.count,
+        )
+        report(
+            f"decrypt_with_key ({mode})",
+            timeit.timeit(
+                partial(crypto.decrypt_with_key, ciphertext, mode, session_key),
+                number=args.count,
+            ),
+            args.count,
+        )
+
+    key = RSA.generate(2048)
+    pubkey = key.publickey()
+    rsa_count = max(args.count // 100, 1)
+    enc_session_key = crypto.wrap_key(session_key, pubkey)
+    report(
+        "wrap_key",
+        timeit.timeit(lambda: crypto.wrap_key(session_key, pubkey), number=rsa_count),
+        rsa_count,
+    )
+    report(
+        "unwrap_key",
+        timeit.timeit(
+            lambda: crypto.unwrap_key(enc_session_key, key), number=rsa_count
+        ),
+        rsa_count,
+    )
+
+
+if __name__ == "__main__":
+    main()
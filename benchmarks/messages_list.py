@@ -0,0 +1,146 @@
+"""Benchmark the list of received messages with very large histories.
+
+Run with `python -m benchmarks.messages_list -o results.json`. Messages arrive in
+batches like from the network thread, events are processed after every batch.
+"""
+
+import os
+import sys
+import time
+from functools import partial
+from typing import List, Tuple, TYPE_CHECKING
+from encryptor.constants import UI_BATCH_SIZE
+from encryptor.network.connection import Address, Peer
+from encryptor.network.message import ContentType, Message
+from .common import (
+    measure,
+    new_parser,
+    peak_memory,
+    print_result,
+    Result,
+    write_results,
+)
+
+# Qt is imported once the platform plugin is chosen.
+if TYPE_CHECKING:
+    from PyQt5.QtCore import QCoreApplication
+    from encryptor.widgets.messages_list import MessagesList
+
+# Batches at the end of a history averaged for time of a single batch.
+TAIL_BATCHES = 10
+
+
+def bench_history(counts: List[int], memory: bool) -> List[Result]:
+    """Measure filling the list with histories of given lengths and painting it."""
+
+    # pylint: disable=import-outside-toplevel
+    from PyQt5.QtWidgets import QApplication
+
+    qt_app = QApplication.instance() or QApplication(sys.argv)
+    results: List[Result] = []
+
+    for count in counts:
+        batches = _batches(count)
+        messages_list = _new_list()
+        start = time.perf_counter()
+        tail_start = _fill(qt_app, messages_list, batches)
+        end = time.perf_counter()
+        viewport = messages_list.viewport()
+        assert viewport is not None
+        case: Result = {"name": "history", "messages": count}
+        case_results: List[Result] = [
+            {**case, "case": "fill", "seconds": end - start},
+            {
+                **case,
+                "case": "batch",
+                "seconds": (end - tail_start) / min(TAIL_BATCHES, len(batches)),
+            },
+            {**case, "case": "paint", "seconds": measure(viewport.repaint)},
+        ]
+        messages_list.close()
+
+        if memory:
+            messages_list = _new_list()
+            case_results[0]["peak_memory"] = peak_memory(
+                partial(_fill, qt_app, messages_list, batches)
+            )
+            messages_list.close()
+
+        for result in case_results:
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = new_parser(memory=True, qt_platform=True)
+    parser.add_argument(
+        "-n",
+        "--messages",
+        dest="counts",
+        help="comma separated numbers of messages in a history",
+        type=lambda counts: [int(count) for count in counts.split(",")],
+        default=[1000, 10000, 100000],
+    )
+    args = parser.parse_args()
+
+    os.environ["QT_QPA_PLATFORM"] = args.platform
+    results = bench_history(args.counts, args.memory)
+
+    if args.output is not None:
+        write_results(args.output, results)
+
+
+def _new_list() -> "MessagesList":
+    # pylint: disable=import-outside-toplevel
+    from encryptor.widgets.messages_list import MessagesList
+
+    messages_list = MessagesList()
+    messages_list.resize(640, 480)
+    messages_list.show()
+
+    return messages_list
+
+
+def _fill(
+    qt_app: "QCoreApplication",
+    messages_list: "MessagesList",
+    batches: List[List[Tuple[Peer, Message]]],
+) -> float:
+    # Returns the time the tail batches started to arrive at.
+    tail_start = time.perf_counter()
+
+    for number, batch in enumerate(batches):
+        if number == max(len(batches) - TAIL_BATCHES, 0):
+            tail_start = time.perf_counter()
+
+        messages_list.new_messages(batch)
+        qt_app.processEvents()
+
+    return tail_start
+
+
+def _batches(count: int) -> List[List[Tuple[Peer, Message]]]:
+    peer = Peer(0, Address("127.0.0.1", 0))
+    messages = []
+
+    for number in range(count):
+        message = Message.of(f"Message {number}".encode("utf-8"), ContentType.BINARY)
+
+        # Every other message waits to be decrypted, its content is never read.
+        if number % 2:
+            message.headers.session_key_id = 0
+
+        messages.append((peer, message))
+
+    return [
+        messages[start : start + UI_BATCH_SIZE]
+        for start in range(0, count, UI_BATCH_SIZE)
+    ]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Benchmark sending messages over a TCP loopback connection.
+
+Run with `python -m benchmarks.network -o results.json` and compare two runs with
+`python -m benchmarks.compare old.json new.json`.
+"""
+
+import contextlib
+import os
+import socket
+import threading
+import time
+from functools import partial
+from typing import Callable, List, Tuple
+from encryptor.constants import SEND_COALESCE_WINDOW
+from encryptor.encryption.keys import export_public_key, generate_key, Key
+from encryptor.network.message import ContentType, Message, MessageWriter
+from .common import new_parser, parse_size, print_result, Result, write_results
+
+# Workloads as a name, a size of a single message and a number of messages.
+WORKLOADS = [("small", 64, 20000), ("bulk", 16 * 1024**2, 8)]
+
+
+def bench_send(version: int, repeat: int) -> List[Result]:
+    """Measure throughput of sending frames for every workload and send path."""
+
+    results: List[Result] = []
+    pubkey = generate_key()
+
+    for workload, size, count in WORKLOADS:
+        message = Message.of(os.urandom(size), ContentType.BINARY)
+        total = len(message.to_bytes(version)) * count
+        cases: List[Tuple[str, Callable[[socket.socket], None]]] = [
+            (
+                "sendall",
+                partial(_sendall, message=message, count=count, version=version),
+            ),
+            (
+                "sendmsg",
+                partial(
+                    _write,
+                    message=message,
+                    count=count,
+                    version=version,
+                    pubkey=pubkey,
+                    coalesce_window=0,
+                ),
+            ),
+            (
+                "coalesce",
+                partial(
+                    _write,
+                    message=message,
+                    count=count,
+                    version=version,
+                    pubkey=pubkey,
+                    coalesce_window=SEND_COALESCE_WINDOW,
+                ),
+            ),
+        ]
+
+        for name, send in cases:
+            seconds = min(_measure(send) for _ in range(repeat))
+            result: Result = {
+                "name": name,
+                "workload": workload,
+                "size": size,
+                "count": count,
+                "version": version,
+                "seconds": seconds,
+                "throughput": total / seconds,
+            }
+            results.append(result)
+            print_result(result)
+
+    return results
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = new_parser(repeat=3)
+    parser.add_argument(
+        "-p",
+        "--protocol",
+        dest="version",
+        help="version of the protocol used to encode frames",
+        type=int,
+        choices=(1, 2),
+        default=2,
+    )
+    parser.add_argument(
+        "-s",
+        "--small-count",
+        dest="small_count",
+        help="number of messages sent in the small workload",
+        type=parse_size,
+        default=WORKLOADS[0][2],
+    )
+    args = parser.parse_args()
+
+    WORKLOADS[0] = (*WORKLOADS[0][:2], args.small_count)
+    results = bench_send(args.version, args.repeat)
+
+    if args.output is not None:
+        write_results(args.output, results)
+
+
+def _sendall(
+    sock: socket.socket, *, message: Message, count: int, version: int
+) -> None:
+    # The send path used before scatter/gather I/O, logging like `MessageWriter`.
+    for _ in range(count):
+        print(f"Sending a message {message} to {sock.getpeername()}")
+        sock.sendall(message.to_bytes(version))
+
+    sock.close()
+
+
+def _write(  # pylint: disable=too-many-arguments
+    sock: socket.socket,
+    *,
+    message: Message,
+    count: int,
+    version: int,
+    pubkey: Key,
+    coalesce_window: float,
+) -> None:
+    writer = MessageWriter(sock, coalesce_window=coalesce_window)
+    writer.protocol_version = version
+    writer.write_pubkey(export_public_key(pubkey))
+    writer.update_endpoint_pubkey(pubkey)
+
+    for _ in range(count):
+        writer.write(message)
+
+    writer.close()
+
+
+def _measure(send: Callable[[socket.socket], None]) -> float:
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+
+    receiver = threading.Thread(target=_drain, args=(conn,))
+    receiver.start()
+
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(
+        devnull
+    ):
+        start = time.perf_counter()
+        send(client)
+        receiver.join()
+
+    return time.perf_counter() - start
+
+
+def _drain(sock: socket.socket) -> None:
+    buffer = bytearray(1024**2)
+
+    with sock:
+        while sock.recv_into(buffer):
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Compare per-message RSA wrapping with session keys.
+
+Run with `python -m benchmarks.session`.
+"""
+
+import time
+from argparse import ArgumentParser
+from functools import partial
+from typing import Any, Callable
+from Crypto.PublicKey import RSA
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import Key
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.encryption.session import DecryptionSession, EncryptionSession
+
+
+def _measure(count: int, func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+
+    for _ in range(count):
+        func()
+
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = ArgumentParser()
+    parser.add_argument("-n", "--count", dest="count", type=int, default=200)
+    parser.add_argument("-s", "--size", dest="size", type=int, default=256)
+    args = parser.parse_args()
+
+    key = RSA.generate(2048)
+    pubkey = key.publickey()
+    payload = b"x" * args.size
+
+    for mode in EncryptionMode:
+        per_message = _measure(
+            args.count, partial(_per_message, payload, mode, pubkey, key)
+        )
+
+        enc_session = EncryptionSession(pubkey)
+        dec_session = DecryptionSession()
+        dec_session.add_key(*enc_session.rekey())
+        session = _measure(
+            args.count,
+            partial(_session, enc_session, dec_session, payload, mode, key),
+        )
+
+        print(
+            f"{str(mode):17} per-message RSA {per_message:10.1f} msg/s, "
+            f"session key {session:10.1f} msg/s ({session / per_message:.1f}x)"
+        )
+
+
+def _per_message(payload: bytes, mode: EncryptionMode, pubkey: Key, key: Key) -> None:
+    crypto.decrypt(crypto.encrypt(payload, mode, pubkey), mode, key)
+
+
+def _session(
+    enc_session: EncryptionSession,
+    dec_session: DecryptionSession,
+    payload: bytes,
+    mode: EncryptionMode,
+    key: Key,
+) -> None:
+    dec_session.decrypt(
+        enc_session.key_id, enc_session.encrypt(payload, mode), mode, key
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark startup of the application.
+
+Run with `python -m benchmarks.startup -o results.json`. Every case runs in a fresh
+interpreter, so nothing is imported or cached by the benchmark itself.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+from encryptor.encryption.keys import create_keys, generate_key
+from .common import new_parser, print_result, Result, write_results
+
+# Modules imported by `python -m encryptor` with and without a command.
+MODULES = ["encryptor.app", "encryptor.cli"]
+# Prints a line once the first frame of the window is painted and once it's started.
+_CHILD = """
+import sys
+from PyQt5.QtCore import QEvent, QObject, QTimer
+from PyQt5.QtWidgets import QApplication
+from encryptor import app
+
+class FirstFrame(QObject):
+    def eventFilter(self, obj, event):
+        if isinstance(obj, app.MainWindow) and event.type() == QEvent.UpdateRequest:
+            qt_app.removeEventFilter(self)
+            QTimer.singleShot(0, lambda: print("frame", flush=True))
+        return False
+
+qt_app = QApplication(sys.argv)
+first_frame = FirstFrame()
+qt_app.installEventFilter(first_frame)
+window = app.MainWindow(0, sys.argv[1])
+window.started.connect(lambda: print("started", flush=True))
+window.started.connect(window.close)
+qt_app.exec_()
+"""
+
+
+def bench_imports(repeat: int, top: int) -> List[Result]:
+    """Measure cumulative import time of entry modules, print the slowest imports."""
+
+    results: List[Result] = []
+
+    for module in MODULES:
+        timings: List[Tuple[int, int, str]] = []
+        seconds = float("inf")
+
+        for _ in range(repeat):
+            timings = _import_times(module)
+            seconds = min(seconds, next(c for _, c, name in timings if name == module))
+
+        result: Result = {"name": "import", "module": module, "seconds": seconds / 1e6}
+        results.append(result)
+        print_result(result)
+
+        for self_time, cumulative, name in sorted(timings, reverse=True)[:top]:
+            print(f"  {name:38} {self_time / 1e3:12.3f} ms {cumulative / 1e3:10.3f} ms")
+
+    return results
+
+
+def bench_first_frame(repeat: int, platform: str) -> List[Result]:
+    """Measure time from starting the interpreter to the first frame of the window."""
+
+    env = dict(os.environ, QT_QPA_PLATFORM=platform)
+    times = {"frame": float("inf"), "started": float("inf")}
+
+    with tempfile.TemporaryDirectory() as keys_dir:
+        create_keys("benchmark", keys_dir, generate_key())
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+
+            with subprocess.Popen(
+                [sys.executable, "-c", _CHILD, keys_dir],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                env=env,
+                text=True,
+            ) as child:
+                assert child.stdout is not None
+
+                for line in child.stdout:
+                    event = line.strip()
+                    times[event] = min(times[event], time.perf_counter() - start)
+
+            if child.returncode != 0:
+                raise RuntimeError(f"Application exited with {child.returncode}")
+
+    results: List[Result] = [
+        {"name": "first_frame", "platform": platform, "seconds": times["frame"]},
+        {"name": "started", "platform": platform, "seconds": times["started"]},
+    ]
+
+    for result in results:
+        print_result(result)
+
+    return results
+
+
+def main() -> None:
+    """Run the benchmark."""
+
+    parser = new_parser(repeat=5, qt_platform=True)
+    parser.add_argument(
+        "-t",
+        "--top",
+        dest="top",
+        help="number of the slowest imports printed for every module",
+        type=int,
+        default=10,
+    )
+    args = parser.parse_args()
+
+    results = bench_imports(args.repeat, args.top)
+    results += bench_first_frame(args.repeat, args.platform)
+
+    if args.output is not None:
+        write_results(args.output, results)
+
+
+def _import_times(module: str) -> List[Tuple[int, int, str]]:
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    timings: List[Tuple[int, int, str]] = []
+
+    # Lines look like `import time:   1234 |   5678 |   package.module`, in us.
+    for line in process.stderr.splitlines()[1:]:
+        self_time, cumulative, name = line.split(":", 1)[1].split("|")
+        timings.append((int(self_time), int(cumulative), name.strip()))
+
+    return timings
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 import os
+import sys
 from argparse import ArgumentParser
-from encryptor import app
+from encryptor import log, tracing
+from encryptor.constants import DEFAULT_SERVER_PORT, KEY_AGENT_TTL, LOG_ENV
+from encryptor.encryption.keys import KeyType
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.network.connection import Address
 
 parser = ArgumentParser()
 
@@ -10,7 +15,134 @@ parser.add_argument(
 parser.add_argument(
     "-d", "--dir", dest="directory", help="directory with keys", type=str
 )
+parser.add_argument(
+    "-t",
+    "--key-ttl",
+    dest="key_ttl",
+    help="seconds an unlocked private key is kept in memory without use",
+    type=float,
+    default=KEY_AGENT_TTL,
+)
+parser.add_argument(
+    "--log",
+    dest="log_levels",
+    help=(
+        f"levels of logs like info,encryptor.network.aio=debug, read from {LOG_ENV} "
+        "by default"
+    ),
+    type=log.parse_levels,
+    default=os.environ.get(LOG_ENV, ""),
+)
+parser.add_argument(
+    "--trace",
+    dest="trace",
+    help="file a trace of messages is written to in the Chrome trace event format",
+)
+parser.add_argument(
+    "--profile",
+    dest="profile",
+    help="file stats of profiling the whole session with cProfile are written to",
+)
+parser.add_argument(
+    "--key-pool",
+    dest="key_pool_size",
+    help="number of keys of each type pre-generated in the background",
+    type=int,
+    default=0,
+)
+
+# Commands run without the GUI and never import PyQt5.
+commands = parser.add_subparsers(dest="command", metavar="command")
+
+keygen_parser = commands.add_parser("keygen", help="generate keys of a user")
+keygen_parser.add_argument(
+    "-k",
+    "--key-type",
+    dest="key_type",
+    help="type of generated keys",
+    type=KeyType,
+    choices=KeyType.available(),
+    default=KeyType.RSA_2048,
+)
+keygen_parser.add_argument(
+    "-f", "--force", dest="force", help="replace existing keys", action="store_true"
+)
+
+serve_parser = commands.add_parser(
+    "serve", help="receive messages and write them to stdout"
+)
+serve_parser.add_argument(
+    "--host", dest="host", help="host the server listens on", default="127.0.0.1"
+)
+serve_parser.add_argument(
+    "-o",
+    "--output",
+    dest="output",
+    help="directory messages are written to as files, instead of stdout",
+)
+serve_parser.add_argument(
+    "--metrics-port",
+    dest="metrics_port",
+    help="port of an HTTP endpoint with metrics in the Prometheus text format",
+    type=int,
+)
+
+send_parser = commands.add_parser("send", help="send a file or stdin to a server")
+send_parser.add_argument(
+    "address",
+    help="address of the server",
+    type=lambda addr: Address.from_str(addr, DEFAULT_SERVER_PORT),
+)
+send_parser.add_argument(
+    "-i", "--input", dest="input", help="file to send, stdin by default"
+)
+send_parser.add_argument(
+    "-m",
+    "--mode",
+    dest="mode",
+    help="encryption mode",
+    type=EncryptionMode,
+    choices=list(EncryptionMode),
+    default=EncryptionMode.GCM,
+)
+send_parser.add_argument(
+    "-l",
+    "--lines",
+    dest="lines",
+    help="send every line as a separate message",
+    action="store_true",
+)
+send_parser.add_argument(
+    "--host",
+    dest="host",
+    help="host the server connects back to with its pubkey",
+    default="127.0.0.1",
+)
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    app.run(args.port, os.path.abspath(args.directory or "."))
+    args.directory = os.path.abspath(args.directory or ".")
+    log.configure(args.log_levels)
+
+    if args.profile is not None:
+        tracing.start_profile(args.profile)
+
+    if args.trace is not None:
+        tracing.start(args.trace)
+
+    if args.command is not None:
+        from encryptor import cli
+
+        if args.port is None:
+            args.port = DEFAULT_SERVER_PORT if args.command == "serve" else 0
+
+        sys.exit(cli.run(args))
+
+    from encryptor import app
+
+    app.run(
+        args.port,
+        args.directory,
+        args.key_ttl,
+        args.key_pool_size,
+    )
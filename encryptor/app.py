@@ -1,64 +1,128 @@
+import os
 import sys
-from typing import Optional
+from typing import List, Optional, TYPE_CHECKING
 from PyQt5.QtGui import QCloseEvent
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QHBoxLayout
-from PyQt5.QtCore import QSize, QThread
+from PyQt5.QtWidgets import (
+    QApplication,
+    QMainWindow,
+    QMessageBox,
+    QWidget,
+    QHBoxLayout,
+)
+from PyQt5.QtCore import QEvent, QSize, QThread, QTimer, pyqtSignal, pyqtSlot
+from encryptor.constants import DOWNLOADS_DIR, KEY_AGENT_TTL
+from encryptor.encryption.agent import KeyAgent
+from encryptor.encryption.key_pool import KeyPool
+from encryptor.encryption.known_peers import KnownPeers
 from encryptor.encryption.mode import EncryptionMode
-from encryptor.encryption.keys import keys_exist, create_keys, get_public_key
+from encryptor.encryption.keys import keys_exist, get_public_key, Key, KeyType
 from encryptor.widgets.menu_bar import MenuBar
 from encryptor.widgets.status_bar import StatusBar
 from encryptor.widgets.send_box import SendBox
-from encryptor.widgets.auth_dialogs import NewKeysDialog
+from encryptor.widgets.auth_dialogs import AuthDialog, NewKeysDialog
+from encryptor.widgets.key_generation_dialog import KeyGenerationDialog
 from encryptor.widgets.messages_list import MessagesList
 from encryptor.network.connection import Address
-from encryptor.network.client_thread import ClientWorker
-from encryptor.network.server_thread import ServerThread
 
+# The network stack and ciphers are imported once the window is on the screen.
+if TYPE_CHECKING:
+    from encryptor.decryption_worker import DecryptionWorker
+    from encryptor.network.client_thread import ClientWorker
+    from encryptor.network.message import Message
+    from encryptor.network.server_thread import ServerThread
+    from encryptor.network.transfer import IncomingTransfer
 
-class MainWindow(QMainWindow):
-    """Main window of the application."""
 
-    def __init__(self, port: int, keys_dir: str) -> None:
+class MainWindow(QMainWindow):  # pylint: disable=too-many-instance-attributes
+    """Main window of the application.
+
+    Only widgets are created before the window is shown. The network stack is
+    imported, the pubkey is loaded and the server is started after the first frame is
+    painted, and `started` is emitted then.
+    """
+
+    decryption = pyqtSignal(list, object)
+    file_decryption = pyqtSignal(object, object)
+    pubkey_change = pyqtSignal(object)
+    started = pyqtSignal()
+
+    def __init__(
+        self,
+        port: int,
+        keys_dir: str,
+        key_ttl: float = KEY_AGENT_TTL,
+        key_pool_size: int = 0,
+    ) -> None:
+        # Events are delivered from within the constructor of the window.
+        self._start_pending = True
+
         super().__init__()
 
-        self._server_thread = ServerThread(Address("127.0.0.1", port))
-        self._client_thread = QThread()
-        self._client_worker = ClientWorker(
-            Address("127.0.0.1", port), EncryptionMode.ECB, get_public_key(keys_dir)
+        self._addr = Address("127.0.0.1", port)
+        self._keys_dir = keys_dir
+        self._key_agent = KeyAgent(key_ttl)
+        self._key_agent_timer = QTimer(self)
+        self._key_pool = (
+            KeyPool(key_pool_size, KeyType.available()) if key_pool_size > 0 else None
         )
+        self._generation_dialog: Optional[KeyGenerationDialog] = None
+        self._known_peers: Optional[KnownPeers] = None
+        self._server_thread: Optional["ServerThread"] = None
+        self._client_thread = QThread()
+        self._client_worker: Optional["ClientWorker"] = None
+        self._decryption_thread = QThread()
+        self._decryption_worker: Optional["DecryptionWorker"] = None
 
         self._init_gui()
-        self._init_client()
-        self._init_server()
+        self._init_key_agent()
         self.show()
 
-    def closeEvent(self, event: QCloseEvent) -> None:
+    def event(self, event: Optional[QEvent]) -> bool:
+        """Handle an event, start the application after the first frame."""
+
+        handled = super().event(event)
+
+        # The window is painted and flushed by the time its update request returns.
+        if (
+            self._start_pending
+            and event is not None
+            and event.type() == QEvent.Type.UpdateRequest
+        ):
+            self._start_pending = False
+            QTimer.singleShot(0, self._start)
+
+        return handled
+
+    def closeEvent(self, event: Optional[QCloseEvent]) -> None:
         """Handle close event."""
 
-        self._server_thread.quit()
+        if self._server_thread is not None:
+            self._server_thread.stop()
+
         self._client_thread.quit()
-        event.accept()
+        self._decryption_thread.quit()
+        self._key_agent.wipe()
+
+        if self._key_pool is not None:
+            self._key_pool.stop()
+
+        if event is not None:
+            event.accept()
 
     def _init_gui(self) -> None:
         self._menu_bar = MenuBar()
-        self._status_bar = StatusBar(self._server_thread.addr)
+        self._status_bar = StatusBar(self._addr)
         self._send_box = SendBox()
         self._messages_list = MessagesList()
         central_widget = QWidget()
         central_layout = QHBoxLayout()
 
-        self._menu_bar.connection.connect(self._client_worker.connect)
-        self._menu_bar.disconnection.connect(self._client_worker.disconnect)
-        self._status_bar.mode_change.connect(self._client_worker.change_mode)
-        self._send_box.send.connect(self._client_worker.send_message)
-        self._client_worker.connection.connect(self._status_bar.update_server_addr)
-        self._client_worker.disconnection.connect(
-            lambda: self._status_bar.update_server_addr(None)
-        )
-        self._server_thread.handshake.connect(self._client_worker.handshake)
-        self._server_thread.pubkey.connect(self._client_worker.rec_pubkey)
-        self._server_thread.disconnect.connect(self._client_worker.disconnect)
-        self._server_thread.new_message.connect(self._messages_list.new_message)
+        self._menu_bar.decrypt_all.connect(self._messages_list.decrypt_all)
+        self._menu_bar.lock_keys.connect(self._key_agent.wipe)
+        self._menu_bar.new_keys.connect(self._generate_keys)
+        self._messages_list.decrypt.connect(lambda message: self._decrypt([message]))
+        self._messages_list.decrypt_many.connect(self._decrypt)
+        self._messages_list.decrypt_file.connect(self._decrypt_file)
 
         central_widget.setLayout(central_layout)
         central_layout.addWidget(self._send_box)
@@ -69,15 +133,144 @@ class MainWindow(QMainWindow):
         self.setStatusBar(self._status_bar)
         self.setCentralWidget(central_widget)
 
-    def _init_client(self) -> None:
-        self._client_worker.moveToThread(self._client_thread)
+    @pyqtSlot()
+    def _start(self) -> None:
+        # pylint: disable=import-outside-toplevel
+        from encryptor.decryption_worker import DecryptionWorker
+        from encryptor.network.client_thread import ClientWorker
+        from encryptor.network.server_thread import ServerThread
+
+        known_peers = KnownPeers(self._keys_dir)
+        server_thread = ServerThread(
+            self._addr, known_peers, os.path.join(self._keys_dir, DOWNLOADS_DIR)
+        )
+        client_worker = ClientWorker(
+            self._addr,
+            EncryptionMode.ECB,
+            get_public_key(self._keys_dir),
+            known_peers,
+            server_thread.loop,
+        )
+        decryption_worker = DecryptionWorker()
+        self._known_peers = known_peers
+        self._server_thread = server_thread
+        self._client_worker = client_worker
+        self._decryption_worker = decryption_worker
+
+        self._init_network(server_thread, client_worker)
+        self._init_client(client_worker)
+        self._init_decryption(decryption_worker)
+        server_thread.start()
+
+        if self._key_pool is not None:
+            self._key_pool.start()
+
+        self.started.emit()
+
+    def _init_network(
+        self, server_thread: "ServerThread", client_worker: "ClientWorker"
+    ) -> None:
+        self._menu_bar.connection.connect(client_worker.connect)
+        self._menu_bar.disconnection.connect(client_worker.disconnect)
+        self._status_bar.mode_change.connect(client_worker.change_mode)
+        self._send_box.send.connect(client_worker.send_message)
+        self._send_box.send_file.connect(client_worker.send_file)
+        client_worker.connection.connect(self._status_bar.update_server_addr)
+        client_worker.disconnection.connect(
+            lambda: self._status_bar.update_server_addr(None)
+        )
+        client_worker.reconnecting.connect(self._status_bar.show_reconnecting)
+        server_thread.handshake.connect(client_worker.handshake)
+        server_thread.pubkey.connect(client_worker.rec_pubkey)
+        server_thread.disconnect.connect(client_worker.peer_disconnect)
+        server_thread.new_messages.connect(self._messages_list.new_messages)
+        server_thread.file_progress.connect(self._messages_list.file_progress)
+        server_thread.file_progress.connect(client_worker.ack_file)
+        server_thread.file_ack.connect(client_worker.file_ack)
+        self.pubkey_change.connect(client_worker.change_pubkey)
+
+    def _init_client(self, client_worker: "ClientWorker") -> None:
+        client_worker.moveToThread(self._client_thread)
         self._client_thread.start()
 
-    def _init_server(self) -> None:
-        self._server_thread.start()
+    def _init_decryption(self, decryption_worker: "DecryptionWorker") -> None:
+        self.decryption.connect(decryption_worker.decrypt)
+        self.file_decryption.connect(decryption_worker.decrypt_file)
+        decryption_worker.decrypted.connect(self._messages_list.show_decrypted)
+        decryption_worker.file_decrypted.connect(
+            self._messages_list.show_decrypted_file
+        )
+        decryption_worker.failed.connect(self._messages_list.show_failed)
+        decryption_worker.file_failed.connect(self._messages_list.show_failed_file)
+        decryption_worker.moveToThread(self._decryption_thread)
+        self._decryption_thread.start()
+
+    def _init_key_agent(self) -> None:
+        self._key_agent_timer.timeout.connect(self._key_agent.evict_expired)
+        self._key_agent_timer.start(int(max(min(self._key_agent.ttl, 60), 1) * 1000))
+
+    @pyqtSlot(list)
+    def _decrypt(self, messages: List["Message"]) -> None:
+        privkey = self._get_privkey()
+
+        if privkey is not None:
+            self.decryption.emit(messages, privkey)
+
+    @pyqtSlot(object)
+    def _decrypt_file(self, transfer: "IncomingTransfer") -> None:
+        privkey = self._get_privkey()
+
+        if privkey is not None:
+            self.file_decryption.emit(transfer, privkey)
+
+    def _get_privkey(self) -> Optional[Key]:
+        privkey = self._key_agent.get(self._keys_dir)
+
+        if privkey is None:
+            dialog = AuthDialog()
 
+            if not dialog.exec_():
+                return None
 
-def run(port: int, keys_dir: str) -> None:
+            try:
+                privkey = self._key_agent.unlock(
+                    dialog.passphrase.text(), self._keys_dir
+                )
+            except ValueError:
+                QMessageBox.warning(self, "Decryption", "Invalid passphrase")
+
+        return privkey
+
+    @pyqtSlot()
+    def _generate_keys(self) -> None:
+        dialog = NewKeysDialog(
+            "Enter a passphrase of your new private key. Messages received so far "
+            "will no longer be decryptable"
+        )
+
+        if dialog.exec_() and dialog.passphrase.text() != "":
+            generation_dialog = KeyGenerationDialog(self._key_pool)
+
+            generation_dialog.generated.connect(self._change_keys)
+            generation_dialog.failed.connect(self._keys_failed)
+            generation_dialog.start(
+                dialog.passphrase.text(), self._keys_dir, dialog.key_type
+            )
+            self._generation_dialog = generation_dialog
+
+    @pyqtSlot(object)
+    def _change_keys(self, pubkey: object) -> None:
+        self._key_agent.lock(self._keys_dir)
+        self.pubkey_change.emit(pubkey)
+
+    @pyqtSlot(str)
+    def _keys_failed(self, error: str) -> None:
+        QMessageBox.critical(self, "Keys", error)
+
+
+def run(
+    port: int, keys_dir: str, key_ttl: float = KEY_AGENT_TTL, key_pool_size: int = 0
+) -> None:
     """Run the application."""
 
     qt_app = QApplication(sys.argv)
@@ -89,12 +282,24 @@ def run(port: int, keys_dir: str) -> None:
             passphrase = dialog.passphrase.text()
 
             if passphrase != "":
-                create_keys(passphrase, keys_dir)
+                windows: List[MainWindow] = []
+                generation_dialog = KeyGenerationDialog()
+
+                # Without keys there is no window to open, so the application exits.
+                def failed(error: str) -> None:
+                    QMessageBox.critical(None, "Keys", error)
+                    qt_app.exit(1)
 
-                window = MainWindow(port, keys_dir)
+                generation_dialog.generated.connect(
+                    lambda _: windows.append(
+                        MainWindow(port, keys_dir, key_ttl, key_pool_size)
+                    )
+                )
+                generation_dialog.failed.connect(failed)
+                generation_dialog.start(passphrase, keys_dir, dialog.key_type)
 
                 sys.exit(qt_app.exec_())
     else:
-        window = MainWindow(port, keys_dir)
+        window = MainWindow(port, keys_dir, key_ttl, key_pool_size)
 
         sys.exit(qt_app.exec_())
@@ -0,0 +1,413 @@
+import asyncio
+import contextlib
+import getpass
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import uuid
+from argparse import Namespace
+from typing import (
+    cast,
+    Any,
+    BinaryIO,
+    Coroutine,
+    Dict,
+    Iterator,
+    Optional,
+    Set,
+    Tuple,
+)
+from encryptor import log, metrics
+from encryptor.compression import available_codecs, negotiate
+from encryptor.constants import HANDSHAKE_TIMEOUT, MAX_MESSAGE_SIZE, PASSWORD_ENV
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import (
+    create_keys,
+    export_public_key,
+    fingerprint,
+    generate_key,
+    get_private_key,
+    get_public_key,
+    keys_exist,
+    Key,
+    KeyType,
+)
+from encryptor.encryption.known_peers import KnownPeers
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.network.aio import AsyncClient, AsyncServer, ClientHandler, ServerHandler
+from encryptor.network.connection import Address, Peer
+from encryptor.network.exceptions import ConnectionClosed
+from encryptor.network.message import (
+    pubkey_from_message,
+    ContentType,
+    Handshake,
+    JSONContentType,
+    JSONMessageContent,
+    Message,
+    MessageReader,
+    MessageWriter,
+)
+
+# Commands write their results to the real stdout, their messages are printed to
+# stderr like logs, so the output can be piped.
+_STDOUT = sys.stdout
+_logger = log.get_logger(__name__)
+
+
+def keygen(keys_dir: str, key_type: KeyType, force: bool = False) -> int:
+    """Generate keys of a user protected with a password."""
+
+    if keys_exist(keys_dir) and not force:
+        print(f"Keys already exist in {keys_dir}, use --force to replace them")
+
+        return 1
+
+    create_keys(read_password(confirm=True), keys_dir, generate_key(key_type))
+    print(f"Created {key_type} keys in {keys_dir}")
+    _STDOUT.write(fingerprint(get_public_key(keys_dir)) + "\n")
+
+    return 0
+
+
+def serve(
+    addr: Address,
+    keys_dir: str,
+    output_dir: Optional[str] = None,
+    metrics_addr: Optional[Address] = None,
+) -> int:
+    """Receive messages from peers until interrupted.
+
+    Decrypted messages are written to stdout, one per line, or to files in the output
+    directory. All peers are served by an `AsyncServer` on a single event loop.
+    Metrics are served in the Prometheus text format at `/metrics` of `metrics_addr`,
+    if it is given.
+    """
+
+    privkey = get_private_key(read_password(), keys_dir)
+    daemon = _Daemon(addr, privkey, KnownPeers(keys_dir), output_dir)
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    if metrics_addr is not None:
+        metrics_server = metrics.start_server(metrics_addr)
+        print(f"Serving metrics at {metrics_addr.host}:{metrics_server.server_port}")
+
+    try:
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+def send(  # pylint: disable=too-many-arguments
+    addr: Address,
+    keys_dir: str,
+    source: BinaryIO,
+    mode: EncryptionMode,
+    *,
+    lines: bool = False,
+    ret_addr: Address = Address("127.0.0.1", 0),
+) -> int:
+    """Send content of a file to a server, as a single message or line by line.
+
+    The server's pubkey arrives over a connection it opens to `ret_addr`, a port is
+    picked if none is given. Without keys in the directory an ephemeral key is used.
+    A single message is encrypted and sent a fragment at a time, content of a pipe is
+    spooled to a temporary file first, as the length of a message is sent upfront.
+    """
+
+    pubkey = (
+        get_public_key(keys_dir)
+        if keys_exist(keys_dir)
+        else generate_key(KeyType.available()[-1])
+    )
+    known_peers = KnownPeers(keys_dir)
+
+    with _message_content(source, lines, mode) as content, socket.create_server(
+        (ret_addr.host, ret_addr.port)
+    ) as listener:
+        ret_addr = Address(ret_addr.host, listener.getsockname()[1])
+        writer = MessageWriter(socket.create_connection((addr.host, addr.port)))
+
+        try:
+            writer.write_handshake(Handshake(ret_addr, None, available_codecs()))
+            listener.settimeout(HANDSHAKE_TIMEOUT)
+            sock = listener.accept()[0]
+            reader = MessageReader(sock)
+
+            try:
+                sock.settimeout(HANDSHAKE_TIMEOUT)
+                handshake = reader.read_handshake()
+                _accept_handshake(writer, handshake, handshake.protocol_version, pubkey)
+                endpoint_pubkey = _read_pubkey(reader, known_peers)
+                known_peers.remember(str(addr), endpoint_pubkey)
+                writer.update_endpoint_pubkey(endpoint_pubkey)
+
+                _write_content(writer, source, content, mode)
+                writer.write_goodbye()
+                writer.close()
+                # The server replies with a goodbye once it reads ours, so it does not
+                # take the connection we close for a lost one.
+                _wait_goodbye(reader)
+            finally:
+                reader.close()
+        finally:
+            writer.close()
+
+    return 0
+
+
+def read_password(confirm: bool = False) -> str:
+    """Read a password of keys from the environment or the terminal."""
+
+    password = os.environ.get(PASSWORD_ENV)
+
+    if password is not None:
+        return password
+
+    password = getpass.getpass("Password: ")
+
+    if confirm and getpass.getpass("Repeat password: ") != password:
+        raise ValueError("Passwords do not match")
+
+    return password
+
+
+def run(args: Namespace) -> int:
+    """Run a command parsed from the command line, return its exit status."""
+
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            if args.command == "keygen":
+                return keygen(args.directory, args.key_type, args.force)
+
+            if args.command == "serve":
+                return serve(
+                    Address(args.host, args.port),
+                    args.directory,
+                    args.output,
+                    (
+                        Address(args.host, args.metrics_port)
+                        if args.metrics_port is not None
+                        else None
+                    ),
+                )
+
+            with _open_source(args.input) as source:
+                return send(
+                    args.address,
+                    args.directory,
+                    source,
+                    args.mode,
+                    lines=args.lines,
+                    ret_addr=Address(args.host, args.port),
+                )
+        except (OSError, ValueError, ConnectionClosed) as e:
+            print(f"{args.command}: {e or type(e).__name__}")
+
+            return 1
+
+
+class _Daemon(ServerHandler):
+    # Every peer is connected back to by a client of its own, which only sends the
+    # public part of our key and a goodbye.
+
+    def __init__(
+        self,
+        addr: Address,
+        privkey: Key,
+        known_peers: KnownPeers,
+        output_dir: Optional[str],
+    ) -> None:
+        self.server = AsyncServer(addr, self, known_peers)
+        self._privkey = privkey
+        self._known_peers = known_peers
+        self._output_dir = output_dir
+        self._output_lock = threading.Lock()
+        self._clients: Dict[str, AsyncClient] = {}
+        self._tasks: Set["asyncio.Task[Any]"] = set()
+
+    async def serve_forever(self) -> None:
+        """Serve peers until cancelled, then disconnect from them."""
+
+        await self.server.start()
+        print(f"Serving at {self.server.addr}")
+
+        try:
+            await self.server.serve_forever()
+        finally:
+            await asyncio.gather(
+                *(client.disconnect() for client in list(self._clients.values())),
+                return_exceptions=True,
+            )
+            await self.server.close()
+
+    def on_handshake(self, peer: Peer, handshake: Handshake) -> None:
+        ret_addr = str(handshake.ret_addr)
+        client = self._clients.get(ret_addr)
+
+        if client is None:
+            client = self._clients[ret_addr] = AsyncClient(
+                self.server.addr,
+                EncryptionMode.GCM,
+                self._privkey,
+                self._known_peers,
+                handler=_ClientHandler(self._clients, ret_addr),
+            )
+
+        self._spawn(client.handshake(handshake, peer))
+
+    def on_pubkey(self, peer: Peer, pubkey: Key) -> None:
+        client = self._clients.get(str(peer.ret_addr))
+
+        if client is not None and client.endpoint_addr is not None:
+            self._spawn(client.rec_pubkey(pubkey))
+
+    async def on_message(self, peer: Peer, message: Message) -> None:
+        if not message.encrypted:
+            _logger.debug("Ignoring a message from {}", peer)
+
+            return
+
+        # Peers are pushed back on while their messages are decrypted and written.
+        loop = asyncio.get_running_loop()
+
+        try:
+            content = await loop.run_in_executor(None, message.decrypt, self._privkey)
+        except ValueError:
+            _logger.warning(
+                "Dropped a message from {} that failed authentication", peer
+            )
+
+            return
+
+        await loop.run_in_executor(None, self._output, content)
+
+    def on_disconnect(self, peer: Peer) -> None:
+        # A peer that lost the connection without saying goodbye may resume it.
+        client = self._clients.get(str(peer.ret_addr))
+
+        if peer.left and client is not None:
+            self._spawn(client.disconnect())
+
+    def _spawn(self, coro: Coroutine[Any, Any, Any]) -> None:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _output(self, content: bytes) -> None:
+        if self._output_dir is not None:
+            path = os.path.join(self._output_dir, f"{uuid.uuid4().hex}.msg")
+
+            with open(path, "wb") as file_out:
+                file_out.write(content)
+
+            return
+
+        with self._output_lock:
+            _STDOUT.buffer.write(content + b"\n")
+            _STDOUT.buffer.flush()
+
+
+class _ClientHandler(ClientHandler):
+    def __init__(self, clients: Dict[str, AsyncClient], ret_addr: str) -> None:
+        self._clients = clients
+        self._ret_addr = ret_addr
+
+    def on_disconnect(self) -> None:
+        self._clients.pop(self._ret_addr, None)
+
+
+def _accept_handshake(
+    writer: MessageWriter, handshake: Handshake, protocol_version: int, key: Key
+) -> None:
+    writer.compression = negotiate(handshake.compression)
+    writer.protocol_version = protocol_version
+
+    if handshake.pubkey_fingerprint == fingerprint(key):
+        writer.write_pubkey_fingerprint(fingerprint(key))
+    else:
+        writer.write_pubkey(export_public_key(key))
+
+
+def _read_pubkey(reader: MessageReader, known_peers: KnownPeers) -> Key:
+    message = reader.read()
+
+    # The endpoint may reply to our handshake before it sends its pubkey.
+    while _content_type(message) == JSONContentType.HANDSHAKE:
+        message = reader.read()
+
+    return pubkey_from_message(message, known_peers)
+
+
+def _write_content(
+    writer: MessageWriter,
+    source: BinaryIO,
+    content: Optional[Tuple[BinaryIO, int]],
+    mode: EncryptionMode,
+) -> None:
+    if content is None:
+        for line in source:
+            writer.write_encrypted(line.rstrip(b"\r\n"), ContentType.BINARY, mode)
+    else:
+        writer.write_encrypted_stream(*content, ContentType.BINARY, mode)
+
+
+def _wait_goodbye(reader: MessageReader) -> None:
+    with contextlib.suppress(ConnectionClosed, OSError):
+        while _content_type(reader.read()) != JSONContentType.GOODBYE:
+            pass
+
+
+def _content_type(message: Message) -> Optional[JSONContentType]:
+    if message.headers.content_type != ContentType.JSON or message.encrypted:
+        return None
+
+    return JSONMessageContent.from_message(message).content_type
+
+
+@contextlib.contextmanager
+def _message_content(
+    source: BinaryIO, lines: bool, mode: EncryptionMode
+) -> Iterator[Optional[Tuple[BinaryIO, int]]]:
+    # Lines are read as they are sent, a single message is read with its length.
+    if lines:
+        yield None
+
+        return
+
+    with contextlib.ExitStack() as stack:
+        if source.seekable():
+            start = source.tell()
+            length = source.seek(0, os.SEEK_END) - start
+            source.seek(start)
+        else:
+            spool = cast(BinaryIO, stack.enter_context(tempfile.TemporaryFile()))
+            shutil.copyfileobj(source, spool)
+            length = spool.tell()
+            spool.seek(0)
+            source = spool
+
+        if crypto.encrypted_length(length, mode) > MAX_MESSAGE_SIZE:
+            raise ValueError(
+                f"Content of {length} bytes does not fit in a message, send it line "
+                "by line"
+            )
+
+        yield source, length
+
+
+@contextlib.contextmanager
+def _open_source(path: Optional[str]) -> Iterator[BinaryIO]:
+    if path is None or path == "-":
+        yield sys.stdin.buffer
+
+        return
+
+    with open(path, "rb") as source:
+        yield source
@@ -0,0 +1,154 @@
+import zlib
+from typing import cast, Callable, Dict, Iterable, List, Optional
+from encryptor.constants import (
+    COMPRESSION_MAX_RATIO,
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_SAMPLE_SIZE,
+    MAX_MESSAGE_SIZE,
+)
+
+
+class Codec:  # pylint: disable=too-few-public-methods
+    """Compression codec applied to content before it is encrypted.
+
+    Decompression takes a limit of the output size, so data crafted by a peer cannot
+    expand without bounds. It raises `ValueError` if the limit is exceeded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compressor: Callable[[bytes], bytes],
+        decompressor: Callable[[bytes, int], bytes],
+    ) -> None:
+        self.name = name
+        self.compress = compressor
+        self.decompress = decompressor
+
+
+# Codecs in order of preference, fast optional codecs go first.
+_codecs: Dict[str, Codec] = {}
+
+try:
+    import zstandard  # type: ignore
+
+    def _zstd_decompress(data: bytes, max_size: int) -> bytes:
+        # Frames may declare any content size, so the output is read in pieces.
+        reader = zstandard.ZstdDecompressor().stream_reader(data)
+        chunks: List[bytes] = []
+        size = 0
+
+        while True:
+            chunk = reader.read(min(max_size + 1 - size, 1024 * 1024))
+
+            if not chunk:
+                return b"".join(chunks)
+
+            chunks.append(chunk)
+            size += len(chunk)
+
+            if size > max_size:
+                raise ValueError(f"Decompressed data exceeds {max_size} bytes")
+
+    _codecs["zstd"] = Codec(
+        "zstd", zstandard.ZstdCompressor().compress, _zstd_decompress
+    )
+except ImportError:
+    pass
+
+try:
+    import lz4.frame  # type: ignore
+
+    def _lz4_decompress(data: bytes, max_size: int) -> bytes:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        decompressed = cast(
+            bytes, decompressor.decompress(data, max_length=max_size + 1)
+        )
+
+        if len(decompressed) > max_size:
+            raise ValueError(f"Decompressed data exceeds {max_size} bytes")
+
+        if not decompressor.eof:
+            raise ValueError("Compressed data is truncated")
+
+        return decompressed
+
+    _codecs["lz4"] = Codec("lz4", lz4.frame.compress, _lz4_decompress)
+except ImportError:
+    pass
+
+
+def _zlib_decompress(data: bytes, max_size: int) -> bytes:
+    decompressor = zlib.decompressobj()
+    decompressed = decompressor.decompress(data, max_size + 1)
+
+    if len(decompressed) > max_size or decompressor.unconsumed_tail:
+        raise ValueError(f"Decompressed data exceeds {max_size} bytes")
+
+    if not decompressor.eof:
+        raise ValueError("Compressed data is truncated")
+
+    return decompressed
+
+
+_codecs["zlib"] = Codec("zlib", lambda data: zlib.compress(data, 6), _zlib_decompress)
+
+
+def available_codecs() -> List[str]:
+    """Get names of available codecs in order of preference."""
+
+    return list(_codecs)
+
+
+def negotiate(offered: Iterable[str]) -> Optional[str]:
+    """Choose the most preferred codec out of codecs offered by an endpoint."""
+
+    offered = set(offered)
+
+    return next((name for name in _codecs if name in offered), None)
+
+
+def compress(data: bytes, codec: str) -> Optional[bytes]:
+    """Compress given bytes with a specified codec.
+
+    Returns `None` if the data is too small or does not compress well enough to be
+    worth it. Large data is probed with a sample before compressing all of it.
+    """
+
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return None
+
+    compress_data = _codecs[codec].compress
+
+    if len(data) > 2 * COMPRESSION_SAMPLE_SIZE:
+        sample = data[:COMPRESSION_SAMPLE_SIZE]
+
+        if len(compress_data(sample)) > len(sample) * COMPRESSION_MAX_RATIO:
+            return None
+
+    compressed = compress_data(data)
+
+    if len(compressed) > len(data) * COMPRESSION_MAX_RATIO:
+        return None
+
+    return compressed
+
+
+def decompress(data: bytes, codec: str, max_size: int = MAX_MESSAGE_SIZE) -> bytes:
+    """Decompress given bytes with a specified codec into at most `max_size` bytes.
+
+    Raises `ValueError` if the codec is unknown, the data is corrupted or it
+    decompresses into more than `max_size` bytes.
+    """
+
+    try:
+        decompress_data = _codecs[codec].decompress
+    except KeyError:
+        raise ValueError(f"Unknown compression codec {codec}") from None
+
+    try:
+        return decompress_data(data, max_size)
+    except ValueError:
+        raise
+    except Exception as e:  # pylint: disable=broad-except
+        raise ValueError(f"Cannot decompress data with {codec}") from e
@@ -2,9 +2,52 @@ import os
 
 
 METAHEADER_LEN = 8
-BUFFER_SIZE = 1024
+PROTOCOL_VERSIONS = (1, 2, 3)
+BUFFER_SIZE = 64 * 1024
+SEND_COALESCE_WINDOW = 0.002
+SEND_COALESCE_SIZE = 64 * 1024
+FRAGMENT_SIZE = 64 * 1024
 DEFAULT_SERVER_PORT = 40000
+SERVER_BACKLOG = 1024
+MAX_CONNECTIONS = 4096
+HANDSHAKE_TIMEOUT = 10
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+MAX_PENDING_MESSAGES = 256
+MAX_PARTIAL_STREAMS = 256
+INBOUND_QUEUE_SIZE = 1024
+OUTBOUND_QUEUE_SIZE = 256
+SEND_FLUSH_TIMEOUT = 5
+RECONNECT_MIN_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30
+RECONNECT_MAX_ATTEMPTS = 10
+RESUMPTION_TTL = 10 * 60
+UI_BATCH_SIZE = 64
+MESSAGE_PREVIEW_LEN = 1024
+METRICS_INTERVAL = 1
+LOG_ENV = "ENCRYPTOR_LOG"
+LOG_SAMPLE_BURST = 10
+LOG_SAMPLE_INTERVAL = 1
+TRACE_MAX_EVENTS = 1_000_000
 PUBLIC_KEY_DIR = "public"
 PRIVATE_KEY_DIR = "private"
 PUBLIC_KEY_PATH = os.path.join(PUBLIC_KEY_DIR, "pubkey.pem")
 PRIVATE_KEY_PATH = os.path.join(PRIVATE_KEY_DIR, "privkey.pem")
+SESSION_KEY_LEN = 32
+SESSION_MAX_MESSAGES = 10000
+SESSION_MAX_BYTES = 256 * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 1024 * 1024
+MAX_FILE_CHUNK_SIZE = 16 * 1024 * 1024
+MAX_FILE_SIZE = 64 * 1024**3
+AEAD_NONCE_LEN = 12
+AEAD_TAG_LEN = 16
+OAEP_CACHE_SIZE = 32
+KEY_AGENT_TTL = 5 * 60
+PASSWORD_ENV = "ENCRYPTOR_PASSWORD"
+X25519_KEY_LEN = 32
+KEY_POOL_SIZE = 2
+KNOWN_PEERS_DIR = "known_peers"
+DOWNLOADS_DIR = "downloads"
+COMPRESSION_MIN_SIZE = 256
+COMPRESSION_SAMPLE_SIZE = 16 * 1024
+COMPRESSION_MAX_RATIO = 0.9
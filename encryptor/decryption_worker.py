@@ -0,0 +1,42 @@
+from typing import List
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from encryptor import log
+from encryptor.encryption.keys import Key
+from encryptor.network.message import decrypt_messages, Message
+from encryptor.network.transfer import IncomingTransfer
+
+_logger = log.get_logger(__name__)
+
+
+class DecryptionWorker(QObject):
+    """Worker responsible for decrypting received messages."""
+
+    decrypted = pyqtSignal(Message, bytes)
+    file_decrypted = pyqtSignal(object, str)
+    # Emitted for messages and files that fail authentication.
+    failed = pyqtSignal(Message)
+    file_failed = pyqtSignal(object)
+
+    @pyqtSlot(list, object)
+    def decrypt(self, messages: List[Message], privkey: Key) -> None:
+        """Decrypt given messages using every available core."""
+
+        for message, content in decrypt_messages(messages, privkey):
+            if content is None:
+                self.failed.emit(message)
+            else:
+                self.decrypted.emit(message, content)
+
+    @pyqtSlot(object, object)
+    def decrypt_file(self, transfer: IncomingTransfer, privkey: Key) -> None:
+        """Decrypt a received file into the directory it was received to."""
+
+        try:
+            path = transfer.decrypt(privkey)
+        except ValueError:
+            _logger.warning(
+                "File {} from {} failed authentication", transfer.id, transfer.sender
+            )
+            self.file_failed.emit(transfer)
+        else:
+            self.file_decrypted.emit(transfer, path)
@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from encryptor.constants import KEY_AGENT_TTL
+from .keys import get_private_key, Key
+
+
+class KeyAgent:
+    """Keeps unlocked private keys in memory so the passphrase is derived once.
+
+    Keys are held per keys directory and forgotten after `ttl` seconds without use.
+    Locking a key only drops the references held by the agent, Python gives no way to
+    reliably zero the memory of the key.
+    """
+
+    def __init__(
+        self, ttl: float = KEY_AGENT_TTL, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.ttl = ttl
+        self._clock = clock
+        self._keys: Dict[str, Tuple[Key, float]] = {}
+        self._lock = threading.Lock()
+
+    def unlock(self, password: str, keys_dir: str) -> Key:
+        """Unlock a private key from a specified directory and keep it in memory.
+
+        Raises `ValueError` if the passphrase is invalid.
+        """
+
+        privkey = get_private_key(password, keys_dir)
+
+        with self._lock:
+            self._keys[_entry_key(keys_dir)] = (privkey, self._clock())
+
+        return privkey
+
+    def get(self, keys_dir: str) -> Optional[Key]:
+        """Get an unlocked private key from a specified directory if it is held."""
+
+        entry_key = _entry_key(keys_dir)
+        now = self._clock()
+
+        with self._lock:
+            entry = self._keys.get(entry_key)
+
+            if entry is None:
+                return None
+
+            if now - entry[1] >= self.ttl:
+                del self._keys[entry_key]
+
+                return None
+
+            self._keys[entry_key] = (entry[0], now)
+
+            return entry[0]
+
+    def lock(self, keys_dir: str) -> None:
+        """Forget an unlocked private key from a specified directory."""
+
+        with self._lock:
+            self._keys.pop(_entry_key(keys_dir), None)
+
+    def wipe(self) -> None:
+        """Forget all unlocked private keys."""
+
+        with self._lock:
+            self._keys.clear()
+
+    def evict_expired(self) -> None:
+        """Forget private keys that have not been used for longer than the TTL."""
+
+        now = self._clock()
+
+        with self._lock:
+            for entry_key, (_, last_used) in list(self._keys.items()):
+                if now - last_used >= self.ttl:
+                    del self._keys[entry_key]
+
+
+def _entry_key(keys_dir: str) -> str:
+    return os.path.realpath(keys_dir)
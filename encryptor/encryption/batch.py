@@ -0,0 +1,84 @@
+from concurrent.futures import (
+    as_completed,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from . import crypto
+from .keys import import_key, Key
+from .mode import EncryptionMode
+
+_worker_privkey: Optional[Key] = None  # pylint: disable=invalid-name
+
+
+def decrypt_many(  # pylint: disable=too-many-arguments
+    data: Iterable[bytes],
+    rec_privkey: Key,
+    mode: EncryptionMode,
+    *,
+    max_workers: Optional[int] = None,
+    use_processes: bool = True,
+    ordered: bool = True,
+) -> Iterator[Tuple[int, Optional[bytes]]]:
+    """Decrypt many payloads produced by `crypto.encrypt` in parallel.
+
+    Yields pairs of an index of the payload and its decrypted content, either in the
+    order of given payloads or as soon as they are decrypted. Content of a payload
+    that fails authentication is `None`. Work is spread across a pool of processes,
+    or threads if `use_processes` is false. Keys cannot be pickled, so processes
+    receive the private key exported to DER once per worker.
+    """
+
+    with _new_executor(rec_privkey, max_workers, use_processes) as executor:
+        futures: List["Future[Optional[bytes]]"] = []
+
+        for payload in data:
+            if use_processes:
+                futures.append(executor.submit(_decrypt_in_worker, payload, mode))
+            else:
+                futures.append(
+                    executor.submit(_try_decrypt, payload, mode, rec_privkey)
+                )
+
+        indices: Dict["Future[Optional[bytes]]", int] = {
+            future: index for index, future in enumerate(futures)
+        }
+
+        for future in futures if ordered else as_completed(futures):
+            yield indices[future], future.result()
+
+
+def _new_executor(
+    rec_privkey: Key, max_workers: Optional[int], use_processes: bool
+) -> Executor:
+    if use_processes:
+        return ProcessPoolExecutor(
+            max_workers,
+            initializer=_init_worker,
+            initargs=(rec_privkey.export_key(format="DER"),),
+        )
+
+    return ThreadPoolExecutor(max_workers)
+
+
+def _init_worker(privkey_der: bytes) -> None:
+    global _worker_privkey  # pylint: disable=global-statement
+
+    _worker_privkey = import_key(privkey_der)
+
+
+def _decrypt_in_worker(payload: bytes, mode: EncryptionMode) -> Optional[bytes]:
+    assert _worker_privkey is not None, "Worker has not been initialized"
+
+    return _try_decrypt(payload, mode, _worker_privkey)
+
+
+def _try_decrypt(
+    payload: bytes, mode: EncryptionMode, rec_privkey: Key
+) -> Optional[bytes]:
+    try:
+        return crypto.decrypt(payload, mode, rec_privkey)
+    except ValueError:
+        return None
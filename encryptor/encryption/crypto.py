@@ -1,68 +1,309 @@
+import itertools
 import os
 import random
 import string
-from typing import cast, Any
-from Crypto.PublicKey import RSA
+import threading
+import time
+from collections import OrderedDict
+from typing import cast, Any, BinaryIO, Iterable, Iterator, Tuple, Union
 from Crypto.Cipher import AES, PKCS1_OAEP
-from Crypto.Util.Padding import pad, unpad
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
+from Crypto.PublicKey import ECC, RSA
+from encryptor import metrics, tracing
+from encryptor.constants import (
+    AEAD_TAG_LEN,
+    OAEP_CACHE_SIZE,
+    SESSION_KEY_LEN,
+    STREAM_CHUNK_SIZE,
+    X25519_KEY_LEN,
+)
+from .engines import get_engine, read_exactly, Buffer
+from .keys import Key
 from .mode import EncryptionMode
 
+Source = Union[BinaryIO, Iterable[bytes]]
+
+
+def generate_session_key() -> bytes:
+    """Generate a new random symmetric session key."""
+
+    return os.urandom(SESSION_KEY_LEN)
+
+
+def wrap_key(session_key: bytes, rec_pubkey: Key) -> bytes:
+    """Encrypt a session key using a receipent key.
+
+    RSA keys wrap the session key with OAEP. X25519 keys agree on a key-encryption
+    key with an ephemeral key, which is sent along with the wrapped session key.
+    """
+
+    start = time.perf_counter()
+
+    with tracing.span("wrap_key"):
+        if isinstance(rec_pubkey, RSA.RsaKey):
+            wrapped_key = cast(bytes, _oaep_cipher(rec_pubkey).encrypt(session_key))
+        else:
+            eph_privkey = ECC.generate(curve="curve25519")
+            eph_pubkey = eph_privkey.public_key().export_key(format="raw")
+            cipher = _x25519_cipher(
+                eph_pubkey, eph_priv=eph_privkey, static_pub=rec_pubkey
+            )
+            ciphertext, tag = cipher.encrypt_and_digest(session_key)
+            wrapped_key = eph_pubkey + ciphertext + tag
+
+    metrics.KEY_WRAP_SECONDS.labels("wrap").observe(time.perf_counter() - start)
+
+    return wrapped_key
+
+
+def unwrap_key(enc_session_key: bytes, rec_privkey: Key) -> bytes:
+    """Decrypt a session key using a receipent key.
+
+    Raises `ValueError` if the key cannot be decrypted.
+    """
+
+    start = time.perf_counter()
+
+    try:
+        with tracing.span("unwrap_key"):
+            return _unwrap_key(enc_session_key, rec_privkey)
+    finally:
+        metrics.KEY_WRAP_SECONDS.labels("unwrap").observe(time.perf_counter() - start)
+
+
+def wrapped_key_len(key: Key) -> int:
+    """Get length of a session key wrapped with a given key."""
+
+    if isinstance(key, RSA.RsaKey):
+        return key.size_in_bytes()
+
+    return X25519_KEY_LEN + SESSION_KEY_LEN + AEAD_TAG_LEN
 
-def encrypt(data: bytes, mode: EncryptionMode, rec_pubkey: RSA.RsaKey) -> bytes:
-    """Encrypt given bytes using a specified encryption mode and receipent key."""
 
-    session_key = os.urandom(16)
-    cipher_rsa = PKCS1_OAEP.new(rec_pubkey)
-    enc_session_key = cipher_rsa.encrypt(session_key)
-    cipher_aes = {
-        EncryptionMode.ECB: AES.new(session_key, AES.MODE_ECB),
-        EncryptionMode.CBC: AES.new(session_key, AES.MODE_CBC),
-        EncryptionMode.CFB: AES.new(session_key, AES.MODE_CFB),
-        EncryptionMode.OFB: AES.new(session_key, AES.MODE_OFB),
-    }[mode]
-    ciphertext: bytes = cipher_aes.encrypt(pad(data, AES.block_size))
+def encrypt_with_key(data: Buffer, mode: EncryptionMode, session_key: bytes) -> bytes:
+    """Encrypt given bytes using a specified encryption mode and session key."""
 
-    if mode == EncryptionMode.ECB:
-        return enc_session_key + ciphertext
+    start = time.perf_counter()
 
-    return enc_session_key + cast(bytes, cast(Any, cipher_aes).iv) + ciphertext
+    with tracing.span("encrypt", mode=mode.value, length=len(data)):
+        encrypted = get_engine(mode).encrypt(data, session_key)
 
+    metrics.ENCRYPT_SECONDS.labels(mode.value).observe(time.perf_counter() - start)
 
-def decrypt(data: bytes, mode: EncryptionMode, rec_privkey: RSA.RsaKey) -> bytes:
-    """Decrypt given bytes using a specified encryption mode and."""
+    return encrypted
 
-    key_len = rec_privkey.size_in_bytes()
-    enc_session_key = data[:key_len]
-    cipher_rsa = PKCS1_OAEP.new(rec_privkey)
 
-    if mode == EncryptionMode.ECB:
-        iv = None
-        ciphertext = data[key_len:]
-    else:
-        iv_end = key_len + AES.block_size
-        iv = data[key_len:iv_end]
-        ciphertext = data[iv_end:]
+def decrypt_with_key(data: Buffer, mode: EncryptionMode, session_key: bytes) -> bytes:
+    """Decrypt given bytes using a specified encryption mode and session key.
+
+    Authenticated modes raise `ValueError` if the data has been tampered with, other
+    modes return random text in place of data they cannot decrypt.
+    """
+
+    engine = get_engine(mode)
+    start = time.perf_counter()
 
     try:
-        session_key = cipher_rsa.decrypt(enc_session_key)
+        with tracing.span("decrypt", mode=mode.value, length=len(data)):
+            return engine.decrypt(data, session_key)
     except ValueError:
-        session_key = os.urandom(16)
+        if engine.authenticated:
+            raise
+
+        return random_text()
+    finally:
+        metrics.DECRYPT_SECONDS.labels(mode.value).observe(time.perf_counter() - start)
+
+
+def encrypt_stream_with_key(
+    source: Source,
+    mode: EncryptionMode,
+    session_key: bytes,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Encrypt a stream of bytes using a specified encryption mode and session key.
+
+    Concatenated chunks are the same as the result of `encrypt_with_key`.
+    """
 
-    cipher_aes = {
-        EncryptionMode.ECB: AES.new(session_key, AES.MODE_ECB),
-        EncryptionMode.CBC: AES.new(session_key, AES.MODE_CBC, cast(bytes, iv)),
-        EncryptionMode.CFB: AES.new(session_key, AES.MODE_CFB, cast(bytes, iv)),
-        EncryptionMode.OFB: AES.new(session_key, AES.MODE_OFB, cast(bytes, iv)),
-    }[mode]
+    yield from get_engine(mode).encrypt_stream(
+        _iter_chunks(source, chunk_size), session_key
+    )
+
+
+def decrypt_stream_with_key(
+    source: Source,
+    mode: EncryptionMode,
+    session_key: bytes,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Decrypt a stream of bytes using a specified encryption mode and session key.
+
+    Concatenated chunks are the same as the result of `decrypt_with_key`, except for
+    authenticated modes which raise `ValueError` after the last chunk if the stream
+    has been tampered with.
+    """
+
+    engine = get_engine(mode)
 
     try:
-        data = unpad(cipher_aes.decrypt(ciphertext), AES.block_size)
+        yield from engine.decrypt_stream(_iter_chunks(source, chunk_size), session_key)
     except ValueError:
-        data = (
-            "".join(
-                random.SystemRandom().choice(string.printable)
-                for _ in range(random.randint(5, 100))
-            )
-        ).encode("utf-8")
+        if engine.authenticated:
+            raise
+
+        yield random_text()
+
+
+def encrypted_length(length: int, mode: EncryptionMode, key_len: int = 0) -> int:
+    """Get length of encrypted data of a given length."""
+
+    return key_len + get_engine(mode).encrypted_length(length)
+
+
+def encrypt(data: bytes, mode: EncryptionMode, rec_pubkey: Key) -> bytes:
+    """Encrypt given bytes using a specified encryption mode and receipent key."""
+
+    session_key = generate_session_key()
+
+    return wrap_key(session_key, rec_pubkey) + encrypt_with_key(data, mode, session_key)
+
+
+def decrypt(data: bytes, mode: EncryptionMode, rec_privkey: Key) -> bytes:
+    """Decrypt given bytes using a specified encryption mode and receipent key.
+
+    Authenticated modes raise `ValueError` if the data has been tampered with or was
+    encrypted for another key.
+    """
+
+    key_len = wrapped_key_len(rec_privkey)
+
+    try:
+        session_key = unwrap_key(data[:key_len], rec_privkey)
+    except ValueError:
+        session_key = generate_session_key()
+
+    return decrypt_with_key(data[key_len:], mode, session_key)
+
+
+def encrypt_stream(
+    source: Source,
+    mode: EncryptionMode,
+    rec_pubkey: Key,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Encrypt a stream of bytes using a specified encryption mode and receipent key.
+
+    The source is either a binary file or an iterable of chunks. Concatenated chunks
+    are the same as the result of `encrypt`, memory usage is bound by `chunk_size`.
+    """
+
+    session_key = generate_session_key()
+
+    yield wrap_key(session_key, rec_pubkey)
+    yield from encrypt_stream_with_key(source, mode, session_key, chunk_size)
+
+
+def decrypt_stream(
+    source: Source,
+    mode: EncryptionMode,
+    rec_privkey: Key,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Decrypt a stream of bytes using a specified encryption mode and receipent key.
+
+    The source is either a binary file or an iterable of chunks. Concatenated chunks
+    are the same as the result of `decrypt`, memory usage is bound by `chunk_size`.
+    """
+
+    chunks = _iter_chunks(source, chunk_size)
+    enc_session_key, rest = read_exactly(chunks, wrapped_key_len(rec_privkey))
+
+    try:
+        session_key = unwrap_key(enc_session_key, rec_privkey)
+    except ValueError:
+        session_key = generate_session_key()
+
+    yield from decrypt_stream_with_key(
+        itertools.chain([rest], chunks), mode, session_key, chunk_size
+    )
+
+
+def random_text() -> bytes:
+    """Generate random printable text returned in place of undecryptable data."""
+
+    return (
+        "".join(
+            random.SystemRandom().choice(string.printable)
+            for _ in range(random.randint(5, 100))
+        )
+    ).encode("utf-8")
+
+
+_oaep_ciphers: "OrderedDict[int, Tuple[RSA.RsaKey, Any]]" = OrderedDict()
+_oaep_lock = threading.Lock()
+
+
+def _unwrap_key(enc_session_key: bytes, rec_privkey: Key) -> bytes:
+    if isinstance(rec_privkey, RSA.RsaKey):
+        return cast(bytes, _oaep_cipher(rec_privkey).decrypt(enc_session_key))
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.Protocol.DH import import_x25519_public_key
+
+    eph_pubkey = enc_session_key[:X25519_KEY_LEN]
+    cipher = _x25519_cipher(
+        eph_pubkey,
+        static_priv=rec_privkey,
+        eph_pub=import_x25519_public_key(eph_pubkey),
+    )
+
+    return cast(
+        bytes,
+        cipher.decrypt_and_verify(
+            enc_session_key[X25519_KEY_LEN:-AEAD_TAG_LEN],
+            enc_session_key[-AEAD_TAG_LEN:],
+        ),
+    )
+
+
+def _oaep_cipher(key: RSA.RsaKey) -> Any:
+    # Keys are not hashable, ciphers are cached by identity of the key object which
+    # is kept alive by the cache entry so that its id cannot be reused.
+    with _oaep_lock:
+        entry = _oaep_ciphers.get(id(key))
+
+        if entry is not None and entry[0] is key:
+            _oaep_ciphers.move_to_end(id(key))
+
+            return entry[1]
+
+        cipher = PKCS1_OAEP.new(key)
+        _oaep_ciphers[id(key)] = (key, cipher)
+
+        if len(_oaep_ciphers) > OAEP_CACHE_SIZE:
+            _oaep_ciphers.popitem(last=False)
+
+        return cipher
+
+
+def _x25519_cipher(eph_pubkey: bytes, **keys: ECC.EccKey) -> Any:
+    # pylint: disable=import-outside-toplevel
+    from Crypto.Protocol.DH import key_agreement
+
+    kek = key_agreement(
+        kdf=lambda secret: HKDF(secret, SESSION_KEY_LEN, eph_pubkey, SHA256), **keys
+    )
+
+    # Every key-encryption key is used exactly once, so a constant nonce is safe.
+    return AES.new(kek, AES.MODE_GCM, nonce=bytes(12), mac_len=AEAD_TAG_LEN)
+
+
+def _iter_chunks(source: Source, chunk_size: int) -> Iterator[bytes]:
+    if hasattr(source, "read"):
+        read = cast(BinaryIO, source).read
+
+        return iter(lambda: read(chunk_size), b"")
 
-    return data
+    return iter(source)
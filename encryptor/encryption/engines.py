@@ -0,0 +1,229 @@
+import itertools
+import os
+from abc import ABC, abstractmethod
+from typing import cast, Any, Callable, Dict, Iterator, Optional, Tuple, Union
+from Crypto.Cipher import AES, ChaCha20_Poly1305
+from Crypto.Util.Padding import pad, unpad
+from encryptor.constants import AEAD_NONCE_LEN, AEAD_TAG_LEN
+from .mode import EncryptionMode
+
+# Data encrypted or decrypted at once may be a view, like of a memory mapped file.
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class CipherEngine(ABC):
+    """Symmetric cipher used to encrypt data in a single encryption mode."""
+
+    # Whether the engine detects tampered data on its own.
+    authenticated = False
+
+    @abstractmethod
+    def encrypt(self, data: Buffer, key: bytes) -> bytes:
+        """Encrypt given bytes using a specified key."""
+
+    @abstractmethod
+    def decrypt(self, data: Buffer, key: bytes) -> bytes:
+        """Decrypt given bytes using a specified key.
+
+        Raises `ValueError` if the data cannot be decrypted.
+        """
+
+    @abstractmethod
+    def encrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        """Encrypt a stream of chunks using a specified key."""
+
+    @abstractmethod
+    def decrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        """Decrypt a stream of chunks using a specified key.
+
+        Raises `ValueError` after the last chunk if the data cannot be decrypted.
+        """
+
+    @abstractmethod
+    def encrypted_length(self, length: int) -> int:
+        """Get length of encrypted data of a given length."""
+
+
+class PaddedEngine(CipherEngine):
+    """AES engine for modes that require data padded to the block size."""
+
+    def __init__(self, aes_mode: int, has_iv: bool = True) -> None:
+        # Stubs of AES.new tell modes apart by literals, which a variable is not.
+        self._aes_mode: Any = aes_mode
+        self._iv_len = AES.block_size if has_iv else 0
+
+    def encrypt(self, data: Buffer, key: bytes) -> bytes:
+        cipher = self._new(key)
+        # Only the last partial block is padded, so data is never copied as a whole
+        # and may be any buffer, like a memory mapped file.
+        blocks = len(data) - len(data) % AES.block_size
+        view = memoryview(data)
+
+        body: bytes = cipher.encrypt(view[:blocks])
+        tail: bytes = cipher.encrypt(pad(bytes(view[blocks:]), AES.block_size))
+
+        return self._iv(cipher) + body + tail
+
+    def decrypt(self, data: Buffer, key: bytes) -> bytes:
+        cipher = self._new(key, data[: self._iv_len])
+
+        return unpad(cipher.decrypt(data[self._iv_len :]), AES.block_size)
+
+    def encrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        cipher = self._new(key)
+        pending = bytearray()
+
+        yield self._iv(cipher)
+
+        for chunk in chunks:
+            pending += chunk
+            usable = len(pending) - len(pending) % AES.block_size
+
+            if usable > 0:
+                yield cipher.encrypt(bytes(pending[:usable]))
+                del pending[:usable]
+
+        yield cipher.encrypt(pad(bytes(pending), AES.block_size))
+
+    def decrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        iv, rest = read_exactly(chunks, self._iv_len)
+        cipher = self._new(key, iv)
+        pending = bytearray()
+
+        for chunk in itertools.chain([rest], chunks):
+            pending += chunk
+            # The last block is held back until the end of the stream to unpad it.
+            usable = len(pending) - (len(pending) % AES.block_size or AES.block_size)
+
+            if usable > 0:
+                yield cipher.decrypt(bytes(pending[:usable]))
+                del pending[:usable]
+
+        yield unpad(cipher.decrypt(bytes(pending)), AES.block_size)
+
+    def encrypted_length(self, length: int) -> int:
+        return self._iv_len + length + AES.block_size - length % AES.block_size
+
+    def _new(self, key: bytes, iv: Optional[Buffer] = None) -> Any:
+        if self._iv_len == 0 or iv is None:
+            return AES.new(key, self._aes_mode)
+
+        return AES.new(key, self._aes_mode, iv=iv)
+
+    def _iv(self, cipher: Any) -> bytes:
+        return cast(bytes, cipher.iv) if self._iv_len > 0 else b""
+
+
+class AEADEngine(CipherEngine):
+    """Engine for modes that authenticate and encrypt data in a single pass."""
+
+    authenticated = True
+
+    def __init__(self, factory: Callable[[bytes, Buffer], Any]) -> None:
+        self._factory = factory
+
+    def encrypt(self, data: Buffer, key: bytes) -> bytes:
+        nonce = os.urandom(AEAD_NONCE_LEN)
+        ciphertext, tag = self._factory(key, nonce).encrypt_and_digest(data)
+
+        return cast(bytes, nonce + ciphertext + tag)
+
+    def decrypt(self, data: Buffer, key: bytes) -> bytes:
+        cipher = self._factory(key, data[:AEAD_NONCE_LEN])
+
+        return cast(
+            bytes,
+            cipher.decrypt_and_verify(
+                data[AEAD_NONCE_LEN:-AEAD_TAG_LEN], data[-AEAD_TAG_LEN:]
+            ),
+        )
+
+    def encrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        nonce = os.urandom(AEAD_NONCE_LEN)
+        cipher = self._factory(key, nonce)
+
+        yield nonce
+
+        for chunk in chunks:
+            yield cipher.encrypt(chunk)
+
+        yield cipher.digest()
+
+    def decrypt_stream(self, chunks: Iterator[bytes], key: bytes) -> Iterator[bytes]:
+        nonce, rest = read_exactly(chunks, AEAD_NONCE_LEN)
+        cipher = self._factory(key, nonce)
+        pending = bytearray()
+
+        for chunk in itertools.chain([rest], chunks):
+            pending += chunk
+            # The tag is held back until the end of the stream to verify it.
+            usable = len(pending) - AEAD_TAG_LEN
+
+            if usable > 0:
+                yield cipher.decrypt(bytes(pending[:usable]))
+                del pending[:usable]
+
+        cipher.verify(bytes(pending))
+
+    def encrypted_length(self, length: int) -> int:
+        return AEAD_NONCE_LEN + length + AEAD_TAG_LEN
+
+
+_factories: Dict[EncryptionMode, Callable[[], CipherEngine]] = {}
+_engines: Dict[EncryptionMode, CipherEngine] = {}
+
+
+def register_engine(mode: EncryptionMode, factory: Callable[[], CipherEngine]) -> None:
+    """Register a factory of an engine for a specified encryption mode.
+
+    The engine is constructed when it is used for the first time.
+    """
+
+    _factories[mode] = factory
+    _engines.pop(mode, None)
+
+
+def get_engine(mode: EncryptionMode) -> CipherEngine:
+    """Get an engine for a specified encryption mode."""
+
+    engine = _engines.get(mode)
+
+    if engine is None:
+        try:
+            factory = _factories[mode]
+        except KeyError:
+            raise ValueError(f"No engine registered for {mode}") from None
+
+        engine = _engines.setdefault(mode, factory())
+
+    return engine
+
+
+def read_exactly(chunks: Iterator[bytes], size: int) -> Tuple[bytes, bytes]:
+    """Read a specified number of bytes from chunks and return them with the rest."""
+
+    buffer = bytearray()
+
+    for chunk in chunks:
+        buffer += chunk
+
+        if len(buffer) >= size:
+            break
+
+    return bytes(buffer[:size]), bytes(buffer[size:])
+
+
+register_engine(EncryptionMode.ECB, lambda: PaddedEngine(AES.MODE_ECB, has_iv=False))
+register_engine(EncryptionMode.CBC, lambda: PaddedEngine(AES.MODE_CBC))
+register_engine(EncryptionMode.CFB, lambda: PaddedEngine(AES.MODE_CFB))
+register_engine(EncryptionMode.OFB, lambda: PaddedEngine(AES.MODE_OFB))
+register_engine(
+    EncryptionMode.GCM,
+    lambda: AEADEngine(
+        lambda key, nonce: AES.new(key, AES.MODE_GCM, nonce=nonce, mac_len=AEAD_TAG_LEN)
+    ),
+)
+register_engine(
+    EncryptionMode.CHACHA20_POLY1305,
+    lambda: AEADEngine(lambda key, nonce: ChaCha20_Poly1305.new(key=key, nonce=nonce)),
+)
@@ -0,0 +1,92 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, Optional
+from encryptor.constants import KEY_POOL_SIZE
+from .keys import generate_key, Key, KeyType
+
+
+class KeyPool:
+    """Keeps pre-generated private keys ready to be taken without waiting.
+
+    Keys are generated by a background thread which tops the pool up whenever a key
+    is taken.
+    """
+
+    def __init__(
+        self,
+        size: int = KEY_POOL_SIZE,
+        key_types: Iterable[KeyType] = (KeyType.RSA_2048,),
+    ) -> None:
+        self.size = size
+        self._keys: Dict[KeyType, Deque[Key]] = {
+            key_type: deque() for key_type in key_types if key_type.supported
+        }
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def start(self) -> None:
+        """Start filling the pool in the background."""
+
+        with self._condition:
+            if self._thread is not None:
+                return
+
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name="KeyPool", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop filling the pool, keys that are already generated are kept."""
+
+        with self._condition:
+            self._stopped = True
+            thread = self._thread
+            self._thread = None
+            self._condition.notify_all()
+
+        if thread is not None:
+            thread.join()
+
+    def available(self, key_type: KeyType) -> int:
+        """Get number of pre-generated keys of a given type."""
+
+        with self._condition:
+            return len(self._keys.get(key_type, ()))
+
+    def take(self, key_type: KeyType = KeyType.RSA_2048) -> Key:
+        """Take a key of a given type, generating it if the pool is empty."""
+
+        with self._condition:
+            keys = self._keys.get(key_type)
+            key = keys.popleft() if keys else None
+            self._condition.notify_all()
+
+        return key if key is not None else generate_key(key_type)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                key_type = self._missing_key_type()
+
+                while key_type is None and not self._stopped:
+                    self._condition.wait()
+                    key_type = self._missing_key_type()
+
+                # The type is missing unless the pool has been stopped.
+                if self._stopped or key_type is None:
+                    return
+
+            key = generate_key(key_type)
+
+            with self._condition:
+                self._keys[key_type].append(key)
+
+    def _missing_key_type(self) -> Optional[KeyType]:
+        for key_type, keys in self._keys.items():
+            if len(keys) < self.size:
+                return key_type
+
+        return None
@@ -1,7 +1,40 @@
 import os
-from Crypto.PublicKey import RSA
+from enum import Enum
+from typing import cast, List, Optional, Union, TYPE_CHECKING
+import Crypto
 from encryptor import constants
 
+# Key classes are imported on first use, so the GUI starts without loading them.
+if TYPE_CHECKING:
+    from Crypto.PublicKey import ECC, RSA
+
+# X25519 requires pycryptodome 3.21 or newer.
+X25519_SUPPORTED = Crypto.version_info >= (3, 21)
+
+Key = Union["RSA.RsaKey", "ECC.EccKey"]
+
+
+class KeyType(Enum):
+    """Type of user keys."""
+
+    RSA_2048 = "RSA-2048"
+    X25519 = "X25519"
+
+    def __str__(self) -> str:  # pylint: disable=invalid-str-returned
+        return self.value
+
+    @staticmethod
+    def available() -> List["KeyType"]:
+        """Get list of key types supported by the installed pycryptodome."""
+
+        return [key_type for key_type in KeyType if key_type.supported]
+
+    @property
+    def supported(self) -> bool:
+        """Determine whether the key type is supported."""
+
+        return self != KeyType.X25519 or X25519_SUPPORTED
+
 
 def keys_exist(keys_dir: str) -> bool:
     """Check if keys exist."""
@@ -12,43 +45,120 @@ def keys_exist(keys_dir: str) -> bool:
     return os.path.exists(pubkey_path) and os.path.exists(privkey_path)
 
 
-def create_keys(password: str, keys_dir: str) -> None:
-    """Create public and private keys."""
+def generate_key(key_type: KeyType = KeyType.RSA_2048) -> Key:
+    """Generate a new private key of a given type."""
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.PublicKey import ECC, RSA
+
+    if key_type == KeyType.X25519:
+        if not X25519_SUPPORTED:
+            raise ValueError(f"Key type {key_type} requires a newer pycryptodome")
+
+        return ECC.generate(curve="curve25519")
+
+    return RSA.generate(2048)
+
+
+def get_key_type(key: Key) -> KeyType:
+    """Get type of a given key."""
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.PublicKey import RSA
+
+    return KeyType.RSA_2048 if isinstance(key, RSA.RsaKey) else KeyType.X25519
+
+
+def create_keys(password: str, keys_dir: str, key: Optional[Key] = None) -> None:
+    """Create public and private keys.
 
-    if not os.path.exists(constants.PUBLIC_KEY_DIR):
-        os.mkdir(constants.PUBLIC_KEY_DIR)
+    A new RSA key is generated unless a pre-generated private key is given.
+    """
 
-    if not os.path.exists(constants.PRIVATE_KEY_DIR):
-        os.mkdir(constants.PRIVATE_KEY_DIR)
+    # pylint: disable=import-outside-toplevel
+    from Crypto.PublicKey import RSA
+
+    os.makedirs(os.path.join(keys_dir, constants.PUBLIC_KEY_DIR), exist_ok=True)
+    os.makedirs(os.path.join(keys_dir, constants.PRIVATE_KEY_DIR), exist_ok=True)
 
     pubkey_path = os.path.join(keys_dir, constants.PUBLIC_KEY_PATH)
     privkey_path = os.path.join(keys_dir, constants.PRIVATE_KEY_PATH)
-    key = RSA.generate(2048)
-    public_key = key.publickey().export_key()
-    private_key = key.export_key(passphrase=password)
-    file_out = open(privkey_path, "wb")
-    file_out.write(private_key)
-    file_out.close()
 
-    file_out = open(pubkey_path, "wb")
+    if key is None:
+        key = generate_key()
 
-    file_out.write(public_key)
-    file_out.close()
+    if isinstance(key, RSA.RsaKey):
+        private_key = key.export_key(passphrase=password)
+    else:
+        private_key = key.export_key(
+            format="PEM",
+            passphrase=password,
+            protection="PBKDF2WithHMAC-SHA1AndAES128-CBC",
+        ).encode("ascii")
 
+    with open(privkey_path, "wb") as file_out:
+        file_out.write(private_key)
 
-def get_public_key(keys_dir: str) -> RSA.RsaKey:
-    """Get public key of a user."""
+    with open(pubkey_path, "wb") as file_out:
+        file_out.write(export_public_key(key))
+
+
+def export_public_key(key: Key) -> bytes:
+    """Export a public part of a given key in the PEM format."""
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.PublicKey import RSA
+
+    if isinstance(key, RSA.RsaKey):
+        return cast(bytes, key.publickey().export_key())
+
+    return key.public_key().export_key(format="PEM").encode("ascii")
+
+
+def fingerprint(key: Key) -> str:
+    """Get a fingerprint of a public part of a given key."""
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.Hash import SHA256
+    from Crypto.PublicKey import RSA
 
-    key_file = open(os.path.join(keys_dir, constants.PUBLIC_KEY_PATH), "rb")
+    if isinstance(key, RSA.RsaKey):
+        der = key.publickey().export_key(format="DER")
+    else:
+        der = key.public_key().export_key(format="DER")
 
-    return RSA.import_key(key_file.read())
+    return SHA256.new(der).hexdigest()
 
 
-def get_private_key(password: str, keys_dir: str) -> RSA.RsaKey:
+def import_key(data: bytes, passphrase: Optional[str] = None) -> Key:
+    """Import a public or private key of any supported type."""
+
+    # pylint: disable=import-outside-toplevel
+    from Crypto.PublicKey import ECC, RSA
+
+    try:
+        return RSA.import_key(data, passphrase=passphrase)
+    except ValueError as rsa_error:
+        if not X25519_SUPPORTED:
+            raise
+
+        try:
+            return ECC.import_key(data, passphrase=passphrase)
+        except ValueError:
+            raise rsa_error from None
+
+
+def get_public_key(keys_dir: str) -> Key:
+    """Get public key of a user."""
+
+    with open(os.path.join(keys_dir, constants.PUBLIC_KEY_PATH), "rb") as key_file:
+        return import_key(key_file.read())
+
+
+def get_private_key(password: str, keys_dir: str) -> Key:
     """Get private key of a user."""
 
-    key_file = open(os.path.join(keys_dir, constants.PRIVATE_KEY_PATH), "rb")
-    encrypted_privkey = key_file.read()
-    key_file.close()
-    private_key = RSA.import_key(encrypted_privkey, passphrase=password)
-    return private_key
+    with open(os.path.join(keys_dir, constants.PRIVATE_KEY_PATH), "rb") as key_file:
+        encrypted_privkey = key_file.read()
+
+    return import_key(encrypted_privkey, passphrase=password)
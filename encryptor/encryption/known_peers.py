@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from typing import Dict, Optional
+from encryptor import constants
+from .keys import export_public_key, fingerprint, import_key, Key
+
+ADDRESSES_FILE = "addresses.json"
+
+
+class KnownPeers:
+    """Persistent store of public keys of peers indexed by their fingerprints.
+
+    Keys are kept as PEM files in the `known_peers` directory next to user keys and
+    parsed at most once per process. The store also remembers which key was last
+    received from a given address, so handshakes can send only a fingerprint.
+    """
+
+    def __init__(self, keys_dir: str) -> None:
+        self._dir = os.path.join(keys_dir, constants.KNOWN_PEERS_DIR)
+        self._keys: Dict[str, Key] = {}
+        self._addresses: Optional[Dict[str, str]] = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, key_fingerprint: str) -> bool:
+        return self.get(key_fingerprint) is not None
+
+    def get(self, key_fingerprint: str) -> Optional[Key]:
+        """Get a known key with a given fingerprint."""
+
+        with self._lock:
+            key = self._keys.get(key_fingerprint)
+
+            if key is None:
+                key = self._load(key_fingerprint)
+
+            return key
+
+    def add(self, key: Key) -> str:
+        """Store a key and return its fingerprint."""
+
+        key_fingerprint = fingerprint(key)
+
+        with self._lock:
+            if key_fingerprint not in self._keys:
+                self._keys[key_fingerprint] = key
+
+                path = self._key_path(key_fingerprint)
+
+                if not os.path.exists(path):
+                    _write_atomic(path, export_public_key(key))
+
+        return key_fingerprint
+
+    def fingerprint_for(self, addr: str) -> Optional[str]:
+        """Get a fingerprint of the key last received from a given address."""
+
+        with self._lock:
+            return self._load_addresses().get(addr)
+
+    def remember(self, addr: str, key: Key) -> str:
+        """Store a key received from a given address and return its fingerprint."""
+
+        key_fingerprint = self.add(key)
+
+        with self._lock:
+            addresses = self._load_addresses()
+
+            if addresses.get(addr) != key_fingerprint:
+                addresses[addr] = key_fingerprint
+                _write_atomic(
+                    os.path.join(self._dir, ADDRESSES_FILE),
+                    json.dumps(addresses, indent=2).encode("utf-8"),
+                )
+
+        return key_fingerprint
+
+    def _key_path(self, key_fingerprint: str) -> str:
+        return os.path.join(self._dir, f"{key_fingerprint}.pem")
+
+    def _load(self, key_fingerprint: str) -> Optional[Key]:
+        if not all(c in "0123456789abcdef" for c in key_fingerprint):
+            return None
+
+        try:
+            with open(self._key_path(key_fingerprint), "rb") as key_file:
+                key = import_key(key_file.read())
+        except (OSError, ValueError):
+            return None
+
+        if fingerprint(key) != key_fingerprint:
+            return None
+
+        self._keys[key_fingerprint] = key
+
+        return key
+
+    def _load_addresses(self) -> Dict[str, str]:
+        if self._addresses is None:
+            try:
+                with open(os.path.join(self._dir, ADDRESSES_FILE), "rb") as file_in:
+                    self._addresses = json.loads(file_in.read())
+            except (OSError, ValueError):
+                self._addresses = {}
+
+        return self._addresses
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+
+    with open(tmp_path, "wb") as file_out:
+        file_out.write(data)
+
+    os.replace(tmp_path, path)
@@ -8,3 +8,8 @@ class EncryptionMode(Enum):
     CBC = "CBC"
     CFB = "CFB"
     OFB = "OFB"
+    GCM = "GCM"
+    CHACHA20_POLY1305 = "ChaCha20-Poly1305"
+
+    def __str__(self) -> str:
+        return str(self.value)
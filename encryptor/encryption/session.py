@@ -0,0 +1,147 @@
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+from encryptor.constants import SESSION_MAX_BYTES, SESSION_MAX_MESSAGES
+from . import crypto
+from .keys import Key
+from .mode import EncryptionMode
+
+
+class EncryptionSession:  # pylint: disable=too-many-instance-attributes
+    """Encrypts messages sent to a single receipent with a rotated session key.
+
+    The session key is wrapped with the receipent's public key only when it is
+    created, every message is then encrypted with the symmetric key alone. A new key
+    is created after `max_messages` messages or `max_bytes` bytes.
+    """
+
+    def __init__(
+        self,
+        rec_pubkey: Key,
+        max_messages: int = SESSION_MAX_MESSAGES,
+        max_bytes: int = SESSION_MAX_BYTES,
+    ) -> None:
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._rec_pubkey = rec_pubkey
+        self._key: Optional[bytes] = None
+        self._wrapped_key: Optional[bytes] = None
+        self._key_id = -1
+        self._messages_count = 0
+        self._bytes_count = 0
+
+    @property
+    def key_id(self) -> int:
+        """Get an identifier of the current session key."""
+
+        return self._key_id
+
+    @property
+    def wrapped_key(self) -> Optional[bytes]:
+        """Get the current session key wrapped with the receipent's public key."""
+
+        return self._wrapped_key
+
+    @property
+    def needs_rekey(self) -> bool:
+        """Determine whether a new session key has to be created."""
+
+        return (
+            self._key is None
+            or self._messages_count >= self.max_messages
+            or self._bytes_count >= self.max_bytes
+        )
+
+    def rekey(self) -> Tuple[int, bytes]:
+        """Create a new session key and return its identifier and wrapped value."""
+
+        self._key = crypto.generate_session_key()
+        self._key_id += 1
+        self._messages_count = 0
+        self._bytes_count = 0
+        self._wrapped_key = crypto.wrap_key(self._key, self._rec_pubkey)
+
+        return self._key_id, self._wrapped_key
+
+    def encrypt(self, data: bytes, mode: EncryptionMode) -> bytes:
+        """Encrypt given bytes with the current session key."""
+
+        if self._key is None:
+            raise RuntimeError("Cannot encrypt data, session key does not exist")
+
+        self._messages_count += 1
+        self._bytes_count += len(data)
+
+        return crypto.encrypt_with_key(data, mode, self._key)
+
+    def encrypt_stream(
+        self, source: crypto.Source, length: int, mode: EncryptionMode
+    ) -> Iterator[bytes]:
+        """Encrypt a stream of bytes of a given length with the current session key."""
+
+        if self._key is None:
+            raise RuntimeError("Cannot encrypt data, session key does not exist")
+
+        self._messages_count += 1
+        self._bytes_count += length
+
+        return crypto.encrypt_stream_with_key(source, mode, self._key)
+
+
+class DecryptionSession:
+    """Decrypts messages received from a single sender.
+
+    Wrapped session keys announced by the sender are kept for the lifetime of the
+    session, each of them is unwrapped at most once, even if messages are decrypted
+    from many threads.
+    """
+
+    def __init__(self) -> None:
+        self._wrapped_keys: Dict[int, bytes] = {}
+        self._keys: Dict[int, bytes] = {}
+        self._locks: Dict[int, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def add_key(self, key_id: int, enc_session_key: bytes) -> None:
+        """Register a wrapped session key announced by the sender."""
+
+        with self._lock:
+            # A key announced again by a resumed session stays unwrapped.
+            if self._wrapped_keys.get(key_id) == enc_session_key:
+                return
+
+            self._wrapped_keys[key_id] = enc_session_key
+            self._keys.pop(key_id, None)
+
+    def decrypt(
+        self, key_id: int, data: bytes, mode: EncryptionMode, rec_privkey: Key
+    ) -> bytes:
+        """Decrypt given bytes encrypted with a specified session key."""
+
+        session_key = self._keys.get(key_id)
+
+        if session_key is None:
+            session_key = self._unwrap_key(key_id, rec_privkey)
+
+        if session_key is None:
+            return crypto.random_text()
+
+        return crypto.decrypt_with_key(data, mode, session_key)
+
+    def _unwrap_key(self, key_id: int, rec_privkey: Key) -> Optional[bytes]:
+        with self._lock:
+            lock = self._locks.setdefault(key_id, threading.Lock())
+
+        with lock:
+            session_key = self._keys.get(key_id)
+
+            if session_key is None:
+                try:
+                    session_key = crypto.unwrap_key(
+                        self._wrapped_keys[key_id], rec_privkey
+                    )
+                except (KeyError, ValueError):
+                    return None
+
+                self._keys[key_id] = session_key
+
+            return session_key
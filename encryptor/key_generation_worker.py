@@ -0,0 +1,35 @@
+from typing import Optional
+from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from encryptor.encryption.key_pool import KeyPool
+from encryptor.encryption.keys import create_keys, generate_key, get_public_key, KeyType
+
+
+class KeyGenerationWorker(QObject):
+    """Worker responsible for generating user keys off the GUI thread."""
+
+    progress = pyqtSignal(str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, key_pool: Optional[KeyPool] = None) -> None:
+        super().__init__()
+
+        self._key_pool = key_pool
+
+    @pyqtSlot(str, str, object)
+    def generate(self, password: str, keys_dir: str, key_type: KeyType) -> None:
+        """Generate and save new keys, emit the public key when they are ready."""
+
+        try:
+            if self._key_pool is not None and self._key_pool.available(key_type):
+                self.progress.emit(f"Taking a pre-generated {key_type} key")
+                key = self._key_pool.take(key_type)
+            else:
+                self.progress.emit(f"Generating a {key_type} key")
+                key = generate_key(key_type)
+
+            self.progress.emit("Saving keys")
+            create_keys(password, keys_dir, key)
+            self.finished.emit(get_public_key(keys_dir))
+        except (OSError, ValueError) as e:
+            self.failed.emit(str(e))
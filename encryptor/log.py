@@ -0,0 +1,152 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, TextIO, Tuple
+from encryptor.constants import LOG_SAMPLE_BURST, LOG_SAMPLE_INTERVAL
+
+FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class BraceMessage:  # pylint: disable=too-few-public-methods
+    """Message of a log record with `{}` fields, formatted like `str.format`."""
+
+    __slots__ = ("fmt", "args")
+
+    def __init__(self, fmt: str, args: Tuple[object, ...]) -> None:
+        self.fmt = fmt
+        self.args = args
+
+    def __str__(self) -> str:
+        return self.fmt.format(*self.args)
+
+
+class BraceAdapter(logging.LoggerAdapter):
+    """Logger of messages with `{}` fields, formatted only if a record is emitted."""
+
+    def log(self, level: int, msg: object, *args: object, **kwargs: Any) -> None:
+        if self.isEnabledFor(level):
+            msg, options = self.process(msg, kwargs)
+            # The call site is a frame further from the logger than it expects.
+            options["stacklevel"] = options.get("stacklevel", 1) + 1
+            self.logger.log(level, BraceMessage(str(msg), args), **options)
+
+
+def get_logger(name: str) -> BraceAdapter:
+    """Get a logger of a module that takes messages with `{}` fields."""
+
+    return BraceAdapter(logging.getLogger(name), {})
+
+
+class SampleFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Lets through at most `burst` debug records of a call site per `interval`.
+
+    Records of a call site are told apart by their logger and unformatted message,
+    the first record let through after others were dropped tells how many of them.
+    Records of higher levels are never dropped.
+    """
+
+    def __init__(
+        self, burst: int = LOG_SAMPLE_BURST, interval: float = LOG_SAMPLE_INTERVAL
+    ) -> None:
+        super().__init__()
+
+        self.burst = burst
+        self.interval = interval
+        # Start of the current interval, records let through and dropped in it.
+        self._sites: Dict[Tuple[str, object], Tuple[float, int, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+
+        msg = record.msg
+        site = (record.name, msg.fmt if isinstance(msg, BraceMessage) else msg)
+        now = time.monotonic()
+
+        with self._lock:
+            start, passed, dropped = self._sites.get(site, (now, 0, 0))
+
+            if now - start >= self.interval:
+                start, passed = now, 0
+
+            if passed >= self.burst:
+                self._sites[site] = (start, passed, dropped + 1)
+
+                return False
+
+            self._sites[site] = (start, passed + 1, 0)
+
+        if dropped and isinstance(msg, BraceMessage):
+            record.msg = BraceMessage(
+                f"{msg.fmt} ({{}} similar messages dropped)", (*msg.args, dropped)
+            )
+        elif dropped and isinstance(record.args, tuple):
+            record.msg = f"{msg} (%d similar messages dropped)"
+            record.args = (*record.args, dropped)
+
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records stay in the process, so their messages are formatted by the
+        # listener thread instead of the thread that logged them.
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Parse levels of loggers like `info,encryptor.network.aio=debug`.
+
+    A level without a logger name applies to the whole application. Raises
+    `ValueError` if a level is unknown.
+    """
+
+    levels: Dict[str, int] = {}
+
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, level = item.rpartition("=")
+        levelno = logging.getLevelName(level.strip().upper())
+
+        if not isinstance(levelno, int):
+            raise ValueError(f"Unknown log level {level}")
+
+        levels[name.strip() or "encryptor"] = levelno
+
+    return levels
+
+
+def configure(
+    levels: Optional[Dict[str, int]] = None, stream: Optional[TextIO] = None
+) -> QueueListener:
+    """Send logs of the application through a queue to a stream, stderr by default.
+
+    Logging calls only put records into the queue, a listener thread formats and
+    writes them, so network threads never wait for the stream. Debug records are
+    sampled with a `SampleFilter`. Levels of loggers are given as by `parse_levels`,
+    the application logs at the info level by default.
+    """
+
+    levels = {"encryptor": logging.INFO, **(levels or {})}
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    listener = QueueListener(records, stream_handler)
+    root_logger = logging.getLogger("encryptor")
+
+    handler.addFilter(SampleFilter())
+    stream_handler.setFormatter(logging.Formatter(FORMAT))
+    root_logger.addHandler(handler)
+    root_logger.propagate = False
+
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
@@ -0,0 +1,354 @@
+import bisect
+import threading
+from abc import ABC, abstractmethod
+from typing import (
+    cast,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TYPE_CHECKING,
+)
+from encryptor.network.connection import Address
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds of histogram buckets in seconds, from 10 us to 10 s.
+LATENCY_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Value:
+    """A value of a counter or a gauge with a single set of labels."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        """Increase the value."""
+
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float) -> None:
+        """Set the value."""
+
+        self.value = value
+
+
+class Tracked:  # pylint: disable=too-few-public-methods
+    """A value of a gauge read from a function whenever metrics are collected."""
+
+    __slots__ = ("_read",)
+
+    def __init__(self, read: Callable[[], float]) -> None:
+        self._read = read
+
+    @property
+    def value(self) -> float:
+        """Read the value."""
+
+        return self._read()
+
+
+class Buckets:  # pylint: disable=too-few-public-methods
+    """Observations of a histogram with a single set of labels."""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "_lock")
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record a single observation."""
+
+        index = bisect.bisect_left(self.bounds, value)
+
+        with self._lock:
+            if index < len(self.counts):
+                self.counts[index] += 1
+
+            self.count += 1
+            self.sum += value
+
+
+class Metric(ABC):
+    """A metric with values for every combination of label values.
+
+    Values are created on first use of their labels. Values of labels that stop being
+    used, like addresses of closed connections, have to be removed.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def remove(self, *labels: str) -> None:
+        """Remove a value with given label values."""
+
+        with self._lock:
+            self._values.pop(labels, None)
+
+    @abstractmethod
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        """Get samples as a name suffix, formatted labels and a value."""
+
+    def _get(self, labels: Tuple[str, ...]) -> Any:
+        value = self._values.get(labels)
+
+        if value is None:
+            if len(labels) != len(self.label_names):
+                raise ValueError(f"Metric {self.name} expects {self.label_names}")
+
+            with self._lock:
+                value = self._values.setdefault(labels, self._new_value())
+
+        return value
+
+    def _new_value(self) -> Any:
+        return Value()
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return list(self._values.items())
+
+    def _format_labels(self, labels: Tuple[str, ...], *extra: str) -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.label_names, labels)
+        ]
+        pairs.extend(extra)
+
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    """A metric that only goes up, like a number of sent bytes."""
+
+    kind = "counter"
+
+    def labels(self, *labels: str) -> Value:
+        """Get a value with given label values."""
+
+        return cast(Value, self._get(labels))
+
+    def total(self) -> float:
+        """Get a sum of values of all labels."""
+
+        return float(sum(value.value for _, value in self._items()))
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, value in self._items():
+            yield "", self._format_labels(labels), value.value
+
+
+class Gauge(Counter):
+    """A metric that goes up and down, like a size of a queue.
+
+    Values that change often are better tracked with a function read only when
+    metrics are collected. Such a value has to be removed once it stops being used.
+    """
+
+    kind = "gauge"
+
+    def track(self, read: Callable[[], float], *labels: str) -> None:
+        """Read a value with given label values from a function."""
+
+        with self._lock:
+            self._values[labels] = Tracked(read)
+
+
+class Histogram(Metric):
+    """A metric that counts observations in buckets, like latencies of calls."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labels)
+
+        self.buckets = tuple(sorted(buckets))
+
+    def labels(self, *labels: str) -> Buckets:
+        """Get observations with given label values."""
+
+        return cast(Buckets, self._get(labels))
+
+    def totals(self) -> Tuple[int, float]:
+        """Get a number and a sum of observations of all labels."""
+
+        items = [buckets for _, buckets in self._items()]
+
+        return sum(b.count for b in items), sum(b.sum for b in items)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        for labels, buckets in self._items():
+            cumulative = 0
+
+            for bound, count in zip(self.buckets, buckets.counts):
+                cumulative += count
+                bucket_labels = self._format_labels(labels, f'le="{bound}"')
+
+                yield "_bucket", bucket_labels, cumulative
+
+            yield "_bucket", self._format_labels(labels, 'le="+Inf"'), buckets.count
+            yield "_sum", self._format_labels(labels), buckets.sum
+            yield "_count", self._format_labels(labels), buckets.count
+
+    def _new_value(self) -> Any:
+        return Buckets(self.buckets)
+
+
+class Registry:
+    """A collection of metrics rendered together."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> None:
+        """Add a metric to the registry."""
+
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines: List[str] = []
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(
+                f"{metric.name}{suffix}{labels} {_format_value(value)}"
+                for suffix, labels, value in metric.samples()
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+BYTES_RECEIVED = Counter(
+    "encryptor_received_bytes_total", "Bytes received from a peer", ("peer",)
+)
+BYTES_SENT = Counter("encryptor_sent_bytes_total", "Bytes sent to a peer", ("peer",))
+FRAMES_RECEIVED = Counter(
+    "encryptor_received_frames_total", "Frames received from a peer", ("peer",)
+)
+FRAMES_SENT = Counter("encryptor_sent_frames_total", "Frames sent to a peer", ("peer",))
+RECEIVE_BUFFER = Gauge(
+    "encryptor_receive_buffer_bytes", "Size of the receive buffer of a peer", ("peer",)
+)
+SCHEDULED_FRAMES = Gauge(
+    "encryptor_scheduled_frames", "Frames waiting to be sent to a peer", ("peer",)
+)
+QUEUE_SIZE = Gauge("encryptor_queue_size", "Items waiting in a queue", ("queue",))
+ENCRYPT_SECONDS = Histogram(
+    "encryptor_encrypt_seconds", "Time of encrypting content", ("mode",)
+)
+DECRYPT_SECONDS = Histogram(
+    "encryptor_decrypt_seconds", "Time of decrypting content", ("mode",)
+)
+KEY_WRAP_SECONDS = Histogram(
+    "encryptor_key_wrap_seconds",
+    "Time of wrapping or unwrapping a session key",
+    ("operation",),
+)
+HANDSHAKE_SECONDS = Histogram(
+    "encryptor_handshake_seconds",
+    "Time from sending a handshake to an established connection",
+)
+
+for _metric in (
+    BYTES_RECEIVED,
+    BYTES_SENT,
+    FRAMES_RECEIVED,
+    FRAMES_SENT,
+    RECEIVE_BUFFER,
+    SCHEDULED_FRAMES,
+    QUEUE_SIZE,
+    ENCRYPT_SECONDS,
+    DECRYPT_SECONDS,
+    KEY_WRAP_SECONDS,
+    HANDSHAKE_SECONDS,
+):
+    REGISTRY.register(_metric)
+
+
+def start_server(
+    addr: Address, registry: Optional[Registry] = None
+) -> "ThreadingHTTPServer":
+    """Serve metrics over HTTP at `/metrics` from a daemon thread.
+
+    The server is returned, so it can be shut down, its address is in `server_address`.
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    served = registry if registry is not None else REGISTRY
+
+    class Handler(BaseHTTPRequestHandler):
+        """Responds with metrics in the Prometheus text format."""
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            """Respond to a request of metrics."""
+
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+
+                return
+
+            body = served.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer((addr.host, addr.port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,1295 @@
+# pylint: disable=too-many-lines
+import asyncio
+import itertools
+import math
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import cast, Callable, Dict, List, Optional, Tuple, Union
+from encryptor import log, tracing
+from encryptor.compression import available_codecs, negotiate
+from encryptor.constants import (
+    HANDSHAKE_TIMEOUT,
+    MAX_CONNECTIONS,
+    MAX_MESSAGE_SIZE,
+    MAX_PENDING_MESSAGES,
+    OUTBOUND_QUEUE_SIZE,
+    RECONNECT_MAX_ATTEMPTS,
+    RECONNECT_MAX_DELAY,
+    RECONNECT_MIN_DELAY,
+    RESUMPTION_TTL,
+    SEND_FLUSH_TIMEOUT,
+    SEND_COALESCE_SIZE,
+    SEND_COALESCE_WINDOW,
+    SERVER_BACKLOG,
+)
+from encryptor.encryption.keys import export_public_key, fingerprint, Key
+from encryptor.encryption.known_peers import KnownPeers
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.encryption.session import DecryptionSession, EncryptionSession
+from .connection import Address, Peer
+from .exceptions import ConnectionClosed, UnsupportedProtocol
+from .message import (
+    check_message,
+    pubkey_from_message,
+    BaseMessageWriter,
+    ContentType,
+    FileAck,
+    FileOffer,
+    FrameParser,
+    Handshake,
+    JSONContentType,
+    JSONMessageContent,
+    Message,
+    Priority,
+)
+from .queues import BoundedQueue
+from .transfer import FileReceiver, IncomingTransfer, OutgoingTransfer
+
+_logger = log.get_logger(__name__)
+
+
+class MessageProtocol(  # pylint: disable=too-many-instance-attributes
+    asyncio.BufferedProtocol
+):
+    """Protocol that receives frames straight into the buffer of a frame parser."""
+
+    def __init__(
+        self,
+        max_message_size: Optional[int] = MAX_MESSAGE_SIZE,
+        max_pending_messages: Optional[int] = None,
+    ) -> None:
+        self.transport: Optional[asyncio.Transport] = None
+        self.parser: Optional[FrameParser] = None
+        self._max_message_size = max_message_size
+        self._max_pending_messages = max_pending_messages
+        self._error: Optional[Exception] = None
+        self._reading_paused = False
+        self._closed: Optional[asyncio.Future] = None
+        self._readable: Optional[asyncio.Future] = None
+        self._writable: Optional[asyncio.Future] = None
+        # Called when the transport accepts more data or the connection is lost.
+        self.on_writable: Optional[Callable[[], None]] = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.Transport, transport)
+        self.parser = FrameParser(
+            Address(*transport.get_extra_info("peername")[:2]), self._max_message_size
+        )
+        self._closed = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        cast(asyncio.Future, self._closed).set_result(None)
+        cast(FrameParser, self.parser).release()
+        _wake(self._readable)
+        _wake(self._writable)
+
+        if self.on_writable is not None:
+            self.on_writable()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return cast(FrameParser, self.parser).get_buffer()
+
+    def buffer_updated(self, nbytes: int) -> None:
+        parser = cast(FrameParser, self.parser)
+
+        try:
+            parser.buffer_updated(nbytes)
+        except ValueError as e:
+            # Invalid frames are reported to the reader, not to the event loop.
+            self._error = e
+            cast(asyncio.Transport, self.transport).close()
+
+        if (
+            self._max_pending_messages is not None
+            and parser.pending >= self._max_pending_messages
+            and not self._reading_paused
+        ):
+            cast(asyncio.Transport, self.transport).pause_reading()
+            self._reading_paused = True
+
+        _wake(self._readable)
+
+    def pause_writing(self) -> None:
+        self._writable = asyncio.get_running_loop().create_future()
+
+    def resume_writing(self) -> None:
+        _wake(self._writable)
+        self._writable = None
+
+        if self.on_writable is not None:
+            self.on_writable()
+
+    @property
+    def closed(self) -> bool:
+        """Determine whether the connection is closed."""
+
+        return self._closed is None or self._closed.done()
+
+    @property
+    def writing_paused(self) -> bool:
+        """Determine whether the transport does not accept more data."""
+
+        return self._writable is not None
+
+    async def next_message(self) -> Message:
+        """Wait for the next message received from the endpoint."""
+
+        parser = cast(FrameParser, self.parser)
+        message = parser.next_message()
+
+        while message is None:
+            if self._error is not None:
+                raise self._error
+
+            if self.closed:
+                raise ConnectionClosed()
+
+            self._readable = asyncio.get_running_loop().create_future()
+            await self._readable
+            self._readable = None
+            message = parser.next_message()
+
+        if self._reading_paused and not self.closed:
+            cast(asyncio.Transport, self.transport).resume_reading()
+            self._reading_paused = False
+
+        return message
+
+    async def drain(self) -> None:
+        """Wait until the transport accepts more data."""
+
+        if self.closed:
+            raise ConnectionClosed()
+
+        if self._writable is not None:
+            await self._writable
+
+    async def wait_closed(self) -> None:
+        """Wait until the connection is closed."""
+
+        if self._closed is not None:
+            # Waiters may be cancelled, the future is shared by all of them.
+            await asyncio.shield(self._closed)
+
+
+class AsyncMessageReader:
+    """Reads messages from an endpoint on an event loop."""
+
+    def __init__(self, protocol: MessageProtocol) -> None:
+        self.endpoint_addr = cast(FrameParser, protocol.parser).endpoint_addr
+        self._protocol = protocol
+
+    def close(self) -> None:
+        """Close the reader."""
+
+        if not self._protocol.closed:
+            _logger.debug("Closing the reader from {}", self.endpoint_addr)
+            cast(asyncio.Transport, self._protocol.transport).close()
+
+    @property
+    def session(self) -> DecryptionSession:
+        """Get the session decrypting messages of the endpoint."""
+
+        return cast(FrameParser, self._protocol.parser).session
+
+    @session.setter
+    def session(self, session: DecryptionSession) -> None:
+        cast(FrameParser, self._protocol.parser).session = session
+
+    async def read_handshake(self) -> Handshake:
+        """Read a handshake from the endpoint."""
+
+        return Handshake.from_message(await self.read(content_type=ContentType.JSON))
+
+    async def read_pubkey(self, known_peers: Optional[KnownPeers] = None) -> Key:
+        """Read a pubkey from the endpoint."""
+
+        return pubkey_from_message(await self.read(), known_peers)
+
+    async def read(self, content_type: Optional[ContentType] = None) -> Message:
+        """Read a single message."""
+
+        message = await self._protocol.next_message()
+
+        return check_message(message, content_type, self.endpoint_addr)
+
+
+class AsyncMessageWriter(BaseMessageWriter):
+    """Writes messages to an endpoint on an event loop.
+
+    Frames are coalesced like in `MessageWriter` and handed to the transport, `drain`
+    has to be awaited to respect its flow control. While the transport does not
+    accept more data, frames wait in the scheduler, so urgent frames written in the
+    meantime overtake queued fragments of bulk streams.
+    """
+
+    def __init__(
+        self,
+        protocol: MessageProtocol,
+        coalesce_window: float = SEND_COALESCE_WINDOW,
+        coalesce_size: int = SEND_COALESCE_SIZE,
+    ) -> None:
+        self.coalesce_window = coalesce_window
+        self.coalesce_size = coalesce_size
+        self._protocol = protocol
+        self._queue: List[bytes] = []
+        self._queued = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._progress: Optional[asyncio.Future] = None
+
+        super().__init__(cast(FrameParser, protocol.parser).endpoint_addr)
+
+        protocol.on_writable = self._writable
+
+    async def drain(self, priority: Priority = Priority.BULK) -> None:
+        """Wait until frames of a priority and more urgent ones are handed over.
+
+        Then wait until the transport accepts more data.
+        """
+
+        while self._scheduler.pending(priority):
+            if self._protocol.closed:
+                raise ConnectionClosed()
+
+            if self._progress is None:
+                self._progress = asyncio.get_running_loop().create_future()
+
+            # Waiters may be cancelled, the future is shared by all of them.
+            await asyncio.shield(self._progress)
+
+        await self._protocol.drain()
+
+    async def wait_closed(self) -> None:
+        """Wait until the connection is closed."""
+
+        await self._protocol.wait_closed()
+
+    def flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        if self._queue and not self._protocol.closed:
+            cast(asyncio.Transport, self._protocol.transport).writelines(self._queue)
+
+        self._queue = []
+        self._queued = 0
+
+    def _send(self, *buffers: bytes) -> None:
+        if self._protocol.closed:
+            raise ConnectionClosed()
+
+        self._queue.extend(buffers)
+        self._queued += sum(len(buffer) for buffer in buffers)
+
+        if self.coalesce_window <= 0 or self._queued >= self.coalesce_size:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self.coalesce_window, self.flush
+            )
+
+    def _close(self) -> None:
+        if not self._protocol.closed:
+            # The transport buffers the rest of frames until they are sent.
+            with self._scheduler_lock:
+                buffers = self._scheduler.pop()
+
+                while buffers is not None:
+                    self._send_frame(buffers)
+                    buffers = self._scheduler.pop()
+
+            self.flush()
+            cast(asyncio.Transport, self._protocol.transport).close()
+
+        self._wake_progress()
+
+    def _pump(self) -> None:
+        if self._protocol.closed:
+            raise ConnectionClosed()
+
+        with self._scheduler_lock:
+            while not self._protocol.writing_paused:
+                buffers = self._scheduler.pop()
+
+                if buffers is None:
+                    break
+
+                self._send_frame(buffers)
+
+        self._wake_progress()
+
+    def _writable(self) -> None:
+        if self._protocol.closed:
+            self._wake_progress()
+        else:
+            self._pump()
+
+    def _wake_progress(self) -> None:
+        _wake(self._progress)
+        self._progress = None
+
+
+async def open_connection(
+    addr: Address,
+) -> Tuple[AsyncMessageReader, AsyncMessageWriter]:
+    """Open a connection to a specified address."""
+
+    _, protocol = await asyncio.get_running_loop().create_connection(
+        MessageProtocol, addr.host, addr.port
+    )
+
+    return AsyncMessageReader(protocol), AsyncMessageWriter(protocol)
+
+
+class ServerHandler:
+    """Receives events of connections accepted by an `AsyncServer`."""
+
+    def on_handshake(self, peer: Peer, handshake: Handshake) -> None:
+        """Handle a handshake read from a new connection or a reply to our handshake."""
+
+    def on_pubkey(self, peer: Peer, pubkey: Key) -> None:
+        """Handle a pubkey read after a handshake, or kept by a resumed session."""
+
+    async def on_message(self, peer: Peer, message: Message) -> None:
+        """Handle a message read after a pubkey.
+
+        The connection is not read from until the handler returns, so a handler that
+        waits for a slow consumer pushes back on the peer.
+        """
+
+    def on_file(self, peer: Peer, transfer: IncomingTransfer) -> None:
+        """Handle an offered file or a new chunk of it."""
+
+    def on_file_ack(self, peer: Peer, ack: FileAck) -> None:
+        """Handle an acknowledgement of chunks of a file sent to the peer."""
+
+    def on_disconnect(self, peer: Peer) -> None:
+        """Handle a closed connection."""
+
+
+class AsyncServer:  # pylint: disable=too-many-instance-attributes
+    """Server that handles many incoming connections on a single event loop.
+
+    Every connection is limited on its own: a peer has `handshake_timeout` seconds to
+    send its handshake and pubkey, cannot send messages larger than
+    `max_message_size` bytes, and is not read from while `max_pending_messages` of
+    its messages wait to be handled. At most `max_connections` peers are served.
+
+    Files offered by peers are received by a given `FileReceiver`, without it they
+    are ignored.
+
+    Every peer is issued a resumption token at handshake time. A peer that presents
+    the token when it connects again within `RESUMPTION_TTL` seconds after it lost
+    the connection skips the pubkey and keeps its session keys.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        addr: Address,
+        handler: ServerHandler,
+        known_peers: Optional[KnownPeers] = None,
+        *,
+        max_connections: int = MAX_CONNECTIONS,
+        handshake_timeout: float = HANDSHAKE_TIMEOUT,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        max_pending_messages: int = MAX_PENDING_MESSAGES,
+        receiver: Optional[FileReceiver] = None,
+    ) -> None:
+        self.addr = addr
+        self.max_connections = max_connections
+        self.handshake_timeout = handshake_timeout
+        self.max_message_size = max_message_size
+        self.max_pending_messages = max_pending_messages
+        self._handler = handler
+        self._known_peers = known_peers
+        self._receiver = receiver
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: Dict[asyncio.Task, Peer] = {}
+        self._peer_ids = itertools.count()
+        self._sessions: "OrderedDict[str, _ResumableSession]" = OrderedDict()
+
+    @property
+    def peers(self) -> List[Peer]:
+        """Get peers connected to the server."""
+
+        return list(self._tasks.values())
+
+    async def start(self) -> None:
+        """Start accepting connections."""
+
+        self._server = await asyncio.get_running_loop().create_server(
+            self._new_protocol,
+            self.addr.host,
+            self.addr.port,
+            reuse_address=True,
+            backlog=SERVER_BACKLOG,
+        )
+        # A port picked by the system is known only once the server listens.
+        self.addr = Address(self.addr.host, self._server.sockets[0].getsockname()[1])
+
+    async def serve_forever(self) -> None:
+        """Accept connections until the server is closed."""
+
+        if self._server is None:
+            await self.start()
+
+        await cast(asyncio.AbstractServer, self._server).serve_forever()
+
+    async def close(self) -> None:
+        """Stop accepting connections and close the accepted ones."""
+
+        if self._server is not None:
+            self._server.close()
+
+        for task in list(self._tasks):
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        if self._server is not None:
+            await self._server.wait_closed()
+
+    def _new_protocol(self) -> MessageProtocol:
+        return _ServerProtocol(
+            self._serve, self.max_message_size, self.max_pending_messages
+        )
+
+    def _serve(self, protocol: MessageProtocol) -> None:
+        reader = AsyncMessageReader(protocol)
+
+        if len(self._tasks) >= self.max_connections:
+            _logger.warning(
+                "Refusing a connection from {}, server is full", reader.endpoint_addr
+            )
+            reader.close()
+
+            return
+
+        peer = Peer(next(self._peer_ids), reader.endpoint_addr)
+        task = asyncio.get_running_loop().create_task(
+            self._serve_connection(peer, reader)
+        )
+
+        self._tasks[task] = peer
+        task.add_done_callback(self._tasks.pop)
+
+    async def _serve_connection(self, peer: Peer, reader: AsyncMessageReader) -> None:
+        _logger.info("New connection from {}", peer)
+
+        try:
+            await asyncio.wait_for(
+                self._accept_peer(peer, reader), self.handshake_timeout
+            )
+
+            while True:
+                message = await reader.read()
+
+                with tracing.span("dispatch", message.trace_id):
+                    await self._dispatch(peer, message)
+        except ConnectionClosed:
+            _logger.info("Closed connection with {}", peer)
+        except asyncio.TimeoutError:
+            _logger.warning("Closing connection with {}, handshake timed out", peer)
+        except UnsupportedProtocol as e:
+            _logger.warning("Rejecting {}: {}", peer, e)
+        except Exception:  # pylint: disable=broad-except
+            _logger.exception("Closing connection with {} after an error", peer)
+        finally:
+            reader.close()
+            self._expire_session(peer)
+            self._handler.on_disconnect(peer)
+
+    async def _dispatch(self, peer: Peer, message: Message) -> None:
+        content_type = message.headers.content_type
+
+        if content_type == ContentType.FILE:
+            await self._receive_file(peer, message)
+
+            return
+
+        if content_type == ContentType.JSON:
+            content = JSONMessageContent.from_message(message)
+
+            if content.content_type == JSONContentType.FILE_OFFER:
+                await self._receive_file(peer, FileOffer.from_content(content))
+
+                return
+
+            if content.content_type == JSONContentType.FILE_ACK:
+                self._handler.on_file_ack(peer, FileAck.from_content(content))
+
+                return
+
+            if content.content_type == JSONContentType.HANDSHAKE:
+                self._handler.on_handshake(peer, Handshake.from_content(content))
+
+                return
+
+            if content.content_type == JSONContentType.GOODBYE:
+                peer.left = True
+
+                return
+
+        await self._handler.on_message(peer, message)
+
+    async def _receive_file(self, peer: Peer, data: Union[FileOffer, Message]) -> None:
+        if self._receiver is None:
+            _logger.warning(
+                "Ignoring a file from {}, receiving files is disabled", peer
+            )
+
+            return
+
+        loop = asyncio.get_running_loop()
+
+        # Chunks are written to disk off the loop, in the order they were received.
+        if isinstance(data, FileOffer):
+            transfer: Optional[IncomingTransfer] = await loop.run_in_executor(
+                None, self._receiver.receive_offer, data, str(peer.ret_addr)
+            )
+        else:
+            transfer = await loop.run_in_executor(
+                None, self._receiver.receive_chunk, data
+            )
+
+        if transfer is not None:
+            self._handler.on_file(peer, transfer)
+
+    async def _accept_peer(self, peer: Peer, reader: AsyncMessageReader) -> None:
+        handshake = await reader.read_handshake()
+        # Raises for peers we cannot talk to, before they are connected to.
+        peer.protocol_version = handshake.protocol_version
+        session = self._resume_session(handshake)
+        peer.ret_addr = handshake.ret_addr
+        peer.resumed = session is not None
+        peer.resumption_token = secrets.token_hex(16)
+        self._handler.on_handshake(peer, handshake)
+
+        if session is not None:
+            _logger.info("Resumed a session of {}", peer)
+
+            pubkey = session.pubkey
+            reader.session = session.decryption
+        else:
+            message = await reader.read()
+            reply = _as_handshake(message)
+
+            # The peer may reply to our handshake before it sends its pubkey.
+            while reply is not None:
+                self._handler.on_handshake(peer, reply)
+                message = await reader.read()
+                reply = _as_handshake(message)
+
+            pubkey = pubkey_from_message(message, self._known_peers)
+
+            if self._known_peers is not None:
+                self._known_peers.remember(str(handshake.ret_addr), pubkey)
+
+        self._store_session(
+            peer.resumption_token,
+            _ResumableSession(
+                ret_addr=handshake.ret_addr,
+                pubkey=pubkey,
+                decryption=reader.session,
+                expires=math.inf,
+            ),
+        )
+        self._handler.on_pubkey(peer, pubkey)
+
+    def _resume_session(self, handshake: Handshake) -> Optional["_ResumableSession"]:
+        if handshake.resume_token is None:
+            return None
+
+        session = self._sessions.pop(handshake.resume_token, None)
+
+        if (
+            session is None
+            or session.ret_addr != handshake.ret_addr
+            or session.expires < time.monotonic()
+        ):
+            _logger.info("Cannot resume a session of {}", handshake.ret_addr)
+
+            return None
+
+        return session
+
+    def _store_session(self, token: str, session: "_ResumableSession") -> None:
+        now = time.monotonic()
+
+        for expired in [t for t, s in self._sessions.items() if s.expires < now]:
+            del self._sessions[expired]
+
+        self._sessions[token] = session
+
+        while len(self._sessions) > self.max_connections:
+            self._sessions.popitem(last=False)
+
+    def _expire_session(self, peer: Peer) -> None:
+        session = (
+            self._sessions.get(peer.resumption_token)
+            if peer.resumption_token is not None
+            else None
+        )
+
+        if session is None:
+            return
+
+        if peer.left:
+            del self._sessions[cast(str, peer.resumption_token)]
+        else:
+            session.expires = time.monotonic() + RESUMPTION_TTL
+
+
+class ClientHandler:
+    """Receives events of the connection of an `AsyncClient`."""
+
+    def on_connect(self, addr: Address) -> None:
+        """Handle a connection that was established or resumed."""
+
+    def on_reconnecting(self, addr: Address, attempt: int, delay: float) -> None:
+        """Handle a lost connection that is reconnected after a delay in seconds."""
+
+    def on_disconnect(self) -> None:
+        """Handle a connection that was closed and will not be reconnected."""
+
+
+class AsyncClient:  # pylint: disable=too-many-instance-attributes
+    """Client that sends encrypted messages to another client's server.
+
+    Messages are queued in `send_queue` and sent by a background task, at most
+    `max_queued_messages` of them wait to be sent. Files are sent by a task per
+    transfer, a transfer interrupted by a closed connection resumes from the last
+    acknowledged chunk once the client connects to the same server again.
+
+    A connection that is lost is reconnected with exponential backoff, up to
+    `RECONNECT_MAX_ATTEMPTS` times. Messages are queued meanwhile and sent once the
+    connection is back. If the server issued a resumption token, the client
+    presents it and keeps its session key instead of exchanging pubkeys again.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        server_addr: Address,
+        mode: EncryptionMode,
+        pubkey: Key,
+        known_peers: Optional[KnownPeers] = None,
+        *,
+        max_queued_messages: int = OUTBOUND_QUEUE_SIZE,
+        handler: Optional[ClientHandler] = None,
+    ) -> None:
+        self.mode = mode
+        # Content is queued along with an identifier of its trace, if it is traced.
+        self.send_queue: BoundedQueue[Tuple[bytes, ContentType, Optional[int]]] = (
+            BoundedQueue(max_queued_messages, "outbound")
+        )
+        self._server_addr = server_addr
+        self._known_peers = known_peers
+        self._handler = handler if handler is not None else ClientHandler()
+        self._writer: Optional[AsyncMessageWriter] = None
+        self._sender: Optional["asyncio.Task[None]"] = None
+        self._watcher: Optional["asyncio.Task[None]"] = None
+        self._reconnector: Optional["asyncio.Task[None]"] = None
+        self._reconnect_addr: Optional[Address] = None
+        # Woken to retry right away, created on the loop while waiting for a retry.
+        self._retry: Optional[asyncio.Future] = None
+        self._established: Optional["asyncio.Future[None]"] = None
+        self._unsent: Optional[Tuple[bytes, ContentType, Optional[int]]] = None
+        self._transfers: Dict[str, OutgoingTransfer] = {}
+        self._transfer_tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._endpoint_pubkey: Optional[Key] = None
+        self._endpoint_known_fingerprint: Optional[str] = None
+        self._endpoint_compression: Optional[str] = None
+        self._endpoint_protocol_version = 1
+        # Session kept from a lost connection, resumed if the server still has it.
+        self._session: Optional[EncryptionSession] = None
+        self._resuming = False
+        # Token issued to us by the endpoint's server and the one our server issued
+        # to the endpoint, with whether our server resumed the endpoint's session.
+        self._resume_token: Optional[str] = None
+        self._issued_token: Optional[str] = None
+        self._endpoint_resumed = False
+
+        self.set_pubkey(pubkey)
+
+    @property
+    def endpoint_addr(self) -> Optional[Address]:
+        """Get an address of the server the client is connected or reconnecting to."""
+
+        return (
+            self._writer.endpoint_addr
+            if self._writer is not None
+            else self._reconnect_addr
+        )
+
+    @property
+    def connected(self) -> bool:
+        """Determine whether the client is ready to send messages."""
+
+        return self._writer is not None and self._writer.connected
+
+    @property
+    def reconnecting(self) -> bool:
+        """Determine whether the client is reconnecting a lost connection."""
+
+        return self._reconnector is not None
+
+    def set_pubkey(self, pubkey: Key) -> None:
+        """Set the pubkey sent to servers."""
+
+        self._pubkey = pubkey
+        self._pubkey_pem = export_public_key(pubkey)
+        self._pubkey_fingerprint = fingerprint(pubkey)
+
+    async def connect(self, addr: Address) -> bool:
+        """Connect to a server at a specified address and send a handshake to it."""
+
+        if self._reconnector is not None:
+            if addr == self._reconnect_addr:
+                _wake(self._retry)
+
+                return True
+
+            self._reset()
+
+        if not await self._open(addr):
+            self._reset()
+
+            return False
+
+        return True
+
+    async def disconnect(self) -> bool:
+        """Disconnect from the server, return whether the client was connected.
+
+        Messages that are still queued are sent first, unless it takes longer than
+        `SEND_FLUSH_TIMEOUT` seconds. The server is told the connection is closed on
+        purpose, so it does not keep our session for resumption.
+        """
+
+        if self._sender is not None and not self._sender.done():
+            try:
+                await asyncio.wait_for(self.send_queue.wait_empty(), SEND_FLUSH_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+        if self._writer is not None and self._writer.connected:
+            try:
+                self._writer.write_goodbye()
+            except ConnectionClosed:
+                pass
+
+        return self._reset()
+
+    async def handshake(
+        self, handshake: Handshake, peer: Optional[Peer] = None
+    ) -> None:
+        """Handshake with an address of the endpoint's server.
+
+        If the endpoint already knows our pubkey, only its fingerprint is sent. Messages
+        are compressed with the most preferred codec offered by the endpoint and written
+        in the newest protocol version it supports.
+
+        A handshake of an endpoint that connected to our server, given as its `peer`,
+        is replied to, so the endpoint learns whether its session was resumed. A
+        client that is resuming its own session waits for the endpoint's handshake
+        that answers its resumption token, and then either resumes the session or
+        sends its pubkey.
+        """
+
+        addr = handshake.ret_addr
+        endpoint_addr = self.endpoint_addr
+
+        if endpoint_addr is not None and endpoint_addr != addr:
+            _logger.warning(
+                "Ignoring a handshake from {}, the client is already connected to {}",
+                addr,
+                endpoint_addr,
+            )
+
+            return
+
+        try:
+            protocol_version = handshake.protocol_version
+        except UnsupportedProtocol as e:
+            _logger.warning("Rejecting a handshake from {}: {}", addr, e)
+
+            return
+
+        # Handshakes issued after the endpoint's server read our resumption token
+        # carry a new token, older ones do not answer it.
+        answer = not self._resuming or handshake.resumption_token not in (
+            None,
+            self._resume_token,
+        )
+        self._endpoint_known_fingerprint = handshake.pubkey_fingerprint
+        self._endpoint_compression = negotiate(handshake.compression)
+        self._endpoint_protocol_version = protocol_version
+
+        if handshake.resumption_token is not None and answer:
+            self._resume_token = handshake.resumption_token
+
+        if peer is not None and not handshake.reply:
+            self._issued_token = peer.resumption_token
+            self._endpoint_resumed = peer.resumed
+
+        if self._writer is None:
+            if self._reconnector is not None:
+                # The endpoint is back, so there is no point waiting for the backoff.
+                _wake(self._retry)
+            else:
+                await self.connect(addr)
+
+            return
+
+        writer = self._writer
+        writer.compression = self._endpoint_compression
+        writer.protocol_version = self._endpoint_protocol_version
+
+        if not handshake.reply:
+            writer.write_handshake(self._handshake(addr, reply=True))
+
+        if answer and not writer.connected:
+            self._establish(writer, handshake)
+
+        await writer.drain(Priority.CONTROL)
+
+    async def rec_pubkey(self, pubkey: Key) -> bool:
+        """Register a receipent's pubkey, return whether the connection is ready."""
+
+        if self._writer is None:
+            if self._reconnector is None:
+                raise RuntimeError(
+                    "Cannot register a receipent's pubkey, writer does not exist"
+                )
+
+            self._endpoint_pubkey = pubkey
+
+            return False
+
+        writer = self._writer
+        known = self._endpoint_pubkey is not None and fingerprint(
+            self._endpoint_pubkey
+        ) == fingerprint(pubkey)
+        self._endpoint_pubkey = pubkey
+
+        # A resumed session keeps its key, which is not reset for the same pubkey.
+        if self._resuming or (writer.connected and known):
+            return writer.connected
+
+        writer.update_endpoint_pubkey(pubkey)
+
+        if not writer.sent_pubkey:
+            self._write_pubkey()
+            await writer.drain(Priority.CONTROL)
+
+        if writer.connected:
+            self._on_established()
+
+        return writer.connected
+
+    async def send(
+        self, content: bytes, content_type: ContentType = ContentType.BINARY
+    ) -> None:
+        """Queue content to be encrypted and sent, waiting while the queue is full.
+
+        Content is queued also while the client is reconnecting.
+        """
+
+        if self._writer is None and self._reconnector is None:
+            raise RuntimeError("Cannot send a message, writer does not exist")
+
+        if not self.connected and self._reconnector is None:
+            raise RuntimeError(
+                "Cannot send a message without an established connection"
+            )
+
+        await self.send_queue.put((content, content_type, tracing.current_id()))
+
+    async def send_file(self, path: str) -> OutgoingTransfer:
+        """Start sending a file to the server in encrypted chunks.
+
+        A file sent while the client is reconnecting is sent once it is connected.
+        """
+
+        endpoint_addr = self.endpoint_addr
+
+        if endpoint_addr is None or not (self.connected or self.reconnecting):
+            raise RuntimeError("Cannot send a file without an established connection")
+
+        transfer = OutgoingTransfer(path, endpoint_addr, self.mode)
+        self._transfers[transfer.id] = transfer
+
+        if self.connected:
+            self._start_transfer(transfer)
+
+        return transfer
+
+    def acknowledge(self, ack: FileAck) -> None:
+        """Register chunks of a file acknowledged by the server."""
+
+        transfer = self._transfers.get(ack.transfer_id)
+
+        if transfer is None:
+            return
+
+        transfer.acknowledge(ack)
+
+        if transfer.complete:
+            _logger.info("Sent a file {} to {}", transfer.path, transfer.endpoint_addr)
+
+            del self._transfers[transfer.id]
+
+    async def send_file_ack(self, ack: FileAck) -> None:
+        """Acknowledge chunks of a file received by our server."""
+
+        if self._writer is None or not self._writer.connected:
+            raise RuntimeError("Cannot send an ack without an established connection")
+
+        self._writer.write_file_ack(ack)
+        await self._writer.drain(Priority.CONTROL)
+
+    def _establish(self, writer: AsyncMessageWriter, handshake: Handshake) -> None:
+        # Either resume the session or start a new one with our pubkey.
+        if self._resuming and handshake.resumed:
+            self._resuming = False
+            writer.resume(
+                cast(Key, self._endpoint_pubkey),
+                cast(EncryptionSession, self._session),
+            )
+            self._on_established()
+        elif not writer.sent_pubkey:
+            if not handshake.reply:
+                # The endpoint opened a new connection to our server, so its pubkey is
+                # read again and may have changed.
+                self._endpoint_pubkey = None
+
+            self._resuming = False
+            self._session = None
+
+            if self._endpoint_pubkey is not None:
+                writer.update_endpoint_pubkey(self._endpoint_pubkey)
+
+            if self._write_pubkey():
+                self._on_established()
+
+    def _handshake(self, addr: Address, reply: bool = False) -> Handshake:
+        pubkey_fingerprint = (
+            self._known_peers.fingerprint_for(str(addr))
+            if self._known_peers is not None
+            else None
+        )
+        handshake = Handshake(
+            self._server_addr,
+            pubkey_fingerprint,
+            available_codecs(),
+            resumption_token=self._issued_token,
+            resume_token=self._resume_token if self._resuming and not reply else None,
+            resumed=self._endpoint_resumed,
+            reply=reply,
+        )
+        # The endpoint learns that its session was resumed only once.
+        self._endpoint_resumed = False
+
+        return handshake
+
+    async def _open(self, addr: Address) -> bool:
+        try:
+            _logger.info("Connecting to the {}", addr)
+            _, writer = await open_connection(addr)
+        except OSError:
+            _logger.warning("Could not connect to the {}", addr)
+
+            return False
+
+        self._writer = writer
+        self._watcher = asyncio.create_task(self._watch(writer))
+        self._resuming = (
+            self._resume_token is not None
+            and self._session is not None
+            and self._endpoint_pubkey is not None
+        )
+
+        try:
+            writer.compression = self._endpoint_compression
+            writer.protocol_version = self._endpoint_protocol_version
+            writer.write_handshake(self._handshake(addr))
+            await writer.drain(Priority.CONTROL)
+        except ConnectionClosed:
+            _logger.warning("Could not connect to the {}", addr)
+
+            return False
+
+        return True
+
+    def _on_established(self) -> None:
+        writer = cast(AsyncMessageWriter, self._writer)
+
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._send_queued(writer))
+
+        for transfer in self._transfers.values():
+            if transfer.endpoint_addr == writer.endpoint_addr:
+                self._start_transfer(transfer)
+
+        _wake(self._established)
+        self._handler.on_connect(writer.endpoint_addr)
+
+    async def _watch(self, writer: AsyncMessageWriter) -> None:
+        await writer.wait_closed()
+
+        if writer is not self._writer:
+            return
+
+        if writer.connected:
+            _logger.warning("Lost connection to the {}", writer.endpoint_addr)
+
+            self._session = writer.session
+            self._close_writer()
+            self._reconnect_addr = writer.endpoint_addr
+            self._reconnector = asyncio.create_task(
+                self._reconnect(writer.endpoint_addr)
+            )
+        elif self._reconnector is None:
+            _logger.warning(
+                "Connection to the {} closed during handshake", writer.endpoint_addr
+            )
+
+            self._reset()
+
+    async def _reconnect(self, addr: Address) -> None:
+        try:
+            for attempt in range(RECONNECT_MAX_ATTEMPTS):
+                delay = _backoff(attempt)
+
+                _logger.info("Reconnecting to the {} in {:.2f} s", addr, delay)
+                self._handler.on_reconnecting(addr, attempt + 1, delay)
+
+                self._retry = asyncio.get_running_loop().create_future()
+
+                try:
+                    await asyncio.wait_for(self._retry, delay)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._retry = None
+
+                if not await self._open(addr):
+                    self._close_writer()
+
+                    continue
+
+                if await self._wait_established():
+                    return
+
+                if self._reconnector is not asyncio.current_task():
+                    # The connection was lost again and another task reconnects it.
+                    return
+
+                _logger.info("Could not reconnect to the {}", addr)
+
+                # The server may have forgotten the session, so do not resume it.
+                self._resume_token = None
+                self._session = None
+                self._close_writer()
+
+            _logger.warning("Gave up reconnecting to the {}", addr)
+
+            self._reset()
+        finally:
+            if self._reconnector is asyncio.current_task():
+                self._reconnector = None
+                self._reconnect_addr = None
+
+    async def _wait_established(self) -> bool:
+        writer = cast(AsyncMessageWriter, self._writer)
+        self._established = asyncio.get_running_loop().create_future()
+        closed = asyncio.create_task(writer.wait_closed())
+
+        try:
+            await asyncio.wait(
+                (self._established, closed),
+                timeout=HANDSHAKE_TIMEOUT,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            closed.cancel()
+            self._established = None
+
+        return writer is self._writer and writer.connected
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+        for task in (self._sender, self._watcher, *self._transfer_tasks.values()):
+            if task is not None and task is not asyncio.current_task():
+                task.cancel()
+
+        self._writer = None
+        self._sender = None
+        self._watcher = None
+        self._resuming = False
+        self._transfer_tasks.clear()
+
+    def _reset(self) -> bool:
+        if self._writer is None and self._reconnector is None:
+            return False
+
+        if self._writer is not None:
+            _logger.info("Disconnected from the {}", self._writer.endpoint_addr)
+
+        if (
+            self._reconnector is not None
+            and self._reconnector is not asyncio.current_task()
+        ):
+            self._reconnector.cancel()
+
+        self._close_writer()
+
+        if self.send_queue or self._unsent is not None:
+            _logger.warning(
+                "Dropping {} messages that were not sent", len(self.send_queue)
+            )
+            self.send_queue.clear()
+
+        self._reconnector = None
+        self._reconnect_addr = None
+        self._unsent = None
+        self._session = None
+        self._resume_token = None
+        self._issued_token = None
+        self._endpoint_resumed = False
+        self._endpoint_pubkey = None
+        self._endpoint_known_fingerprint = None
+        self._endpoint_compression = None
+        self._endpoint_protocol_version = 1
+        self._handler.on_disconnect()
+
+        return True
+
+    async def _send_queued(self, writer: AsyncMessageWriter) -> None:
+        try:
+            while True:
+                # A message that could not be written is sent again after reconnecting.
+                if self._unsent is None:
+                    self._unsent = await self.send_queue.get()
+
+                content, content_type, trace_id = self._unsent
+
+                with tracing.span("send", trace_id):
+                    writer.write_encrypted(content, content_type, self.mode)
+
+                self._unsent = None
+                await writer.drain(Priority.INTERACTIVE)
+        except ConnectionClosed:
+            _logger.warning(
+                "Stopped sending messages, {} closed connection", writer.endpoint_addr
+            )
+
+    def _start_transfer(self, transfer: OutgoingTransfer) -> None:
+        task = self._transfer_tasks.get(transfer.id)
+
+        if not transfer.complete and (task is None or task.done()):
+            self._transfer_tasks[transfer.id] = asyncio.create_task(
+                self._send_file(cast(AsyncMessageWriter, self._writer), transfer)
+            )
+
+    async def _send_file(
+        self, writer: AsyncMessageWriter, transfer: OutgoingTransfer
+    ) -> None:
+        offset = transfer.acked
+
+        _logger.info(
+            "Sending a file {} from {} to {}",
+            transfer.path,
+            offset,
+            writer.endpoint_addr,
+        )
+
+        try:
+            writer.write_file_offer(transfer.offer(cast(Key, self._endpoint_pubkey)))
+
+            for offset, chunk in transfer.chunks(offset):
+                writer.write_file_chunk(transfer.id, offset, chunk)
+                await writer.drain()
+        except ConnectionClosed:
+            _logger.info("Paused sending a file {} at {}", transfer.path, offset)
+        finally:
+            # A reconnected client may have already started a new task.
+            if self._transfer_tasks.get(transfer.id) is asyncio.current_task():
+                del self._transfer_tasks[transfer.id]
+
+    def _write_pubkey(self) -> bool:
+        # Returns whether the writer is connected once the endpoint has our pubkey.
+        writer = cast(AsyncMessageWriter, self._writer)
+
+        if self._endpoint_known_fingerprint == self._pubkey_fingerprint:
+            writer.write_pubkey_fingerprint(self._pubkey_fingerprint)
+        else:
+            writer.write_pubkey(self._pubkey_pem)
+
+        return writer.connected
+
+
+class _ResumableSession(SimpleNamespace):  # pylint: disable=too-few-public-methods
+    ret_addr: Address
+    pubkey: Key
+    decryption: DecryptionSession
+    # Monotonic time after which the session cannot be resumed.
+    expires: float
+
+
+def start_event_loop() -> asyncio.AbstractEventLoop:
+    """Start a new event loop running forever in a daemon thread."""
+
+    loop = asyncio.new_event_loop()
+
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    return loop
+
+
+class _ServerProtocol(MessageProtocol):
+    def __init__(
+        self,
+        connected: Callable[[MessageProtocol], None],
+        max_message_size: Optional[int] = None,
+        max_pending_messages: Optional[int] = None,
+    ) -> None:
+        super().__init__(max_message_size, max_pending_messages)
+
+        self._connected = connected
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        super().connection_made(transport)
+        self._connected(self)
+
+
+def _as_handshake(message: Message) -> Optional[Handshake]:
+    if message.headers.content_type != ContentType.JSON:
+        return None
+
+    content = JSONMessageContent.from_message(message)
+
+    if content.content_type != JSONContentType.HANDSHAKE:
+        return None
+
+    return Handshake.from_content(content)
+
+
+def _backoff(attempt: int) -> float:
+    # Exponential backoff with jitter, so peers that lost connection at once do not
+    # reconnect at once.
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2**attempt)
+
+    return random.uniform(delay / 2, delay)
+
+
+def _wake(future: Optional[asyncio.Future]) -> None:
+    if future is not None and not future.done():
+        future.set_result(None)
@@ -1,105 +1,141 @@
-import socket
-from typing import Optional
-from Crypto.PublicKey import RSA
+import asyncio
+from typing import Any, Coroutine, Optional, TypeVar
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
+from encryptor import log, tracing
+from encryptor.encryption.keys import Key
+from encryptor.encryption.known_peers import KnownPeers
 from encryptor.encryption.mode import EncryptionMode
-from .connection import Address
-from .message import ContentType, Message, MessageWriter
+from .aio import start_event_loop, AsyncClient, ClientHandler
+from .connection import Address, Peer
+from .message import FileAck, Handshake
+from .transfer import IncomingTransfer
 
+_logger = log.get_logger(__name__)
+T = TypeVar("T")
 
-class ClientWorker(QObject):
-    """Worker responsible for sending data to another client."""
+
+class ClientWorker(QObject, ClientHandler):
+    """Worker responsible for sending data to another client.
+
+    The worker is a thin adapter of an `AsyncClient` running on a given event loop, or
+    on its own loop if none is given. Slots block until the client is done. A lost
+    connection is reconnected by the client, `reconnecting` is emitted before every
+    attempt with its number and delay in seconds.
+    """
 
     connection = pyqtSignal(Address)
+    reconnecting = pyqtSignal(Address, int, float)
     disconnection = pyqtSignal()
 
     def __init__(
-        self, server_addr: Address, mode: EncryptionMode, pubkey: RSA.RsaKey
+        self,
+        server_addr: Address,
+        mode: EncryptionMode,
+        pubkey: Key,
+        known_peers: Optional[KnownPeers] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
     ) -> None:
         super().__init__()
 
-        self._server_addr = server_addr
-        self._mode = mode
-        self._pubkey = pubkey
-        self._writer: Optional[MessageWriter] = None
-
-    def __del__(self) -> None:
-        self.disconnect()
+        self._loop = loop if loop is not None else start_event_loop()
+        self._client = AsyncClient(server_addr, mode, pubkey, known_peers, handler=self)
 
     @pyqtSlot(Address)
     def connect(self, addr: Address) -> None:
         """Connect to a server at a specified address."""
 
-        sock = socket.socket()
+        self._run(self._client.connect(addr))
 
-        try:
-            print(f"Connecting to the {addr}")
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.connect((addr.host, addr.port))
+    @pyqtSlot()
+    def disconnect(self) -> None:
+        """Disconnect from the server."""
 
-            self._writer = MessageWriter(sock)
+        self._run(self._client.disconnect())
 
-            self._writer.write_handshake(self._server_addr)
-        except OSError:
-            print(f"Could not connect to the {addr}")
+    @pyqtSlot(Peer, Handshake)
+    def handshake(self, peer: Peer, handshake: Handshake) -> None:
+        """Handshake with an address of the endpoint's server."""
+
+        self._run(self._client.handshake(handshake, peer))
+
+    @pyqtSlot(Peer)
+    def peer_disconnect(self, peer: Peer) -> None:
+        """Disconnect from the server of a peer that disconnected from us.
+
+        A peer that lost the connection without saying goodbye is expected to
+        reconnect, so our connection to its server is kept.
+        """
+
+        if (
+            peer.left
+            and peer.ret_addr is not None
+            and peer.ret_addr == self._client.endpoint_addr
+        ):
             self.disconnect()
 
-    @pyqtSlot()
-    def disconnect(self) -> None:
-        """Disconnect from the server."""
+    @pyqtSlot(Peer, object)
+    def rec_pubkey(self, peer: Peer, pubkey: Key) -> None:
+        """Register a receipent's pubkey sent by a peer we are connected to."""
 
-        if self._writer is not None:
-            self._writer.close()
-            print(f"Disconnected from the {self._writer.endpoint_addr}")
+        if peer.ret_addr == self._client.endpoint_addr:
+            self._run(self._client.rec_pubkey(pubkey))
 
-            self._writer = None
-            self.disconnection.emit()
+    @pyqtSlot(str)
+    def send_file(self, path: str) -> None:
+        """Start sending a file to the server."""
 
-    @pyqtSlot(Address)
-    def handshake(self, addr: Address) -> None:
-        """Handshake with a specified address."""
-
-        if self._writer is not None:
-            if self._writer.endpoint_addr == addr:
-                self._writer.write_pubkey(self._pubkey)
-            else:
-                raise RuntimeError(
-                    f"Handshake requested with {addr} but the client is already connected to {self._writer.endpoint_addr}"
-                )
-        else:
-            self.connect(addr)
+        self._run(self._client.send_file(path))
 
-    @pyqtSlot(RSA.RsaKey)
-    def rec_pubkey(self, pubkey: RSA.RsaKey) -> None:
-        """Register a receipent's pubkey."""
+    @pyqtSlot(Peer, FileAck)
+    def file_ack(self, peer: Peer, ack: FileAck) -> None:
+        """Register chunks of a sent file acknowledged by a peer we are connected to."""
 
-        if self._writer is not None:
-            self._writer.update_endpoint_pubkey(pubkey)
+        if peer.ret_addr == self._client.endpoint_addr:
+            self._loop.call_soon_threadsafe(self._client.acknowledge, ack)
 
-            if not self._writer.connected:
-                self._writer.write_pubkey(self._pubkey)
+    @pyqtSlot(Peer, object)
+    def ack_file(self, peer: Peer, transfer: IncomingTransfer) -> None:
+        """Acknowledge chunks of a file received from a peer we are connected to."""
 
-            if self._writer.connected:
-                self.connection.emit(self._writer.endpoint_addr)
-        else:
-            raise RuntimeError(
-                "Cannot register a receipent's pubkey, writer does not exist"
+        if peer.ret_addr == self._client.endpoint_addr and self._client.connected:
+            self._run(
+                self._client.send_file_ack(
+                    FileAck(transfer_id=transfer.id, offset=transfer.received)
+                )
             )
 
+    @pyqtSlot(object)
+    def change_pubkey(self, pubkey: Key) -> None:
+        """Change the pubkey sent to servers, the current connection is closed."""
+
+        self._client.set_pubkey(pubkey)
+        self.disconnect()
+
     @pyqtSlot(EncryptionMode)
     def change_mode(self, mode: EncryptionMode) -> None:
         """Change the encryption mode."""
 
-        self._mode = mode
+        self._client.mode = mode
 
-        print(f"Changed encryption mode to {self._mode}")
+        _logger.info("Changed encryption mode to {}", mode)
 
     @pyqtSlot(str)
     def send_message(self, message: str) -> None:
-        """Send a message to the server."""
+        """Queue a message to be sent to the server, wait while the queue is full."""
 
-        if self._writer is not None:
+        # The coroutine runs in a copy of the context, so it is traced with the span.
+        with tracing.span("send_message", tracing.new_id()):
             # TODO: Don't hardcode encoding here.
-            self._writer.write(Message.of(message.encode("utf-8"), ContentType.BINARY))
-        else:
-            raise RuntimeError("Cannot send a message, writer does not exist")
+            self._run(self._client.send(message.encode("utf-8")))
+
+    def on_connect(self, addr: Address) -> None:
+        self.connection.emit(addr)
+
+    def on_reconnecting(self, addr: Address, attempt: int, delay: float) -> None:
+        self.reconnecting.emit(addr, attempt, delay)
+
+    def on_disconnect(self) -> None:
+        self.disconnection.emit()
+
+    def _run(self, coro: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
@@ -38,3 +38,27 @@ class Address:
         raise ValueError(
             "Given string does not contain a port and no default port was specified"
         )
+
+
+class Peer:
+    """Endpoint connected to a server."""
+
+    def __init__(self, peer_id: int, addr: Address) -> None:
+        self.id = peer_id
+        self.addr = addr
+        # Address of the endpoint's server, known once it sends a handshake.
+        self.ret_addr: Optional[Address] = None
+        # Newest protocol version both endpoints support, known with the handshake.
+        self.protocol_version: Optional[int] = None
+        # Token the endpoint presents to resume its session after reconnecting.
+        self.resumption_token: Optional[str] = None
+        # Whether the endpoint resumed a session of a previous connection.
+        self.resumed = False
+        # Whether the endpoint said goodbye before closing the connection.
+        self.left = False
+
+    def __repr__(self) -> str:
+        return f"Peer({self.id}, {self.addr})"
+
+    def __str__(self) -> str:
+        return f"{self.ret_addr or self.addr} (#{self.id})"
@@ -1,2 +1,6 @@
 class ConnectionClosed(Exception):
     """Socket connection closed."""
+
+
+class UnsupportedProtocol(ValueError):
+    """Endpoint supports none of our protocol versions."""
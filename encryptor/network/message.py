@@ -1,15 +1,56 @@
+# pylint: disable=too-many-lines
+import base64
 import io
+import itertools
 import json
+import os
 import socket
 import struct
 import sys
-from enum import Enum
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque, OrderedDict
+from concurrent.futures import as_completed, ThreadPoolExecutor
+from enum import Enum, IntEnum
 from types import SimpleNamespace
-from typing import cast, Any, List, Literal, Optional, Union
-from Crypto.PublicKey import RSA
-from encryptor.constants import BUFFER_SIZE, METAHEADER_LEN
+from typing import (
+    cast,
+    Any,
+    BinaryIO,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Tuple,
+    Union,
+)
+from encryptor import log, metrics, tracing
+from encryptor.compression import compress, decompress
+from encryptor.constants import (
+    BUFFER_SIZE,
+    FRAGMENT_SIZE,
+    MAX_FILE_CHUNK_SIZE,
+    MAX_FILE_SIZE,
+    MAX_MESSAGE_SIZE,
+    MAX_PARTIAL_STREAMS,
+    METAHEADER_LEN,
+    PROTOCOL_VERSIONS,
+    SEND_COALESCE_SIZE,
+    SEND_COALESCE_WINDOW,
+)
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import import_key, Key
+from encryptor.encryption.known_peers import KnownPeers
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.encryption.session import DecryptionSession, EncryptionSession
 from .connection import Address
-from .exceptions import ConnectionClosed
+from .exceptions import ConnectionClosed, UnsupportedProtocol
+
+_logger = log.get_logger(__name__)
 
 
 class ContentType(Enum):
@@ -17,6 +58,7 @@ class ContentType(Enum):
 
     JSON = "json"
     BINARY = "binary"
+    FILE = "file"
 
     def __str__(self) -> str:  # pylint: disable=invalid-str-returned
         return cast(str, self.value)
@@ -33,6 +75,10 @@ class JSONContentType(Enum):
 
     HANDSHAKE = "handshake"
     PUBKEY = "pubkey"
+    SESSION_KEY = "session_key"
+    FILE_OFFER = "file_offer"
+    FILE_ACK = "file_ack"
+    GOODBYE = "goodbye"
 
     def __str__(self) -> str:  # pylint: disable=invalid-str-returned
         return cast(str, self.value)
@@ -44,6 +90,63 @@ class JSONContentType(Enum):
         return list(map(lambda t: t.value, cls))  # type: ignore
 
 
+class Priority(IntEnum):
+    """Priority of a stream of frames, frames of more urgent streams are sent first."""
+
+    CONTROL = 0
+    INTERACTIVE = 1
+    BULK = 2
+
+
+# Binary headers of the protocol v2 consist of a version, flags, codes of a content
+# type, an encryption mode and a compression codec, length of a content encoding
+# name, a session key id and a content length, followed by the encoding name.
+# Fragments of messages in the protocol v3 have a stream id before the encoding name,
+# and file chunks have a transfer id and an offset after that.
+_BINARY_HEADERS = struct.Struct(">BBBBBBIQ")
+_STREAM_ID = struct.Struct(">I")
+# Transfer id of a file chunk as 16 raw bytes of its hex UUID, and the chunk offset.
+_FILE_CHUNK = struct.Struct(">16sQ")
+_FLAGS_OFFSET = 1
+_ENCODING_LEN_OFFSET = 5
+_BINARY_HEADER_FIELDS = (
+    "byteorder",
+    "content_length",
+    "content_type",
+    "content_encoding",
+    "session_key_id",
+    "encryption_mode",
+    "compression",
+    "stream_id",
+    "more",
+    "transfer_id",
+    "offset",
+)
+_FLAG_LITTLE_ENDIAN = 1
+_FLAG_ENCRYPTED = 2
+_FLAG_COMPRESSED = 4
+# More fragments of the message follow on the same stream.
+_FLAG_MORE = 8
+# A transfer id and an offset of a file chunk follow the stream id.
+_FLAG_FILE_CHUNK = 16
+# Streams of control frames and chat messages, other streams are opened on demand.
+_CONTROL_STREAM = 0
+_CHAT_STREAM = 1
+# Codes are positions in these tuples, new values may only be appended.
+_CONTENT_TYPES = (ContentType.JSON, ContentType.BINARY, ContentType.FILE)
+_ENCRYPTION_MODES = (
+    EncryptionMode.ECB,
+    EncryptionMode.CBC,
+    EncryptionMode.CFB,
+    EncryptionMode.OFB,
+    EncryptionMode.GCM,
+    EncryptionMode.CHACHA20_POLY1305,
+)
+_CODECS = ("zlib", "lz4", "zstd")
+# Maximum number of buffers passed to a single `sendmsg` call.
+_IOV_MAX = os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 16
+
+
 class MessageHeaders(SimpleNamespace):
     """A header sent between applications."""
 
@@ -74,6 +177,9 @@ class MessageHeaders(SimpleNamespace):
 
         data["content_type"] = ContentType(data["content_type"])
 
+        if "encryption_mode" in data:
+            data["encryption_mode"] = EncryptionMode(data["encryption_mode"])
+
         return MessageHeaders(**data)
 
     @staticmethod
@@ -82,29 +188,247 @@ class MessageHeaders(SimpleNamespace):
 
         return json.dumps(header.__dict__, default=str, ensure_ascii=False)
 
+    @staticmethod
+    def from_binary(data: Union[bytes, memoryview]) -> "MessageHeaders":
+        """Convert binary headers of the protocol v2 or v3 to message headers."""
+
+        (
+            version,
+            flags,
+            content_type,
+            encryption_mode,
+            codec,
+            encoding_len,
+            session_key_id,
+            content_length,
+        ) = _BINARY_HEADERS.unpack_from(data)
+
+        if version not in (2, 3):
+            raise ValueError(f"Cannot convert headers of protocol version {version}")
+
+        stream_id_len = _STREAM_ID.size if version == 3 else 0
+        encoding_offset = _BINARY_HEADERS.size + _extensions_len(version, flags)
+
+        try:
+            fields: Dict[str, Any] = {
+                "byteorder": "little" if flags & _FLAG_LITTLE_ENDIAN else "big",
+                "content_length": content_length,
+                "content_type": _CONTENT_TYPES[content_type],
+                "content_encoding": bytes(
+                    data[encoding_offset : encoding_offset + encoding_len]
+                ).decode(MessageHeaders.ENCODING),
+            }
+
+            if version == 3:
+                (fields["stream_id"],) = _STREAM_ID.unpack_from(
+                    data, _BINARY_HEADERS.size
+                )
+                fields["more"] = bool(flags & _FLAG_MORE)
+
+            if flags & _FLAG_FILE_CHUNK:
+                transfer_id, fields["offset"] = _FILE_CHUNK.unpack_from(
+                    data, _BINARY_HEADERS.size + stream_id_len
+                )
+                fields["transfer_id"] = transfer_id.hex()
+
+            if flags & _FLAG_ENCRYPTED:
+                fields["session_key_id"] = session_key_id
+                fields["encryption_mode"] = _ENCRYPTION_MODES[encryption_mode]
+
+            if flags & _FLAG_COMPRESSED:
+                fields["compression"] = _CODECS[codec]
+        except IndexError:
+            raise ValueError("Cannot convert headers, unknown field value") from None
+
+        return MessageHeaders(**fields)
+
+    @staticmethod
+    def to_binary(header: "MessageHeaders") -> bytes:
+        """Convert message headers to the binary format of the protocol v2.
+
+        Headers of a fragment of a message are converted to the format of the
+        protocol v3. Raises `ValueError` if the headers cannot be represented in the
+        format.
+        """
+
+        unknown = set(header.__dict__).difference(_BINARY_HEADER_FIELDS)
+
+        if unknown:
+            raise ValueError(f"Cannot convert headers {unknown} to the binary format")
+
+        flags = _FLAG_LITTLE_ENDIAN if header.byteorder == "little" else 0
+        stream_id = getattr(header, "stream_id", None)
+        session_key_id = getattr(header, "session_key_id", 0)
+        encryption_mode = 0
+        codec = 0
+        encoding = header.content_encoding.encode(MessageHeaders.ENCODING)
+
+        if hasattr(header, "session_key_id"):
+            flags |= _FLAG_ENCRYPTED
+            encryption_mode = _ENCRYPTION_MODES.index(header.encryption_mode)
+
+        if hasattr(header, "compression"):
+            flags |= _FLAG_COMPRESSED
+            codec = _CODECS.index(header.compression)
+
+        if getattr(header, "more", False):
+            flags |= _FLAG_MORE
+
+        file_chunk = b""
+
+        if hasattr(header, "transfer_id") or hasattr(header, "offset"):
+            flags |= _FLAG_FILE_CHUNK
+
+        try:
+            if flags & _FLAG_FILE_CHUNK:
+                file_chunk = _FILE_CHUNK.pack(
+                    bytes.fromhex(header.transfer_id), header.offset
+                )
+
+            return (
+                _BINARY_HEADERS.pack(
+                    2 if stream_id is None else 3,
+                    flags,
+                    _CONTENT_TYPES.index(header.content_type),
+                    encryption_mode,
+                    codec,
+                    len(encoding),
+                    session_key_id,
+                    header.content_length,
+                )
+                + (b"" if stream_id is None else _STREAM_ID.pack(stream_id))
+                + file_chunk
+                + encoding
+            )
+        except (AttributeError, TypeError, struct.error) as e:
+            raise ValueError(f"Cannot convert headers to the binary format: {e}") from e
+
+    @staticmethod
+    def from_bytes(data: Union[bytes, memoryview]) -> "MessageHeaders":
+        """Convert headers preceded by a metaheader to message headers.
+
+        The protocol version is detected from the first byte, it is always zero for
+        JSON headers of the protocol v1.
+        """
+
+        if data[0] == 0:
+            return MessageHeaders.from_json(
+                _decode_json(data[METAHEADER_LEN:], MessageHeaders.ENCODING)
+            )
+
+        return MessageHeaders.from_binary(data)
+
+    @staticmethod
+    def to_bytes(header: "MessageHeaders", version: int = 1) -> bytes:
+        """Convert message headers to bytes preceded by a metaheader.
+
+        Headers that cannot be represented in the binary format of the protocol v2
+        fall back to JSON, which every version is able to read.
+        """
+
+        if version >= 2:
+            try:
+                return MessageHeaders.to_binary(header)
+            except ValueError:
+                pass
+
+        headers = MessageHeaders.to_json(header).encode(MessageHeaders.ENCODING)
+
+        return struct.pack(">Q", len(headers)) + headers
+
 
 class Message:
     """Message sent between applications."""
 
-    def __init__(self, headers: MessageHeaders, content: bytes) -> None:
+    def __init__(
+        self,
+        headers: MessageHeaders,
+        content: bytes,
+        session: Optional[DecryptionSession] = None,
+    ) -> None:
         self.headers = headers
         self.content = content
+        self.session = session
+        # Correlates spans of the message when tracing is on.
+        self.trace_id: Optional[int] = None
 
     def __repr__(self) -> str:
         return f"Message({repr({'headers': self.headers, 'content': self.content})})"
 
     def __str__(self) -> str:
         ellipsis = "..." if self.headers.content_length > 64 else ""
+        # Repr of the first 64 bytes is at least 64 characters long, so it can be
+        # truncated the same way as repr of the whole content.
+        content = repr(self.content[:64])[:64]
 
-        return f"Message(len: {self.headers.content_length}) {{ {self.content!r:.64}{ellipsis} }}"
+        return f"Message(len: {self.headers.content_length}) {{ {content}{ellipsis} }}"
 
-    def to_bytes(self) -> bytes:
-        """Convert the message to bytes."""
+    def to_bytes(self, version: int = 1) -> bytes:
+        """Convert the message to bytes in a specified protocol version."""
+
+        return MessageHeaders.to_bytes(self.headers, version) + self.content
+
+    def to_buffers(self, version: int = 1) -> Tuple[bytes, bytes]:
+        """Convert the message to headers and content buffers without copying."""
+
+        return MessageHeaders.to_bytes(self.headers, version), self.content
+
+    def fragments(self, stream_id: int, size: int) -> Iterator["Message"]:
+        """Split the message into fragments of a stream, if it is larger than `size`.
+
+        Every fragment repeats the headers of the message with its own content length
+        and a flag telling whether more fragments follow.
+        """
+
+        if self.headers.content_length <= size:
+            yield self
 
-        headers = MessageHeaders.to_json(self.headers).encode(MessageHeaders.ENCODING)
-        metaheader = struct.pack(">Q", len(headers))
+            return
 
-        return metaheader + headers + self.content
+        content = memoryview(self.content)
+
+        for start in range(0, len(content), size):
+            chunk = content[start : start + size]
+
+            yield _fragment(
+                self.headers,
+                stream_id,
+                cast(bytes, chunk),
+                start + len(chunk) < len(content),
+            )
+
+    @property
+    def encrypted(self) -> bool:
+        """Determine whether the content of the message is encrypted."""
+
+        return hasattr(self.headers, "session_key_id")
+
+    def decrypt(self, rec_privkey: Key) -> bytes:
+        """Decrypt content of the message using a receipent key.
+
+        Raises `ValueError` if the message is not encrypted or its content fails
+        authentication.
+        """
+
+        if not self.encrypted or self.session is None:
+            raise ValueError("Cannot decrypt a message that is not encrypted")
+
+        with tracing.span("decrypt_message", self.trace_id):
+            content = self.session.decrypt(
+                self.headers.session_key_id,
+                self.content,
+                self.headers.encryption_mode,
+                rec_privkey,
+            )
+            codec = getattr(self.headers, "compression", None)
+
+            if codec is None:
+                return content
+
+            try:
+                return decompress(content, codec)
+            except ValueError:
+                return crypto.random_text()
 
     @staticmethod
     def of(
@@ -147,7 +471,8 @@ class JSONMessageContent(SimpleNamespace):
 
         if content_type != ContentType.JSON:
             raise ValueError(
-                f"Cannot extract JSON content from a message with declared content type as {content_type}"
+                "Cannot extract JSON content from a message with declared content "
+                f"type as {content_type}"
             )
 
         data = _decode_json(message.content, JSONMessageContent.ENCODING)
@@ -166,17 +491,459 @@ class JSONMessageContent(SimpleNamespace):
         return JSONMessageContent(**data)
 
 
+class Handshake(SimpleNamespace):
+    """Handshake sent by a client before it sends its pubkey.
+
+    A client also sends a handshake as a reply on an established connection when the
+    endpoint connects to its server again, so the endpoint does not have to wait for
+    a new connection to learn whether its session was resumed.
+    """
+
+    ret_addr: Address
+    # Fingerprint of the receipent's pubkey if the client knows it already.
+    pubkey_fingerprint: Optional[str]
+    # Compression codecs the client can decompress, in order of preference.
+    compression: List[str]
+    # Protocol versions the client's server is able to read.
+    protocol_versions: List[int]
+    # Token issued by the client's server, the receipent presents it to resume its
+    # session after reconnecting.
+    resumption_token: Optional[str]
+    # Token issued by the receipent's server, presented to resume a session.
+    resume_token: Optional[str]
+    # Whether the client's server resumed the session of the receipent.
+    resumed: bool
+    # Whether the handshake replies to a handshake on an established connection.
+    reply: bool
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ret_addr: Address,
+        pubkey_fingerprint: Optional[str] = None,
+        compression: Iterable[str] = (),
+        protocol_versions: Iterable[int] = PROTOCOL_VERSIONS,
+        *,
+        resumption_token: Optional[str] = None,
+        resume_token: Optional[str] = None,
+        resumed: bool = False,
+        reply: bool = False,
+    ) -> None:
+        super().__init__(
+            ret_addr=ret_addr,
+            pubkey_fingerprint=pubkey_fingerprint,
+            compression=list(compression),
+            protocol_versions=list(protocol_versions),
+            resumption_token=resumption_token,
+            resume_token=resume_token,
+            resumed=resumed,
+            reply=reply,
+        )
+
+    @property
+    def protocol_version(self) -> int:
+        """Get the newest protocol version supported by both endpoints.
+
+        Raises `UnsupportedProtocol` if the endpoints have no version in common.
+        """
+
+        versions = set(self.protocol_versions).intersection(PROTOCOL_VERSIONS)
+
+        if not versions:
+            raise UnsupportedProtocol(
+                f"No common protocol version in {self.protocol_versions}"
+            )
+
+        return max(versions)
+
+    def to_message(self) -> Message:
+        """Convert the handshake to a message."""
+
+        fields: Dict[str, Any] = {
+            "content_type": JSONContentType.HANDSHAKE,
+            "ret_host": self.ret_addr.host,
+            "ret_port": self.ret_addr.port,
+            "compression": self.compression,
+            "protocol_versions": self.protocol_versions,
+        }
+
+        if self.pubkey_fingerprint is not None:
+            fields["pubkey_fingerprint"] = self.pubkey_fingerprint
+
+        if self.resumption_token is not None:
+            fields["resumption_token"] = self.resumption_token
+
+        if self.resume_token is not None:
+            fields["resume_token"] = self.resume_token
+
+        if self.resumed:
+            fields["resumed"] = True
+
+        if self.reply:
+            fields["reply"] = True
+
+        return Message.of(JSONMessageContent(**fields).to_bytes(), ContentType.JSON)
+
+    @staticmethod
+    def from_message(message: Message) -> "Handshake":
+        """Extract a handshake from a message."""
+
+        return Handshake.from_content(JSONMessageContent.from_message(message))
+
+    @staticmethod
+    def from_content(handshake_content: JSONMessageContent) -> "Handshake":
+        """Extract a handshake from content of a JSON message."""
+
+        if handshake_content.content_type != JSONContentType.HANDSHAKE:
+            raise ValueError(
+                f"Expected a handshake but got {handshake_content.content_type}"
+            )
+
+        return Handshake(
+            Address(handshake_content.ret_host, handshake_content.ret_port),
+            getattr(handshake_content, "pubkey_fingerprint", None),
+            getattr(handshake_content, "compression", ()),
+            # Endpoints that do not send versions support only the protocol v1.
+            getattr(handshake_content, "protocol_versions", (1,)),
+            resumption_token=getattr(handshake_content, "resumption_token", None),
+            resume_token=getattr(handshake_content, "resume_token", None),
+            resumed=getattr(handshake_content, "resumed", False),
+            reply=getattr(handshake_content, "reply", False),
+        )
+
+
+class FileOffer(SimpleNamespace):
+    """Offer of a file sent before its chunks, and again when a transfer resumes."""
+
+    transfer_id: str
+    # Name of the file encrypted with the transfer key.
+    name: bytes
+    size: int
+    chunk_size: int
+    encryption_mode: EncryptionMode
+    # Transfer key wrapped with the receipent's pubkey.
+    key: bytes
+
+    def to_message(self) -> Message:
+        """Convert the offer to a message."""
+
+        return Message.of(
+            JSONMessageContent(
+                content_type=JSONContentType.FILE_OFFER,
+                transfer_id=self.transfer_id,
+                name=base64.b64encode(self.name).decode("ascii"),
+                size=self.size,
+                chunk_size=self.chunk_size,
+                encryption_mode=self.encryption_mode,
+                key=base64.b64encode(self.key).decode("ascii"),
+            ).to_bytes(),
+            ContentType.JSON,
+        )
+
+    @staticmethod
+    def from_content(content: JSONMessageContent) -> "FileOffer":
+        """Extract an offer from content of a JSON message."""
+
+        if content.content_type != JSONContentType.FILE_OFFER:
+            raise ValueError(f"Expected a file offer but got {content.content_type}")
+
+        if (
+            not isinstance(content.size, int)
+            or not isinstance(content.chunk_size, int)
+            or not 0 <= content.size <= MAX_FILE_SIZE
+            or not 0 < content.chunk_size <= MAX_FILE_CHUNK_SIZE
+        ):
+            raise ValueError(f"Invalid size of a file transfer {content.transfer_id}")
+
+        return FileOffer(
+            transfer_id=content.transfer_id,
+            name=base64.b64decode(content.name),
+            size=content.size,
+            chunk_size=content.chunk_size,
+            encryption_mode=EncryptionMode(content.encryption_mode),
+            key=base64.b64decode(content.key),
+        )
+
+
+class FileAck(SimpleNamespace):
+    """Acknowledgement of all chunks of a file received before an offset."""
+
+    transfer_id: str
+    offset: int
+
+    def to_message(self) -> Message:
+        """Convert the acknowledgement to a message."""
+
+        return Message.of(
+            JSONMessageContent(
+                content_type=JSONContentType.FILE_ACK,
+                transfer_id=self.transfer_id,
+                offset=self.offset,
+            ).to_bytes(),
+            ContentType.JSON,
+        )
+
+    @staticmethod
+    def from_content(content: JSONMessageContent) -> "FileAck":
+        """Extract an acknowledgement from content of a JSON message."""
+
+        if content.content_type != JSONContentType.FILE_ACK:
+            raise ValueError(f"Expected a file ack but got {content.content_type}")
+
+        return FileAck(transfer_id=content.transfer_id, offset=content.offset)
+
+
+class FrameParser:  # pylint: disable=too-many-instance-attributes
+    """Parses frames received from an endpoint into messages.
+
+    The parser does no I/O on its own. Received bytes are written directly into the
+    buffer returned by `get_buffer` and announced with `buffer_updated`, which is the
+    interface of both `socket.recv_into` and `asyncio.BufferedProtocol`. Fragments of
+    messages sent on interleaved streams are joined back per stream. Messages larger
+    than `max_message_size` bytes are rejected, unless the limit is None.
+    """
+
+    def __init__(
+        self, endpoint_addr: Address, max_message_size: Optional[int] = MAX_MESSAGE_SIZE
+    ) -> None:
+        self.endpoint_addr = endpoint_addr
+        self.max_message_size = max_message_size
+        # Received bytes that are not consumed yet lie between start and end.
+        self._buffer = bytearray(BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._headers: Optional[MessageHeaders] = None
+        self._messages: Deque[Message] = deque()
+        self._session = DecryptionSession()
+        # Headers of the first fragment and fragments received so far per stream.
+        self._partial: Dict[int, Tuple[MessageHeaders, List[bytes], int]] = {}
+        self._partial_size = 0
+        self._bytes_received = metrics.BYTES_RECEIVED.labels(str(endpoint_addr))
+        self._frames_received = metrics.FRAMES_RECEIVED.labels(str(endpoint_addr))
+        self._buffer_size = metrics.RECEIVE_BUFFER.labels(str(endpoint_addr))
+        self._buffer_size.set(BUFFER_SIZE)
+
+    def get_buffer(self) -> memoryview:
+        """Get a free part of the buffer to receive bytes into."""
+
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Parse all complete frames after bytes are received into the buffer.
+
+        Raises `ValueError` if a frame is invalid or larger than the size limit.
+        """
+
+        self._end += nbytes
+        self._bytes_received.inc(nbytes)
+        self._process_frames()
+
+    @property
+    def session(self) -> DecryptionSession:
+        """Get the session decrypting messages of the endpoint."""
+
+        return self._session
+
+    @session.setter
+    def session(self, session: DecryptionSession) -> None:
+        # Only messages parsed afterwards are decrypted with a resumed session.
+        self._session = session
+
+    @property
+    def pending(self) -> int:
+        """Get number of parsed messages that were not taken yet."""
+
+        return len(self._messages)
+
+    def next_message(self) -> Optional[Message]:
+        """Get the next parsed message if there is any."""
+
+        return self._messages.popleft() if self._messages else None
+
+    def release(self) -> None:
+        """Release the buffer and metrics of the endpoint."""
+
+        self._view.release()
+
+        for metric in (
+            metrics.BYTES_RECEIVED,
+            metrics.FRAMES_RECEIVED,
+            metrics.RECEIVE_BUFFER,
+        ):
+            metric.remove(str(self.endpoint_addr))
+
+    def _process_frames(self) -> None:
+        frames = 0
+
+        while True:
+            pending = self._end - self._start
+
+            if self._headers is None:
+                if pending < METAHEADER_LEN:
+                    self._reserve(METAHEADER_LEN)
+                    break
+
+                headers_len = self._headers_len(pending)
+
+                if headers_len is None or pending < headers_len:
+                    self._reserve(headers_len or _BINARY_HEADERS.size)
+                    break
+
+                with tracing.span("headers", length=headers_len):
+                    self._headers = MessageHeaders.from_bytes(
+                        self._view[self._start : self._start + headers_len]
+                    )
+
+                self._start += headers_len
+                pending -= headers_len
+
+            headers = self._headers
+            content_length = headers.content_length
+            self._check_size(content_length)
+
+            if pending < content_length:
+                self._reserve(content_length)
+                break
+
+            self._headers = None
+            frames += 1
+
+            with tracing.span("content", length=content_length):
+                self._process_content(headers, content_length)
+
+        self._frames_received.inc(frames)
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+            # Do not hold on to memory grown for a single large message.
+            if self._headers is None and len(self._buffer) > BUFFER_SIZE:
+                self._view.release()
+                self._buffer = bytearray(BUFFER_SIZE)
+                self._view = memoryview(self._buffer)
+                self._buffer_size.set(BUFFER_SIZE)
+
+    def _process_content(self, headers: MessageHeaders, content_length: int) -> None:
+        content = bytes(self._view[self._start : self._start + content_length])
+        self._start += content_length
+
+        if hasattr(headers, "stream_id"):
+            reassembled = self._reassemble(headers, content)
+
+            if reassembled is None:
+                return
+
+            headers, content = reassembled
+
+        if hasattr(headers, "session_key_id"):
+            message = Message(headers, content, self._session)
+            message.trace_id = tracing.new_id()
+            self._messages.append(message)
+        else:
+            message = Message(headers, content)
+
+            if not self._process_session_key(message):
+                message.trace_id = tracing.new_id()
+                self._messages.append(message)
+
+    def _reassemble(
+        self, headers: MessageHeaders, content: bytes
+    ) -> Optional[Tuple[MessageHeaders, bytes]]:
+        first, fragments, size = self._partial.pop(headers.stream_id, (headers, [], 0))
+        fragments.append(content)
+        size += len(content)
+        # Fragments of all streams count against the limit of a single message.
+        self._partial_size += len(content)
+        self._check_size(self._partial_size)
+
+        if headers.more:
+            if len(self._partial) >= MAX_PARTIAL_STREAMS:
+                raise ValueError(
+                    f"Too many interleaved streams from {self.endpoint_addr}, the "
+                    f"limit is {MAX_PARTIAL_STREAMS}"
+                )
+
+            self._partial[headers.stream_id] = (first, fragments, size)
+
+            return None
+
+        self._partial_size -= size
+
+        del first.stream_id, first.more
+        first.content_length = size
+
+        return first, b"".join(fragments)
+
+    def _process_session_key(self, message: Message) -> bool:
+        if message.headers.content_type != ContentType.JSON:
+            return False
+
+        content = JSONMessageContent.from_message(message)
+
+        if content.content_type != JSONContentType.SESSION_KEY:
+            return False
+
+        self._session.add_key(content.key_id, base64.b64decode(content.key))
+
+        _logger.debug("New session key {} from {}", content.key_id, self.endpoint_addr)
+
+        return True
+
+    def _headers_len(self, pending: int) -> Optional[int]:
+        # JSON headers of the protocol v1 start with a zero byte of their length.
+        if self._buffer[self._start] != 0:
+            if pending < _BINARY_HEADERS.size:
+                return None
+
+            encoding_len = self._buffer[self._start + _ENCODING_LEN_OFFSET]
+            extensions_len = _extensions_len(
+                self._buffer[self._start], self._buffer[self._start + _FLAGS_OFFSET]
+            )
+
+            return _BINARY_HEADERS.size + extensions_len + encoding_len
+
+        headers_len = cast(int, struct.unpack_from(">Q", self._buffer, self._start)[0])
+        self._check_size(headers_len)
+
+        return METAHEADER_LEN + headers_len
+
+    def _check_size(self, size: int) -> None:
+        if self.max_message_size is not None and size > self.max_message_size:
+            raise ValueError(
+                f"Frame of {size} bytes from {self.endpoint_addr} exceeds the limit "
+                f"of {self.max_message_size} bytes"
+            )
+
+    def _reserve(self, size: int) -> None:
+        # Make room for a frame of a given size, so it is received in place.
+        if self._start + size < len(self._buffer):
+            return
+
+        pending = self._end - self._start
+
+        if size < len(self._buffer):
+            self._buffer[:pending] = bytes(self._view[self._start : self._end])
+        else:
+            buffer = bytearray(max(size + 1, 2 * len(self._buffer)))
+            buffer[:pending] = self._view[self._start : self._end]
+            self._view.release()
+            self._buffer = buffer
+            self._view = memoryview(buffer)
+            self._buffer_size.set(len(buffer))
+
+        self._start = 0
+        self._end = pending
+
+
 class MessageReader:
-    """Reads messages from an endpoint."""
+    """Reads messages from an endpoint, at most `max_message_size` bytes large."""
 
-    def __init__(self, sock: socket.socket) -> None:
+    def __init__(
+        self, sock: socket.socket, max_message_size: Optional[int] = MAX_MESSAGE_SIZE
+    ) -> None:
         self.endpoint_addr = Address(*sock.getpeername())
         self._sock = sock
-        self._buffer = b""
-        self._headers_len: Optional[int] = None
-        self._headers: Optional[MessageHeaders] = None
-        self._content: Optional[bytes] = None
-        self._request_reading = True
+        self._parser = FrameParser(self.endpoint_addr, max_message_size)
         self._closed = False
 
     def __del__(self) -> None:
@@ -186,7 +953,7 @@ class MessageReader:
         """Close the reader and free used resources."""
 
         if not self._closed:
-            print(f"Closing the reader from {self.endpoint_addr}")
+            _logger.debug("Closing the reader from {}", self.endpoint_addr)
 
             try:
                 self._sock.shutdown(socket.SHUT_RDWR)
@@ -194,24 +961,23 @@ class MessageReader:
                 pass
             finally:
                 self._sock.close()
+                self._parser.release()
 
             self._closed = True
 
-    def read_handshake(self) -> Address:
+    def read_handshake(self) -> Handshake:
         """Read a handshake from the endpoint."""
 
-        handshake_content = JSONMessageContent.from_message(
-            self.read(content_type=ContentType.JSON)
-        )
-
-        return Address(handshake_content.ret_host, handshake_content.ret_port)
+        return Handshake.from_message(self.read(content_type=ContentType.JSON))
 
-    def read_pubkey(self) -> RSA.RsaKey:
-        """Read a pubkey from the endpoint."""
+    def read_pubkey(self, known_peers: Optional[KnownPeers] = None) -> Key:
+        """Read a pubkey from the endpoint.
 
-        pubkey_message = self.read(content_type=ContentType.BINARY)
+        The endpoint sends either a full key or only a fingerprint of a key that has
+        to be present in the given known peers.
+        """
 
-        return RSA.import_key(pubkey_message.content)
+        return pubkey_from_message(self.read(), known_peers)
 
     def read(self, content_type: Optional[ContentType] = None) -> Message:
         """Read a single message."""
@@ -221,84 +987,120 @@ class MessageReader:
         while message is None:
             message = self.try_read()
 
-        message_type = message.headers.content_type
+        return check_message(message, content_type, self.endpoint_addr)
 
-        if content_type is None or message_type == content_type:
-            print(f"New message from {self.endpoint_addr}: {message}")
+    def try_read(self) -> Optional[Message]:
+        """Try to read a single message.
 
-            return message
+        All complete messages received from the socket are buffered, so the socket is
+        read only if there are no buffered messages left.
+        """
 
-        raise ValueError(f"Expected content type {content_type} but got {message_type}")
+        message = self._parser.next_message()
 
-    def try_read(self) -> Optional[Message]:
-        """Try to read a single message."""
+        if message is None:
+            with tracing.span("recv"):
+                received = self._sock.recv_into(self._parser.get_buffer())
 
-        if self._request_reading:
-            data = self._sock.recv(BUFFER_SIZE)
+                if received == 0:
+                    raise ConnectionClosed()
 
-            if data == b"":
-                raise ConnectionClosed()
+                self._parser.buffer_updated(received)
+            message = self._parser.next_message()
 
-            self._buffer += data
-            self._request_reading = False
+        return message
 
-        if self._headers_len is None:
-            self._process_metaheader()
 
-        if self._headers_len is not None and self._headers is None:
-            self._process_headers(self._headers_len)
+class FrameScheduler:
+    """Orders frames of logical streams multiplexed over a single connection.
 
-        if self._headers is not None and self._content is None:
-            self._process_content(self._headers)
+    Frames of a stream are sent in the order they were pushed. Streams of a more
+    urgent priority always go first and streams of the same priority take turns
+    frame by frame, so a large message split into fragments does not hold back
+    messages of other streams. Frames of a stream are always pushed with the same
+    priority.
+    """
 
-            if self._content is not None:
-                headers = self._headers  # type: ignore
-                content = self._content
-                self._headers_len = None
-                self._headers = None
-                self._content = None
+    def __init__(self) -> None:
+        self._streams: List["OrderedDict[int, Deque[Tuple[bytes, ...]]]"] = [
+            OrderedDict() for _ in Priority
+        ]
+        self._pending = [0 for _ in Priority]
 
-                return Message(headers, content)
+    def __len__(self) -> int:
+        return sum(self._pending)
 
-        return None
+    def push(
+        self, stream_id: int, priority: Priority, buffers: Tuple[bytes, ...]
+    ) -> None:
+        """Queue buffers of a frame at the end of a stream."""
 
-    def _process_metaheader(self) -> None:
-        if len(self._buffer) >= METAHEADER_LEN:
-            self._headers_len = struct.unpack(">Q", self._buffer[:METAHEADER_LEN])[0]
-            self._buffer = self._buffer[METAHEADER_LEN:]
-        else:
-            self._request_reading = True
+        streams = self._streams[priority]
+        frames = streams.get(stream_id)
 
-    def _process_headers(self, headers_len: int) -> None:
-        if len(self._buffer) >= headers_len:
-            self._headers = MessageHeaders.from_json(
-                _decode_json(self._buffer[:headers_len], MessageHeaders.ENCODING)
-            )
-            self._buffer = self._buffer[headers_len:]
-        else:
-            self._request_reading = True
+        if frames is None:
+            frames = streams[stream_id] = deque()
 
-    def _process_content(self, headers: MessageHeaders) -> None:
-        if len(self._buffer) >= headers.content_length:
-            self._content = self._buffer[: headers.content_length]
-            self._buffer = self._buffer[headers.content_length :]
+        frames.append(buffers)
+        self._pending[priority] += 1
 
-            if self._buffer == b"":
-                self._request_reading = True
-        else:
-            self._request_reading = True
+    def pop(self) -> Optional[Tuple[bytes, ...]]:
+        """Take buffers of the next frame to be sent, if there is any."""
 
+        for priority, streams in enumerate(self._streams):
+            if not streams:
+                continue
 
-class MessageWriter:
-    """Writes messages to an endpoint."""
+            stream_id, frames = next(iter(streams.items()))
+            buffers = frames.popleft()
+            self._pending[priority] -= 1
 
-    def __init__(self, sock: socket.socket) -> None:
-        self.endpoint_addr = Address(*sock.getpeername())
-        self._endpoint_pubkey: Optional[RSA.RsaKey] = None
+            if frames:
+                streams.move_to_end(stream_id)
+            else:
+                del streams[stream_id]
+
+            return buffers
+
+        return None
+
+    def pending(self, priority: Priority = Priority.BULK) -> int:
+        """Get number of queued frames of a priority and more urgent ones."""
+
+        return sum(self._pending[: priority + 1])
+
+
+class BaseMessageWriter(ABC):  # pylint: disable=too-many-instance-attributes
+    """Writes messages to an endpoint over any transport.
+
+    In the protocol v3, frames are multiplexed over logical streams with a
+    `FrameScheduler`: control frames go first, then chat messages, then bulk streams
+    of file transfers and messages larger than `fragment_size`, which are split into
+    fragments. Older endpoints get frames in the order they are written.
+    """
+
+    def __init__(self, endpoint_addr: Address) -> None:
+        self.endpoint_addr = endpoint_addr
+        self.fragment_size = FRAGMENT_SIZE
+        self._endpoint_pubkey: Optional[Key] = None
+        self._session: Optional[EncryptionSession] = None
         self._connected = False
         self._closed = False
         self._sent_pubkey = False
-        self._sock = sock
+        self.compression: Optional[str] = None
+        # Handshakes are always written in the protocol v1.
+        self.protocol_version = 1
+        self._scheduler = FrameScheduler()
+        self._scheduler_lock = threading.Lock()
+        # Notified when a thread stops sending frames of the scheduler.
+        self._pumped = threading.Condition(self._scheduler_lock)
+        self._pumping = False
+        self._stream_ids = itertools.count(_CHAT_STREAM + 1)
+        self._file_streams: Dict[str, int] = {}
+        self._handshake_sent: Optional[float] = None
+        self._bytes_sent = metrics.BYTES_SENT.labels(str(endpoint_addr))
+        self._frames_sent = metrics.FRAMES_SENT.labels(str(endpoint_addr))
+        metrics.SCHEDULED_FRAMES.track(self._scheduler.__len__, str(endpoint_addr))
 
     def __del__(self) -> None:
         self.close()
@@ -309,74 +1111,592 @@ class MessageWriter:
 
         return self._endpoint_pubkey is not None and self._connected
 
+    @property
+    def sent_pubkey(self) -> bool:
+        """Determine whether our pubkey or its fingerprint was sent to the endpoint."""
+
+        return self._sent_pubkey
+
+    @property
+    def session(self) -> Optional[EncryptionSession]:
+        """Get the session encrypting messages to the endpoint."""
+
+        return self._session
+
     def close(self) -> None:
         """Close the writer and free used resources."""
 
         if not self._closed:
-            print(f"Closing the writer to {self.endpoint_addr}")
+            _logger.debug("Closing the writer to {}", self.endpoint_addr)
+            self._close()
 
-            try:
-                self._sock.shutdown(socket.SHUT_RDWR)
-            except OSError:
-                pass
-            finally:
-                self._sock.close()
+            for metric in (
+                metrics.BYTES_SENT,
+                metrics.FRAMES_SENT,
+                metrics.SCHEDULED_FRAMES,
+            ):
+                metric.remove(str(self.endpoint_addr))
 
             self._closed = True
 
-    def update_endpoint_pubkey(self, pubkey: RSA.RsaKey) -> None:
+    def update_endpoint_pubkey(self, pubkey: Key) -> None:
         """Update pubkey of the endpoint."""
 
         self._endpoint_pubkey = pubkey
+        self._session = EncryptionSession(pubkey)
 
         if self._sent_pubkey:
-            self._connected = True
+            self._established()
+
+    def resume(self, pubkey: Key, session: EncryptionSession) -> None:
+        """Resume a session the endpoint's server kept from a previous connection.
+
+        The current session key is announced again, the endpoint ignores it if it
+        already has the key, so neither side wraps or unwraps a new one.
+        """
 
-            print(f"Established connection to {self.endpoint_addr}")
+        self._endpoint_pubkey = pubkey
+        self._session = session
+        self._sent_pubkey = True
+        self._connected = True
+        self._observe_handshake()
+
+        if session.wrapped_key is not None:
+            self._write_session_key(session.key_id, session.wrapped_key)
+
+        _logger.info("Resumed connection to {}", self.endpoint_addr)
+
+    def write_handshake(self, handshake: Handshake) -> None:
+        """Write a handshake to the endpoint.
+
+        A fingerprint of the endpoint's pubkey that is already known lets it send
+        only the fingerprint instead of the full pubkey.
+        """
+
+        _logger.debug("Sending a handshake to {}", self.endpoint_addr)
+        self._handshake_sent = time.perf_counter()
+        self._schedule(handshake.to_message(), Priority.CONTROL, _CONTROL_STREAM, 1)
+
+    def write_pubkey(self, pubkey_pem: bytes) -> None:
+        """Write a pubkey exported to the PEM format to the endpoint."""
+
+        _logger.debug("Sending a pubkey to {}", self.endpoint_addr)
+        self._schedule(
+            Message.of(pubkey_pem, ContentType.BINARY),
+            Priority.CONTROL,
+            _CONTROL_STREAM,
+        )
+        self._pubkey_sent()
 
-    def write_handshake(self, ret_address: Address) -> None:
-        """Write a handshake to the endpoint."""
+    def write_pubkey_fingerprint(self, pubkey_fingerprint: str) -> None:
+        """Write a fingerprint of a pubkey already known by the endpoint."""
 
-        print(f"Sending a handshake to {self.endpoint_addr}")
-        self._sock.sendall(
+        _logger.debug("Sending a pubkey fingerprint to {}", self.endpoint_addr)
+        self._schedule(
             Message.of(
                 JSONMessageContent(
-                    content_type=JSONContentType.HANDSHAKE,
-                    ret_host=ret_address.host,
-                    ret_port=ret_address.port,
+                    content_type=JSONContentType.PUBKEY,
+                    fingerprint=pubkey_fingerprint,
                 ).to_bytes(),
                 ContentType.JSON,
-            ).to_bytes()
+            ),
+            Priority.CONTROL,
+            _CONTROL_STREAM,
+        )
+        self._pubkey_sent()
+
+    def write(self, message: Message) -> None:
+        """Write a single message to the endpoint.
+
+        A message larger than `fragment_size` is sent on a bulk stream of its own,
+        so chat messages written after it may arrive before it.
+        """
+
+        assert (
+            self.connected
+        ), "Cannot write a message without an established connection"
+
+        _logger.debug(
+            "Sending a {} message of {} bytes to {}",
+            message.headers.content_type,
+            message.headers.content_length,
+            self.endpoint_addr,
+        )
+
+        if message.headers.content_length > self.fragment_size:
+            self._schedule(message, Priority.BULK, next(self._stream_ids))
+        else:
+            self._schedule(message, Priority.INTERACTIVE, _CHAT_STREAM)
+
+    def write_encrypted(
+        self,
+        content: bytes,
+        content_type: ContentType,
+        mode: EncryptionMode,
+        content_encoding: str = "utf-8",
+    ) -> None:
+        """Encrypt content with the session key and write it to the endpoint.
+
+        Content is compressed first with the codec negotiated with the endpoint,
+        unless it is too small or does not compress well.
+        """
+
+        assert (
+            self.connected
+        ), "Cannot write a message without an established connection"
+
+        session = cast(EncryptionSession, self._session)
+        compressed = (
+            compress(content, self.compression)
+            if self.compression is not None
+            else None
         )
 
-    def write_pubkey(self, pubkey: RSA.RsaKey) -> None:
-        """Write a pubkey to the endpoint."""
+        if session.needs_rekey:
+            self._write_session_key(*session.rekey())
 
-        print(f"Sending a pubkey to {self.endpoint_addr}")
-        self._sock.sendall(
-            Message.of(pubkey.export_key(), ContentType.BINARY).to_bytes()
+        message = Message.of(
+            session.encrypt(content if compressed is None else compressed, mode),
+            content_type,
+            content_encoding,
         )
+        message.headers.session_key_id = session.key_id
+        message.headers.encryption_mode = mode
 
+        if compressed is not None:
+            message.headers.compression = self.compression
+
+        self.write(message)
+
+    def write_file_offer(self, offer: FileOffer) -> None:
+        """Write an offer of a file that is about to be sent in chunks."""
+
+        assert (
+            self.connected
+        ), "Cannot write a message without an established connection"
+
+        _logger.debug(
+            "Sending a file offer {} to {}", offer.transfer_id, self.endpoint_addr
+        )
+        self._schedule(
+            offer.to_message(), Priority.BULK, self._file_stream(offer.transfer_id)
+        )
+
+    def write_file_chunk(self, transfer_id: str, offset: int, chunk: bytes) -> None:
+        """Write an encrypted chunk of a file starting at a given offset of the file."""
+
+        assert (
+            self.connected
+        ), "Cannot write a message without an established connection"
+
+        message = Message.of(chunk, ContentType.FILE)
+        message.headers.transfer_id = transfer_id
+        message.headers.offset = offset
+
+        self._schedule(message, Priority.BULK, self._file_stream(transfer_id))
+
+    def write_file_ack(self, ack: FileAck) -> None:
+        """Write an acknowledgement of received chunks of a file."""
+
+        assert (
+            self.connected
+        ), "Cannot write a message without an established connection"
+
+        self._schedule(ack.to_message(), Priority.CONTROL, _CONTROL_STREAM)
+
+    def write_goodbye(self) -> None:
+        """Tell the endpoint that the connection is about to be closed on purpose."""
+
+        self._schedule(
+            Message.of(
+                JSONMessageContent(content_type=JSONContentType.GOODBYE).to_bytes(),
+                ContentType.JSON,
+            ),
+            Priority.CONTROL,
+            _CONTROL_STREAM,
+        )
+
+    def flush(self) -> None:
+        """Send frames that wait in a send queue, if the writer has any."""
+
+    @abstractmethod
+    def _send(self, *buffers: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def _close(self) -> None:
+        pass
+
+    def _pump(self) -> None:
+        # A single thread sends frames, one per turn and without holding the lock,
+        # so frames scheduled meanwhile by other threads are sent by their priority
+        # and those threads return without waiting for a bulk stream to be sent.
+        with self._scheduler_lock:
+            if self._pumping:
+                return
+
+            self._pumping = True
+
+        try:
+            while True:
+                with self._scheduler_lock:
+                    buffers = self._scheduler.pop()
+
+                    if buffers is None:
+                        self._pumping = False
+                        self._pumped.notify_all()
+
+                        return
+
+                self._send_frame(buffers)
+        except BaseException:
+            with self._scheduler_lock:
+                self._pumping = False
+                self._pumped.notify_all()
+
+            raise
+
+    def _send_frame(self, buffers: Tuple[bytes, ...]) -> None:
+        self._send(*buffers)
+        self._bytes_sent.inc(sum(len(buffer) for buffer in buffers))
+        self._frames_sent.inc()
+
+    def _schedule(
+        self,
+        message: Message,
+        priority: Priority,
+        stream_id: int,
+        version: Optional[int] = None,
+    ) -> None:
+        version = self.protocol_version if version is None else version
+
+        if version < 3:
+            # Older endpoints cannot join fragments, so nothing is reordered.
+            frames = [message.to_buffers(version)]
+            priority, stream_id = Priority.CONTROL, _CONTROL_STREAM
+        else:
+            frames = [
+                fragment.to_buffers(version)
+                for fragment in message.fragments(stream_id, self.fragment_size)
+            ]
+
+        with self._scheduler_lock:
+            for buffers in frames:
+                self._scheduler.push(stream_id, priority, buffers)
+
+        self._pump()
+
+    def _file_stream(self, transfer_id: str) -> int:
+        stream_id = self._file_streams.get(transfer_id)
+
+        if stream_id is None:
+            stream_id = self._file_streams[transfer_id] = next(self._stream_ids)
+
+        return stream_id
+
+    def _pubkey_sent(self) -> None:
         self._sent_pubkey = True
 
         if self._endpoint_pubkey is not None:
-            self._connected = True
+            self._established()
 
-            print(f"Established connection to {self.endpoint_addr}")
+    def _established(self) -> None:
+        self._connected = True
+        self._observe_handshake()
 
-    def write(self, message: Message) -> None:
-        """Write a single message to the endpoint."""
+        _logger.info("Established connection to {}", self.endpoint_addr)
+
+    def _observe_handshake(self) -> None:
+        # Only the side that sent a handshake knows when the connection started.
+        if self._handshake_sent is not None:
+            metrics.HANDSHAKE_SECONDS.labels().observe(
+                time.perf_counter() - self._handshake_sent
+            )
+            self._handshake_sent = None
+
+    def _write_session_key(self, key_id: int, enc_session_key: bytes) -> None:
+        _logger.debug("Sending a session key {} to {}", key_id, self.endpoint_addr)
+        self._schedule(
+            Message.of(
+                JSONMessageContent(
+                    content_type=JSONContentType.SESSION_KEY,
+                    key_id=key_id,
+                    key=base64.b64encode(enc_session_key).decode("ascii"),
+                ).to_bytes(),
+                ContentType.JSON,
+            ),
+            Priority.CONTROL,
+            _CONTROL_STREAM,
+        )
+
+
+class MessageWriter(BaseMessageWriter):
+    """Writes messages to an endpoint over a blocking socket.
+
+    Frames smaller than `coalesce_size` bytes are queued for up to `coalesce_window`
+    seconds and sent together, a window of zero sends every frame immediately. Frames
+    are sent with scatter/gather I/O, so headers and content are never concatenated.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        coalesce_window: float = SEND_COALESCE_WINDOW,
+        coalesce_size: int = SEND_COALESCE_SIZE,
+    ) -> None:
+        self.coalesce_window = coalesce_window
+        self.coalesce_size = coalesce_size
+        self._sock = sock
+        self._queue: List[bytes] = []
+        self._queued = 0
+        self._queue_lock = threading.Lock()
+        self._flush_timer: Optional[threading.Timer] = None
+
+        super().__init__(Address(*sock.getpeername()))
+
+    def flush(self) -> None:
+        with self._queue_lock:
+            self._flush()
+
+    def _send(self, *buffers: bytes) -> None:
+        with self._queue_lock:
+            self._queue.extend(buffers)
+            self._queued += sum(len(buffer) for buffer in buffers)
+
+            if self.coalesce_window <= 0 or self._queued >= self.coalesce_size:
+                self._flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.coalesce_window, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def _flush(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        if self._queue:
+            queue = self._queue
+            self._queue = []
+            self._queued = 0
+
+            _send_buffers(self._sock, queue)
+
+    def write_encrypted_stream(
+        self,
+        source: BinaryIO,
+        length: int,
+        content_type: ContentType,
+        mode: EncryptionMode,
+        content_encoding: str = "utf-8",
+    ) -> None:
+        """Encrypt `length` bytes read from a binary file and write them as a message.
+
+        In the protocol v3 a message larger than `fragment_size` is encrypted a
+        fragment at a time and every fragment is sent before the next one is read, so
+        the content is never held in memory whole. Such a message is not compressed.
+        Older endpoints cannot join fragments, so they get the content read whole.
+        """
 
         assert (
             self.connected
         ), "Cannot write a message without an established connection"
 
-        # TODO: Add encryption here.
-        print(f"Sending a message {message} to {self.endpoint_addr}")
-        self._sock.sendall(message.to_bytes())
+        content_length = crypto.encrypted_length(length, mode)
+
+        if self.protocol_version < 3 or content_length <= self.fragment_size:
+            self.write_encrypted(
+                source.read(length), content_type, mode, content_encoding
+            )
+
+            return
+
+        session = cast(EncryptionSession, self._session)
+
+        if session.needs_rekey:
+            self._write_session_key(*session.rekey())
+
+        headers = Message.of(b"", content_type, content_encoding).headers
+        headers.content_length = content_length
+        headers.session_key_id = session.key_id
+        headers.encryption_mode = mode
+        stream_id = next(self._stream_ids)
+
+        _logger.debug(
+            "Streaming a {} message of {} bytes to {}",
+            content_type,
+            content_length,
+            self.endpoint_addr,
+        )
+
+        for fragment in _stream_fragments(
+            headers,
+            session.encrypt_stream(source, length, mode),
+            stream_id,
+            self.fragment_size,
+        ):
+            self._schedule(fragment, Priority.BULK, stream_id)
+
+            # Another thread may be sending the fragment, it is waited for instead of
+            # queueing more of the content.
+            with self._pumped:
+                self._pumped.wait_for(lambda: not self._pumping)
+
+    def _close(self) -> None:
+        try:
+            self.flush()
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        finally:
+            self._sock.close()
+
+
+def _stream_fragments(
+    headers: MessageHeaders, chunks: Iterable[bytes], stream_id: int, size: int
+) -> Iterator[Message]:
+    # Chunks are cut into fragments, the last one is known only once they run out.
+    pending = bytearray()
+    cut = 0
+
+    for chunk in chunks:
+        pending += chunk
+
+        if cut + len(pending) > headers.content_length:
+            raise ValueError(f"Stream is longer than declared {headers.content_length}")
+
+        while len(pending) > size:
+            yield _fragment(headers, stream_id, bytes(pending[:size]), True)
+            del pending[:size]
+            cut += size
+
+    if cut + len(pending) != headers.content_length:
+        raise ValueError(f"Stream is shorter than declared {headers.content_length}")
+
+    yield _fragment(headers, stream_id, bytes(pending), False)
+
+
+def _fragment(
+    headers: MessageHeaders, stream_id: int, content: bytes, more: bool
+) -> Message:
+    fragment_headers = MessageHeaders(
+        **{
+            **headers.__dict__,
+            "content_length": len(content),
+            "stream_id": stream_id,
+            "more": more,
+        }
+    )
+
+    return Message(fragment_headers, content)
+
+
+def check_message(
+    message: Message, content_type: Optional[ContentType], endpoint_addr: Address
+) -> Message:
+    """Check that a message read from an endpoint has an expected content type."""
+
+    message_type = message.headers.content_type
+
+    if content_type is None or message_type == content_type:
+        _logger.debug(
+            "New {} message of {} bytes from {}",
+            message_type,
+            message.headers.content_length,
+            endpoint_addr,
+        )
+
+        return message
+
+    raise ValueError(f"Expected content type {content_type} but got {message_type}")
+
+
+def pubkey_from_message(
+    message: Message, known_peers: Optional[KnownPeers] = None
+) -> Key:
+    """Extract a pubkey from a message.
+
+    The message contains either a full key or only a fingerprint of a key that has
+    to be present in the given known peers.
+    """
+
+    if message.headers.content_type == ContentType.BINARY:
+        return import_key(message.content)
+
+    pubkey_content = JSONMessageContent.from_message(message)
+
+    if pubkey_content.content_type != JSONContentType.PUBKEY:
+        raise ValueError(f"Expected a pubkey but got {pubkey_content.content_type}")
+
+    pubkey = (
+        known_peers.get(pubkey_content.fingerprint) if known_peers is not None else None
+    )
+
+    if pubkey is None:
+        raise ValueError(f"Unknown pubkey fingerprint {pubkey_content.fingerprint}")
+
+    return pubkey
+
+
+def decrypt_messages(
+    messages: Iterable[Message],
+    rec_privkey: Key,
+    max_workers: Optional[int] = None,
+) -> Iterator[Tuple[Message, Optional[bytes]]]:
+    """Decrypt many messages in parallel and yield them as soon as they are ready.
+
+    Content of a message that fails authentication is `None`. Threads are used since
+    pycryptodome releases the GIL in its native primitives and messages share
+    unwrapped session keys.
+    """
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(_try_decrypt, message, rec_privkey): message
+            for message in messages
+        }
+
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _try_decrypt(message: Message, rec_privkey: Key) -> Optional[bytes]:
+    try:
+        return message.decrypt(rec_privkey)
+    except ValueError:
+        return None
+
+
+def _extensions_len(version: int, flags: int) -> int:
+    # Fields between the fixed binary headers and the content encoding.
+    return (_STREAM_ID.size if version == 3 else 0) + (
+        _FILE_CHUNK.size if flags & _FLAG_FILE_CHUNK else 0
+    )
+
+
+def _send_buffers(sock: socket.socket, buffers: List[bytes]) -> None:
+    if not hasattr(sock, "sendmsg"):
+        sock.sendall(b"".join(buffers))
+
+        return
+
+    views = [memoryview(buffer) for buffer in buffers if buffer]
+    index = 0
+
+    while index < len(views):
+        sent = sock.sendmsg(views[index : index + _IOV_MAX])
+
+        # Skip buffers that were sent in full and the sent part of the next one.
+        while sent > 0:
+            if sent >= len(views[index]):
+                sent -= len(views[index])
+                index += 1
+            else:
+                views[index] = views[index][sent:]
+                sent = 0
 
 
-def _decode_json(data: bytes, encoding: str) -> Any:
+def _decode_json(data: Union[bytes, memoryview], encoding: str) -> Any:
     try:
         json_text = io.TextIOWrapper(io.BytesIO(data), encoding=encoding, newline="")
         json_data = json.load(json_text)
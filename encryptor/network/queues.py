@@ -0,0 +1,171 @@
+import asyncio
+import threading
+from collections import deque
+from types import SimpleNamespace
+from typing import Deque, Generic, List, TypeVar
+from encryptor import metrics
+
+T = TypeVar("T")
+
+
+class QueueStats(SimpleNamespace):  # pylint: disable=too-few-public-methods
+    """Snapshot of counters of a `BoundedQueue`."""
+
+    name: str
+    size: int
+    maxsize: int
+    high_watermark: int
+    put_count: int
+    get_count: int
+    full_count: int
+
+
+class BoundedQueue(Generic[T]):  # pylint: disable=too-many-instance-attributes
+    """Bounded FIFO queue filled on an event loop and drained from any thread.
+
+    Producers wait in `put` while the queue is full, so a producer reading from a
+    socket stops reading and TCP flow control pushes back on the sender. Consumers
+    either wait in `get` on the same loop or take batches with `get_batch` from
+    another thread.
+    """
+
+    def __init__(self, maxsize: int, name: str = "queue") -> None:
+        self.maxsize = maxsize
+        self.name = name
+        self._items: Deque[T] = deque()
+        self._lock = threading.Lock()
+        self._putters: List["asyncio.Future[None]"] = []
+        self._getters: List["asyncio.Future[None]"] = []
+        self._empty_waiters: List["asyncio.Future[None]"] = []
+        self._high_watermark = 0
+        self._put_count = 0
+        self._get_count = 0
+        self._full_count = 0
+        self._size = metrics.QUEUE_SIZE.labels(name)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @property
+    def stats(self) -> QueueStats:
+        """Get current counters of the queue."""
+
+        with self._lock:
+            return QueueStats(
+                name=self.name,
+                size=len(self._items),
+                maxsize=self.maxsize,
+                high_watermark=self._high_watermark,
+                put_count=self._put_count,
+                get_count=self._get_count,
+                full_count=self._full_count,
+            )
+
+    async def put(self, item: T) -> bool:
+        """Put an item into the queue, waiting while it is full.
+
+        Returns `True` if the queue was empty, so a consumer draining it from another
+        thread has to be notified.
+        """
+
+        while True:
+            with self._lock:
+                if len(self._items) < self.maxsize:
+                    self._items.append(item)
+                    self._put_count += 1
+                    self._high_watermark = max(self._high_watermark, len(self._items))
+                    self._size.set(len(self._items))
+                    self._wake(self._getters)
+
+                    return len(self._items) == 1
+
+                self._full_count += 1
+                putter = asyncio.get_running_loop().create_future()
+                self._putters.append(putter)
+
+            await self._wait(putter, self._putters)
+
+    async def get(self) -> T:
+        """Get an item from the queue, waiting while it is empty."""
+
+        while True:
+            with self._lock:
+                if self._items:
+                    item = self._items.popleft()
+                    self._get_count += 1
+                    self._size.set(len(self._items))
+                    self._wake(self._putters)
+
+                    if not self._items:
+                        self._wake(self._empty_waiters)
+
+                    return item
+
+                getter = asyncio.get_running_loop().create_future()
+                self._getters.append(getter)
+
+            await self._wait(getter, self._getters)
+
+    def get_batch(self, max_items: int) -> List[T]:
+        """Take up to `max_items` items from the queue without waiting."""
+
+        with self._lock:
+            batch = [
+                self._items.popleft() for _ in range(min(max_items, len(self._items)))
+            ]
+            self._get_count += len(batch)
+            self._size.set(len(self._items))
+
+            if batch:
+                self._wake(self._putters)
+
+            if not self._items:
+                self._wake(self._empty_waiters)
+
+        return batch
+
+    async def wait_empty(self) -> None:
+        """Wait until all items are taken from the queue."""
+
+        while True:
+            with self._lock:
+                if not self._items:
+                    return
+
+                waiter = asyncio.get_running_loop().create_future()
+                self._empty_waiters.append(waiter)
+
+            await self._wait(waiter, self._empty_waiters)
+
+    def clear(self) -> None:
+        """Drop all items from the queue."""
+
+        with self._lock:
+            self._items.clear()
+            self._size.set(0)
+            self._wake(self._putters)
+            self._wake(self._empty_waiters)
+
+    def _wake(self, waiters: List["asyncio.Future[None]"]) -> None:
+        # Waiters check the queue again once woken up, so all of them can be woken.
+        for waiter in waiters:
+            waiter.get_loop().call_soon_threadsafe(_set_done, waiter)
+
+        waiters.clear()
+
+    async def _wait(
+        self, waiter: "asyncio.Future[None]", waiters: List["asyncio.Future[None]"]
+    ) -> None:
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+
+            raise
+
+
+def _set_done(waiter: "asyncio.Future[None]") -> None:
+    if not waiter.done():
+        waiter.set_result(None)
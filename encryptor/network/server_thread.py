@@ -1,69 +1,115 @@
-import socket
-import traceback
-from Crypto.PublicKey import RSA
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
-from .connection import Address
-from .exceptions import ConnectionClosed
-from .message import Message, MessageReader
-
-
-class ServerThread(QThread):
-    """A thread that is responsible for handling incoming connections and messages."""
-
-    handshake = pyqtSignal(Address)
-    pubkey = pyqtSignal(RSA.RsaKey)
-    new_message = pyqtSignal(Message)
-    disconnect = pyqtSignal()
-
-    def __init__(self, addr: Address) -> None:
+import asyncio
+from typing import Optional, Tuple
+from PyQt5.QtCore import QThread, QTimer, pyqtSignal, pyqtSlot
+from encryptor import log, tracing
+from encryptor.constants import INBOUND_QUEUE_SIZE, UI_BATCH_SIZE
+from encryptor.encryption.keys import Key
+from encryptor.encryption.known_peers import KnownPeers
+from .aio import AsyncServer, ServerHandler
+from .connection import Address, Peer
+from .message import FileAck, Handshake, Message
+from .queues import BoundedQueue
+from .transfer import FileReceiver, IncomingTransfer
+
+_logger = log.get_logger(__name__)
+
+
+class ServerThread(QThread, ServerHandler):
+    """A thread that runs an event loop handling incoming connections and messages.
+
+    Connections of many peers are served concurrently, each of them is identified by
+    a `Peer` in the signals. The server is a thin adapter of an `AsyncServer`, its
+    loop can be shared with a `ClientWorker` so all networking of the application
+    happens on one thread.
+
+    Received messages wait in the bounded `messages` queue and are delivered to the
+    GUI thread in batches of `UI_BATCH_SIZE` by `new_messages`. While the queue is
+    full, connections are not read from and their peers are pushed back on. Files are
+    received into `files_dir` if it is given.
+    """
+
+    handshake = pyqtSignal(Peer, Handshake)
+    pubkey = pyqtSignal(Peer, object)
+    new_messages = pyqtSignal(list)
+    file_progress = pyqtSignal(Peer, object)
+    file_ack = pyqtSignal(Peer, FileAck)
+    disconnect = pyqtSignal(Peer)
+    _messages_ready = pyqtSignal()
+
+    def __init__(
+        self,
+        addr: Address,
+        known_peers: Optional[KnownPeers] = None,
+        files_dir: Optional[str] = None,
+        max_queued_messages: int = INBOUND_QUEUE_SIZE,
+    ) -> None:
         super().__init__()
 
         self.addr = addr
-        self._socket = socket.socket()
-
-        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-    def __del__(self) -> None:
-        try:
-            self._socket.shutdown(socket.SHUT_RDWR)
-        except OSError:
-            pass
-        finally:
-            self._socket.close()
+        self.loop = asyncio.new_event_loop()
+        self.messages: BoundedQueue[Tuple[Peer, Message]] = BoundedQueue(
+            max_queued_messages, "inbound"
+        )
+        self._server = AsyncServer(
+            addr,
+            self,
+            known_peers,
+            receiver=FileReceiver(files_dir) if files_dir is not None else None,
+        )
+
+        self._messages_ready.connect(self._deliver_messages)
 
     @pyqtSlot()
     def run(self) -> None:
         """Run the server."""
 
-        self._socket.bind((self.addr.host, self.addr.port))
-        self._socket.listen()
+        asyncio.set_event_loop(self.loop)
 
-        while True:
-            conn = self._socket.accept()[0]
-            reader = MessageReader(conn)
-
-            print(f"New connection from {reader.endpoint_addr}")
+        # Threads started by Qt are not profiled unless asked to.
+        with tracing.profile_thread():
+            try:
+                self.loop.run_until_complete(self._server.start())
+            except OSError:
+                _logger.exception("Could not start a server at {}", self.addr)
 
             try:
-                ret_addr = reader.read_handshake()
-                self.handshake.emit(ret_addr)
+                self.loop.run_forever()
+            finally:
+                self.loop.run_until_complete(self._server.close())
+                self.loop.close()
 
-                pubkey = reader.read_pubkey()
-                self.pubkey.emit(pubkey)
+    @pyqtSlot()
+    def stop(self) -> None:
+        """Stop the server and its event loop."""
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def on_handshake(self, peer: Peer, handshake: Handshake) -> None:
+        self.handshake.emit(peer, handshake)
+
+    def on_pubkey(self, peer: Peer, pubkey: Key) -> None:
+        self.pubkey.emit(peer, pubkey)
 
-                while True:
-                    message = reader.read()
-                    self.new_message.emit(message)
-            except Exception as e:
-                reader.close()
+    async def on_message(self, peer: Peer, message: Message) -> None:
+        if await self.messages.put((peer, message)):
+            self._messages_ready.emit()
 
-                if isinstance(e, ConnectionClosed):
-                    print(f"Closed connection with {reader.endpoint_addr}")
-                else:
-                    traceback.print_exc()
+    def on_file(self, peer: Peer, transfer: IncomingTransfer) -> None:
+        self.file_progress.emit(peer, transfer)
+
+    def on_file_ack(self, peer: Peer, ack: FileAck) -> None:
+        self.file_ack.emit(peer, ack)
+
+    def on_disconnect(self, peer: Peer) -> None:
+        self.disconnect.emit(peer)
+
+    @pyqtSlot()
+    def _deliver_messages(self) -> None:
+        batch = self.messages.get_batch(UI_BATCH_SIZE)
 
-                # Remove the reference for the sake of garbage collector's sanity.
-                reader = None  # type: ignore
+        if batch:
+            self.new_messages.emit(batch)
 
-                self.disconnect.emit()
-                break
+        # Let the GUI thread handle other events before delivering the next batch.
+        if self.messages:
+            QTimer.singleShot(0, self._deliver_messages)
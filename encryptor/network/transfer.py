@@ -0,0 +1,323 @@
+import contextlib
+import mmap
+import os
+import re
+import struct
+import threading
+import uuid
+from typing import Dict, Generator, Iterator, Optional, Tuple
+from encryptor import log
+from encryptor.constants import FILE_CHUNK_SIZE
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import Key
+from encryptor.encryption.mode import EncryptionMode
+from .connection import Address
+from .message import FileAck, FileOffer, Message
+
+_logger = log.get_logger(__name__)
+# Chunks are spooled as records of an encrypted chunk preceded by its length.
+_RECORD_HEADER = struct.Struct(">Q")
+# Transfer ids are hex UUIDs, they name spooled files so they must not be paths.
+_TRANSFER_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class OutgoingTransfer:  # pylint: disable=too-many-instance-attributes
+    """File sent to an endpoint in chunks encrypted with a key of the transfer.
+
+    The file is mapped into memory, so chunks are encrypted straight from the page
+    cache. The transfer outlives connections and resumes from the last chunk
+    acknowledged by the endpoint.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        endpoint_addr: Address,
+        mode: EncryptionMode,
+        chunk_size: int = FILE_CHUNK_SIZE,
+    ) -> None:
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.endpoint_addr = endpoint_addr
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.size = os.path.getsize(path)
+        self.acked = 0
+        # Whether the endpoint acknowledged the offer, even of an empty file.
+        self.offer_acked = False
+        self._key = crypto.generate_session_key()
+
+    @property
+    def complete(self) -> bool:
+        """Determine whether the endpoint received the whole file."""
+
+        return self.offer_acked and self.acked >= self.size
+
+    def offer(self, rec_pubkey: Key) -> FileOffer:
+        """Create an offer of the file with the transfer key wrapped for a receipent."""
+
+        return FileOffer(
+            transfer_id=self.id,
+            name=crypto.encrypt_with_key(
+                os.path.basename(self.path).encode("utf-8"), self.mode, self._key
+            ),
+            size=self.size,
+            chunk_size=self.chunk_size,
+            encryption_mode=self.mode,
+            key=crypto.wrap_key(self._key, rec_pubkey),
+        )
+
+    def acknowledge(self, ack: FileAck) -> None:
+        """Register chunks acknowledged by the endpoint."""
+
+        self.offer_acked = True
+        self.acked = max(self.acked, min(ack.offset, self.size))
+
+    def chunks(self, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+        """Encrypt chunks of the file starting at a given offset."""
+
+        if offset >= self.size:
+            return
+
+        with open(self.path, "rb") as file_in, mmap.mmap(
+            file_in.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            view = memoryview(mapped)
+
+            try:
+                for start in range(offset, self.size, self.chunk_size):
+                    yield start, crypto.encrypt_with_key(
+                        view[start : start + self.chunk_size], self.mode, self._key
+                    )
+            finally:
+                view.release()
+
+
+class IncomingTransfer:
+    """File received from a peer, spooled to disk in encrypted chunks.
+
+    Chunks are kept encrypted until the file is decrypted with the private key, like
+    messages are. Spooled chunks survive restarts, so when the sender offers the file
+    again, the transfer resumes after the last chunk that was written in full.
+    """
+
+    def __init__(self, directory: str, offer: FileOffer, sender: str) -> None:
+        self.offer = offer
+        self.sender = sender
+        self.decrypted_path: Optional[str] = None
+        self._directory = directory
+        self._spool_path = os.path.join(directory, f"{offer.transfer_id}.part")
+        self._lock = threading.Lock()
+
+        self.received = self._recover()
+
+    @property
+    def id(self) -> str:
+        """Get an identifier of the transfer."""
+
+        return self.offer.transfer_id
+
+    @property
+    def complete(self) -> bool:
+        """Determine whether all chunks of the file were received."""
+
+        return self.received >= self.offer.size
+
+    def write_chunk(self, offset: int, chunk: bytes) -> bool:
+        """Spool a chunk of the file, return whether it was not received before.
+
+        Raises `ValueError` if chunks before the offset are missing, or the chunk lies
+        beyond the end of the file or is not as long as its encrypted part of it.
+        """
+
+        with self._lock:
+            if offset < self.received:
+                return False
+
+            if offset > self.received:
+                raise ValueError(
+                    f"Chunk at {offset} of {self.id} does not follow {self.received}"
+                )
+
+            if offset >= self.offer.size:
+                raise ValueError(f"Chunk at {offset} of {self.id} is beyond its end")
+
+            expected = crypto.encrypted_length(
+                min(self.offer.chunk_size, self.offer.size - offset),
+                self.offer.encryption_mode,
+            )
+
+            if len(chunk) != expected:
+                raise ValueError(
+                    f"Chunk at {offset} of {self.id} has {len(chunk)} bytes instead "
+                    f"of {expected}"
+                )
+
+            with open(self._spool_path, "ab") as file_out:
+                file_out.write(_RECORD_HEADER.pack(len(chunk)))
+                file_out.write(chunk)
+
+            self.received = min(offset + self.offer.chunk_size, self.offer.size)
+
+            return True
+
+    def decrypt(self, rec_privkey: Key) -> str:
+        """Decrypt the file into the directory and return its path.
+
+        Raises `ValueError` if the file fails authentication, nothing is written then.
+        """
+
+        mode = self.offer.encryption_mode
+
+        try:
+            key = crypto.unwrap_key(self.offer.key, rec_privkey)
+        except ValueError:
+            key = crypto.generate_session_key()
+
+        name = crypto.decrypt_with_key(self.offer.name, mode, key)
+        path = _free_path(
+            self._directory,
+            os.path.basename(name.decode("utf-8", errors="replace")) or self.id,
+        )
+
+        failed = False
+
+        with contextlib.closing(self._records()) as records, open(
+            path, "wb"
+        ) as file_out:
+            for chunk in records:
+                # Chunks are views of the spool, which cannot be closed until views
+                # held by the traceback of an exception are gone.
+                try:
+                    file_out.write(crypto.decrypt_with_key(chunk, mode, key))
+                except ValueError:
+                    failed = True
+                    break
+
+        if failed:
+            os.remove(path)
+
+            raise ValueError(f"File {self.id} failed authentication")
+
+        os.remove(self._spool_path)
+        self.decrypted_path = path
+
+        _logger.info("Decrypted a file {} from {} to {}", self.id, self.sender, path)
+
+        return path
+
+    def _records(self) -> Generator[memoryview, None, None]:
+        if os.path.getsize(self._spool_path) == 0:
+            return
+
+        with open(self._spool_path, "rb") as file_in, mmap.mmap(
+            file_in.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            view = memoryview(mapped)
+            position = 0
+
+            try:
+                while position < len(view):
+                    (length,) = _RECORD_HEADER.unpack_from(view, position)
+                    position += _RECORD_HEADER.size
+                    chunk = view[position : position + length]
+                    position += length
+
+                    try:
+                        yield chunk
+                    finally:
+                        chunk.release()
+            finally:
+                view.release()
+
+    def _recover(self) -> int:
+        # Count chunks written in full and drop a chunk that was cut off.
+        if not os.path.exists(self._spool_path):
+            with open(self._spool_path, "wb"):
+                pass
+
+            return 0
+
+        chunks = 0
+        position = 0
+
+        with open(self._spool_path, "r+b") as file_spool:
+            size = os.fstat(file_spool.fileno()).st_size
+
+            while position + _RECORD_HEADER.size <= size:
+                file_spool.seek(position)
+                (length,) = _RECORD_HEADER.unpack(file_spool.read(_RECORD_HEADER.size))
+
+                if position + _RECORD_HEADER.size + length > size:
+                    break
+
+                position += _RECORD_HEADER.size + length
+                chunks += 1
+
+            file_spool.truncate(position)
+
+        return min(chunks * self.offer.chunk_size, self.offer.size)
+
+
+class FileReceiver:
+    """Receives files offered by peers into a directory."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._transfers: Dict[str, IncomingTransfer] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def receive_offer(self, offer: FileOffer, sender: str) -> IncomingTransfer:
+        """Start a transfer of an offered file or resume it if it was offered before.
+
+        Raises `ValueError` if the transfer id is not a hex UUID.
+        """
+
+        if not isinstance(offer.transfer_id, str) or not _TRANSFER_ID.fullmatch(
+            offer.transfer_id
+        ):
+            raise ValueError(f"Invalid file transfer id {offer.transfer_id!r}")
+
+        with self._lock:
+            transfer = self._transfers.get(offer.transfer_id)
+
+            if transfer is None:
+                transfer = IncomingTransfer(self.directory, offer, sender)
+                self._transfers[offer.transfer_id] = transfer
+
+        _logger.info(
+            "File offer {} from {}, received {}", transfer.id, sender, transfer.received
+        )
+
+        return transfer
+
+    def receive_chunk(self, message: Message) -> Optional[IncomingTransfer]:
+        """Spool a chunk of a file, return its transfer if the chunk is new.
+
+        Raises `ValueError` if the chunk belongs to a transfer that was not offered.
+        """
+
+        transfer = self._transfers.get(message.headers.transfer_id)
+
+        if transfer is None:
+            raise ValueError(f"File transfer {message.headers.transfer_id} is unknown")
+
+        return (
+            transfer
+            if transfer.write_chunk(message.headers.offset, message.content)
+            else None
+        )
+
+
+def _free_path(directory: str, name: str) -> str:
+    base, ext = os.path.splitext(name)
+    path = os.path.join(directory, name)
+    copy = 1
+
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{base} ({copy}){ext}")
+        copy += 1
+
+    return path
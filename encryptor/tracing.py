@@ -0,0 +1,264 @@
+import atexit
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TYPE_CHECKING,
+)
+from encryptor.constants import TRACE_MAX_EVENTS
+
+# Profiling is opt-in, its modules are imported only once it's started.
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+
+# Identifier of the message whose spans are recorded in the current context.
+_trace_id: ContextVar[Optional[int]] = ContextVar("trace_id", default=None)
+_null_span = contextlib.nullcontext()
+# Set once tracing or profiling is started.
+_tracer: Optional["Tracer"] = None  # pylint: disable=invalid-name
+_profiler: Optional["Profiler"] = None  # pylint: disable=invalid-name
+
+
+class Tracer:
+    """Records spans of all threads as events of the Chrome trace format.
+
+    Spans of a single message are correlated by an identifier that is passed to
+    `span` or inherited from an enclosing span, they are joined by flow events, so
+    viewers like Perfetto draw a message's path across threads. Events beyond
+    `max_events` are dropped.
+    """
+
+    def __init__(self, max_events: int = TRACE_MAX_EVENTS) -> None:
+        self.max_events = max_events
+        self.dropped = 0
+        self._events: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self._pid = os.getpid()
+        self._threads: Dict[int, str] = {}
+
+    def new_id(self) -> int:
+        """Get an identifier of a new message, which starts its flow."""
+
+        trace_id = next(self._ids)
+        self._flow("s", trace_id, _now())
+
+        return trace_id
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, trace_id: Optional[int] = None, **args: Any
+    ) -> Iterator[None]:
+        """Record a span of code, within a flow of a message if it's known."""
+
+        trace_id = _trace_id.get() if trace_id is None else trace_id
+        token = _trace_id.set(trace_id)
+        began = _now()
+
+        if trace_id is not None:
+            args["message"] = trace_id
+            self._flow("t", trace_id, began)
+
+        try:
+            yield
+        finally:
+            _trace_id.reset(token)
+            self._add(
+                {
+                    "name": name,
+                    "cat": "encryptor",
+                    "ph": "X",
+                    "ts": began,
+                    "dur": _now() - began,
+                    "args": args,
+                }
+            )
+
+    def write(self, path: str) -> None:
+        """Write recorded events to a JSON file."""
+
+        metadata = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": self._pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for tid, name in list(self._threads.items())
+        ]
+
+        with open(path, "w", encoding="utf-8") as file_out:
+            json.dump(
+                {
+                    "traceEvents": metadata + self._events,
+                    "displayTimeUnit": "ms",
+                    "otherData": {"dropped_events": self.dropped},
+                },
+                file_out,
+            )
+
+    def _flow(self, phase: str, trace_id: int, timestamp: float) -> None:
+        self._add(
+            {
+                "name": "message",
+                "cat": "message",
+                "ph": phase,
+                "id": trace_id,
+                "ts": timestamp,
+            }
+        )
+
+    def _add(self, event: Dict[str, Any]) -> None:
+        if len(self._events) >= self.max_events:
+            self.dropped += 1
+
+            return
+
+        tid = threading.get_ident()
+
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+
+        event["pid"] = self._pid
+        event["tid"] = tid
+        # Appending to a list is atomic, so threads need not be synchronized.
+        self._events.append(event)
+
+
+class Profiler:
+    """Profiles the main thread and threads started afterwards with cProfile.
+
+    Threads not started by `threading`, like `QThread`s, are profiled only in code
+    run in `profile_thread`. Stats of all threads are merged when stopped.
+    """
+
+    def __init__(self) -> None:
+        self._profiles: List["cProfile.Profile"] = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start profiling the current thread and threads started afterwards."""
+
+        threading.setprofile(self._start_thread)
+        self._new_profile().enable()
+
+    def stop(self, path: str) -> None:
+        """Stop profiling and write merged stats in the `pstats` format."""
+
+        import pstats  # pylint: disable=import-outside-toplevel
+
+        threading.setprofile(None)
+        stats: Optional[pstats.Stats] = None
+
+        with self._lock:
+            profiles = list(self._profiles)
+
+        for profile in profiles:
+            profile.create_stats()
+
+            if not getattr(profile, "stats", None):
+                continue
+
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+        if stats is not None:
+            stats.dump_stats(path)
+
+    @contextlib.contextmanager
+    def thread(self) -> Iterator[None]:
+        """Profile code run in the current thread."""
+
+        profile = self._new_profile()
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def _new_profile(self) -> "cProfile.Profile":
+        import cProfile  # pylint: disable=import-outside-toplevel
+
+        profile = cProfile.Profile()
+
+        with self._lock:
+            self._profiles.append(profile)
+
+        return profile
+
+    def _start_thread(self, *_: Any) -> None:
+        # Called on the first event of a new thread, the profile takes over from it.
+        sys.setprofile(None)
+        self._new_profile().enable()
+
+
+def start(path: str) -> Tracer:
+    """Start tracing the process, the trace is written to a file at exit."""
+
+    global _tracer  # pylint: disable=global-statement
+
+    tracer = _tracer = Tracer()
+    atexit.register(tracer.write, path)
+
+    return tracer
+
+
+def start_profile(path: str) -> Profiler:
+    """Run the rest of the process under cProfile, stats are written at exit."""
+
+    global _profiler  # pylint: disable=global-statement
+
+    profiler = _profiler = Profiler()
+    profiler.start()
+    atexit.register(profiler.stop, path)
+
+    return profiler
+
+
+def new_id() -> Optional[int]:
+    """Get an identifier correlating spans of a new message, if tracing is on."""
+
+    return _tracer.new_id() if _tracer is not None else None
+
+
+def current_id() -> Optional[int]:
+    """Get an identifier of the message whose span encloses the current code."""
+
+    return _trace_id.get()
+
+
+def span(name: str, trace_id: Optional[int] = None, **args: Any) -> ContextManager:
+    """Record a span of code if tracing is on, see `Tracer.span`."""
+
+    if _tracer is None:
+        return _null_span
+
+    return _tracer.span(name, trace_id, **args)
+
+
+def profile_thread() -> ContextManager:
+    """Profile code run in the current thread if the process is profiled."""
+
+    if _profiler is None:
+        return _null_span
+
+    return _profiler.thread()
+
+
+def _now() -> float:
+    return time.perf_counter_ns() / 1000
@@ -1,4 +1,12 @@
-from PyQt5.QtWidgets import QDialog, QDialogButtonBox, QLineEdit, QLabel, QVBoxLayout
+from PyQt5.QtWidgets import (
+    QComboBox,
+    QDialog,
+    QDialogButtonBox,
+    QLineEdit,
+    QLabel,
+    QVBoxLayout,
+)
+from encryptor.encryption.keys import KeyType
 
 
 class AuthDialog(QDialog):
@@ -25,14 +33,20 @@ class AuthDialog(QDialog):
 class NewKeysDialog(QDialog):
     """Dialog to authorize creation of new user keys."""
 
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        text: str = (
+            "It looks like you haven't created your public and private keys yet. "
+            "Enter a passphrase of your new private key"
+        ),
+    ) -> None:
         super().__init__()
 
         self.passphrase = QLineEdit(self)
         self.passphrase.setEchoMode(QLineEdit.Password)
-        passphrase_label = QLabel(
-            "It looks like you haven't created your public and private keys yet. Enter a passphrase of your new private key"
-        )
+        self._key_type = QComboBox(self)
+        self._key_type.addItems([key_type.value for key_type in KeyType.available()])
+        passphrase_label = QLabel(text)
         button_box = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         layout = QVBoxLayout()
 
@@ -41,5 +55,13 @@ class NewKeysDialog(QDialog):
         button_box.rejected.connect(self.reject)
         layout.addWidget(passphrase_label)
         layout.addWidget(self.passphrase)
+        layout.addWidget(QLabel("Key type"))
+        layout.addWidget(self._key_type)
         layout.addWidget(button_box)
         self.setLayout(layout)
+
+    @property
+    def key_type(self) -> KeyType:
+        """Get the selected type of new keys."""
+
+        return KeyType(self._key_type.currentText())
@@ -0,0 +1,48 @@
+from typing import Optional
+from PyQt5.QtWidgets import QProgressDialog
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
+from encryptor.encryption.key_pool import KeyPool
+from encryptor.encryption.keys import KeyType
+from encryptor.key_generation_worker import KeyGenerationWorker
+
+
+class KeyGenerationDialog(QProgressDialog):
+    """Dialog showing progress of keys generated in the background."""
+
+    generation = pyqtSignal(str, str, object)
+    generated = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, key_pool: Optional[KeyPool] = None) -> None:
+        super().__init__("Generating keys", "", 0, 0)
+
+        self._thread = QThread()
+        self._worker = KeyGenerationWorker(key_pool)
+
+        self.setWindowTitle("Generating keys")
+        self.setCancelButton(None)
+        self.setMinimumDuration(0)
+        self.generation.connect(self._worker.generate)
+        self._worker.progress.connect(self.setLabelText)
+        self._worker.finished.connect(self._finish)
+        self._worker.failed.connect(self._fail)
+        self._worker.moveToThread(self._thread)
+
+    def start(self, password: str, keys_dir: str, key_type: KeyType) -> None:
+        """Start generating keys."""
+
+        self._thread.start()
+        self.show()
+        self.generation.emit(password, keys_dir, key_type)
+
+    @pyqtSlot(object)
+    def _finish(self, pubkey: object) -> None:
+        self._thread.quit()
+        self.generated.emit(pubkey)
+        self.close()
+
+    @pyqtSlot(str)
+    def _fail(self, error: str) -> None:
+        self._thread.quit()
+        self.failed.emit(error)
+        self.close()
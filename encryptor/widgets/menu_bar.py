@@ -1,5 +1,6 @@
 from PyQt5.QtWidgets import (
     QAction,
+    QMenu,
     QMenuBar,
     QDialog,
     QLineEdit,
@@ -37,11 +38,14 @@ class MenuBar(QMenuBar):
 
     connection = pyqtSignal(Address)
     disconnection = pyqtSignal()
+    decrypt_all = pyqtSignal()
+    lock_keys = pyqtSignal()
+    new_keys = pyqtSignal()
 
     def __init__(self) -> None:
         super().__init__()
 
-        self._connection_menu = self.addMenu("Connection")
+        self._connection_menu = self._add_menu("Connection")
         connect_action = QAction("Connect", self)
         disconnect_action = QAction("Disconnect", self)
 
@@ -53,6 +57,31 @@ class MenuBar(QMenuBar):
         disconnect_action.triggered.connect(self.disconnection.emit)
         self._connection_menu.addActions([connect_action, disconnect_action])
 
+        self._messages_menu = self._add_menu("Messages")
+        decrypt_all_action = QAction("Decrypt all", self)
+
+        decrypt_all_action.setShortcut("Ctrl+Shift+D")
+        decrypt_all_action.setStatusTip("Decrypt all received messages")
+        decrypt_all_action.triggered.connect(self.decrypt_all.emit)
+        self._messages_menu.addAction(decrypt_all_action)
+
+        self._keys_menu = self._add_menu("Keys")
+        lock_keys_action = QAction("Lock private key", self)
+        new_keys_action = QAction("Generate new keys", self)
+
+        lock_keys_action.setShortcut("Ctrl+L")
+        lock_keys_action.setStatusTip("Forget the unlocked private key")
+        lock_keys_action.triggered.connect(self.lock_keys.emit)
+        new_keys_action.setStatusTip("Replace your keys with newly generated ones")
+        new_keys_action.triggered.connect(self.new_keys.emit)
+        self._keys_menu.addActions([lock_keys_action, new_keys_action])
+
+    def _add_menu(self, title: str) -> QMenu:
+        menu = QMenu(title, self)
+        self.addMenu(menu)
+
+        return menu
+
     @pyqtSlot()
     def _open_connect_dialog(self) -> None:
         dialog = ConnectDialog()
@@ -1,46 +1,416 @@
+import codecs
+from typing import cast, Any, Dict, List, Optional, Tuple, TYPE_CHECKING
 from PyQt5.QtWidgets import (
+    QApplication,
+    QListView,
+    QStyle,
+    QStyledItemDelegate,
+    QStyleOptionButton,
+    QStyleOptionViewItem,
     QWidget,
-    QLabel,
-    QListWidget,
-    QListWidgetItem,
-    QPushButton,
-    QHBoxLayout,
 )
-from PyQt5.QtCore import pyqtSignal, pyqtSlot
-from encryptor.network.message import Message
+from PyQt5.QtCore import (
+    QAbstractItemModel,
+    QAbstractListModel,
+    QEvent,
+    QModelIndex,
+    QObject,
+    QRect,
+    QSize,
+    Qt,
+    pyqtSignal,
+    pyqtSlot,
+)
+from PyQt5.QtGui import QMouseEvent, QPainter
+from encryptor import tracing
+from encryptor.constants import MESSAGE_PREVIEW_LEN
+from encryptor.network.connection import Peer
+
+# Messages are only passed around here, the list is created before ciphers are loaded.
+if TYPE_CHECKING:
+    from encryptor.network.message import Message
+    from encryptor.network.transfer import IncomingTransfer
+
+# Data of rows besides their text, a message or a file waiting to be decrypted.
+MESSAGE_ROLE = Qt.ItemDataRole.UserRole
+TRANSFER_ROLE = Qt.ItemDataRole.UserRole + 1
+
+
+class _Row:  # pylint: disable=too-few-public-methods
+    __slots__ = (
+        "sender",
+        "message",
+        "transfer",
+        "preview",
+        "encoding",
+        "path",
+        "failed",
+    )
+
+    def __init__(self, sender: str) -> None:
+        self.sender = sender
+        self.message: Optional["Message"] = None
+        self.transfer: Optional["IncomingTransfer"] = None
+        # Only the beginning of a message's content fits in a row, a byte beyond it
+        # tells whether the content goes on.
+        self.preview: Optional[bytes] = None
+        self.encoding = "utf-8"
+        self.path: Optional[str] = None
+        # Whether the message or file failed authentication and was dropped.
+        self.failed = False
+
+
+class MessagesModel(QAbstractListModel):
+    """Received messages and files, a row each.
+
+    Rows keep only the beginning of a message's content that fits in a row, its text
+    is made only when a view asks for it, so only rows that are shown are ever
+    decoded. An encrypted message is dropped once its content is decrypted.
+    """
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+
+        self._rows: List[_Row] = []
+        # Rows are only appended, so their numbers never change.
+        self._encrypted_rows: Dict["Message", int] = {}
+        self._file_rows: Dict[str, int] = {}
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        """Get the number of rows."""
+
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        """Get data of a row for a role."""
+
+        if not index.isValid():
+            return None
+
+        row = self._rows[index.row()]
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            return _row_text(row)
+
+        if role == MESSAGE_ROLE:
+            return row.message
+
+        if role == TRANSFER_ROLE:
+            # A file can be decrypted only once all of it is received.
+            return row.transfer if row.transfer and row.transfer.complete else None
+
+        return None
+
+    def add_messages(self, messages: List[Tuple[Peer, "Message"]]) -> None:
+        """Append messages received from peers as a single batch of rows."""
+
+        if not messages:
+            return
+
+        first = len(self._rows)
+        self.beginInsertRows(QModelIndex(), first, first + len(messages) - 1)
+
+        for peer, message in messages:
+            with tracing.span("new_message", message.trace_id):
+                row = _Row(str(peer.ret_addr or peer.addr))
+                row.encoding = _text_encoding(message.headers.content_encoding)
+
+                if message.encrypted:
+                    row.message = message
+                    self._encrypted_rows[message] = len(self._rows)
+                else:
+                    row.preview = message.content[: MESSAGE_PREVIEW_LEN + 1]
+
+                self._rows.append(row)
+
+        self.endInsertRows()
+
+    def update_transfer(self, peer: Peer, transfer: "IncomingTransfer") -> None:
+        """Append a file received from a peer or update the row of its progress."""
+
+        number = self._file_rows.get(transfer.id)
+
+        if number is not None:
+            self._row_changed(number)
+
+            return
+
+        number = len(self._rows)
+        row = _Row(str(peer.ret_addr or peer.addr))
+        row.transfer = transfer
+
+        self.beginInsertRows(QModelIndex(), number, number)
+        self._rows.append(row)
+        self._file_rows[transfer.id] = number
+        self.endInsertRows()
+
+    def encrypted_messages(self) -> List["Message"]:
+        """Get messages that are still encrypted."""
+
+        return list(self._encrypted_rows)
+
+    def set_content(self, message: "Message", content: bytes) -> None:
+        """Replace an encrypted message with its decrypted content."""
+
+        number = self._encrypted_rows.pop(message, None)
+
+        if number is not None:
+            row = self._rows[number]
+            row.message = None
+            row.preview = content[: MESSAGE_PREVIEW_LEN + 1]
+            self._row_changed(number)
+
+    def set_path(self, transfer: "IncomingTransfer", path: str) -> None:
+        """Replace an encrypted file with a path of the decrypted one."""
+
+        number = self._file_rows.pop(transfer.id, None)
+
+        if number is not None:
+            row = self._rows[number]
+            row.transfer = None
+            row.path = path
+            self._row_changed(number)
+
+    def set_failed(self, message: "Message") -> None:
+        """Drop an encrypted message that failed authentication."""
+
+        self._set_failed(self._encrypted_rows.pop(message, None))
+
+    def set_file_failed(self, transfer: "IncomingTransfer") -> None:
+        """Drop an encrypted file that failed authentication."""
+
+        self._set_failed(self._file_rows.pop(transfer.id, None))
+
+    def _set_failed(self, number: Optional[int]) -> None:
+        if number is not None:
+            row = self._rows[number]
+            row.message = None
+            row.transfer = None
+            row.failed = True
+            self._row_changed(number)
+
+    def _row_changed(self, number: int) -> None:
+        index = self.index(number)
+        self.dataChanged.emit(index, index)
+
+
+class MessageDelegate(QStyledItemDelegate):
+    """Paints a row with a decrypt button if it can be decrypted.
+
+    No widgets are created for rows, clicks of their buttons are reported with
+    `decrypt`.
+    """
 
+    decrypt = pyqtSignal(QModelIndex)
 
-class MessageItem(QWidget):
-    """A single message on a list."""
+    BUTTON_TEXT = "Decrypt"
 
-    decrypt = pyqtSignal(Message)
+    def paint(
+        self,
+        painter: Optional[QPainter],
+        option: QStyleOptionViewItem,
+        index: QModelIndex,
+    ) -> None:
+        """Paint a row, with a decrypt button if it can be decrypted."""
 
-    def __init__(self, message: Message) -> None:
+        if not _decryptable(index):
+            super().paint(painter, option, index)
+
+            return
+
+        button = self._button_option(option)
+        text_option = QStyleOptionViewItem(option)
+        text_option.rect = option.rect.adjusted(0, 0, -button.rect.width(), 0)
+
+        super().paint(painter, text_option, index)
+        _style(option.widget).drawControl(
+            QStyle.ControlElement.CE_PushButton, button, painter, option.widget
+        )
+
+    def sizeHint(self, option: QStyleOptionViewItem, index: QModelIndex) -> QSize:
+        """Get a size of a row, tall enough for a decrypt button."""
+
+        size = super().sizeHint(option, index)
+
+        return size.expandedTo(QSize(0, self._button_size(option).height()))
+
+    def editorEvent(
+        self,
+        event: Optional[QEvent],
+        model: Optional[QAbstractItemModel],
+        option: QStyleOptionViewItem,
+        index: QModelIndex,
+    ) -> bool:
+        """Handle an event of a row, report a click of its decrypt button."""
+
+        if (
+            isinstance(event, QMouseEvent)
+            and event.type() == QEvent.Type.MouseButtonRelease
+            and event.button() == Qt.MouseButton.LeftButton
+            and _decryptable(index)
+            and self._button_option(option).rect.contains(event.pos())
+        ):
+            self.decrypt.emit(index)
+
+            return True
+
+        return super().editorEvent(event, model, option, index)
+
+    def _button_option(self, option: QStyleOptionViewItem) -> QStyleOptionButton:
+        size = self._button_size(option)
+        button = QStyleOptionButton()
+        button.text = self.BUTTON_TEXT
+        button.state = (
+            QStyle.State(QStyle.StateFlag.State_Enabled) | QStyle.StateFlag.State_Raised
+        )
+        rect = QRect(0, 0, size.width(), min(size.height(), option.rect.height()))
+        rect.moveCenter(option.rect.center())
+        rect.moveRight(option.rect.right())
+        button.rect = rect
+
+        return button
+
+    def _button_size(self, option: QStyleOptionViewItem) -> QSize:
+        button = QStyleOptionButton()
+        button.text = self.BUTTON_TEXT
+        text_size = option.fontMetrics.size(
+            Qt.TextFlag.TextShowMnemonic, self.BUTTON_TEXT
+        )
+
+        return _style(option.widget).sizeFromContents(
+            QStyle.ContentsType.CT_PushButton, button, text_size, option.widget
+        )
+
+
+class MessagesList(QListView):
+    """List of received messages.
+
+    Rows are all of the same height and laid out in batches, so the view measures and
+    paints only the visible ones, however many messages were received.
+    """
+
+    decrypt = pyqtSignal(object)
+    decrypt_many = pyqtSignal(list)
+    decrypt_file = pyqtSignal(object)
+
+    def __init__(self) -> None:
         super().__init__()
 
-        self._message = message
-        layout = QHBoxLayout()
-        decrypt_button = QPushButton("Decrypt", self)
+        self._model = MessagesModel(self)
+        self._delegate = MessageDelegate(self)
+
+        self.setModel(self._model)
+        self.setItemDelegate(self._delegate)
+        self.setUniformItemSizes(True)
+        # A static layout goes through all rows whenever rows are inserted.
+        self.setLayoutMode(QListView.Batched)
+        self._delegate.decrypt.connect(self._decrypt_row)
+
+    @pyqtSlot(list)
+    def new_messages(self, messages: List[Tuple[Peer, "Message"]]) -> None:
+        """Add a batch of messages received from peers to the list."""
+
+        self._model.add_messages(messages)
+
+    @pyqtSlot(Peer, object)
+    def file_progress(self, peer: Peer, transfer: "IncomingTransfer") -> None:
+        """Add a file received from a peer to the list or update its progress."""
+
+        self._model.update_transfer(peer, transfer)
+
+    @pyqtSlot()
+    def decrypt_all(self) -> None:
+        """Request decryption of all messages that are still encrypted."""
+
+        messages = self._model.encrypted_messages()
+
+        if messages:
+            self.decrypt_many.emit(messages)
+
+    @pyqtSlot(object, bytes)
+    def show_decrypted(self, message: "Message", content: bytes) -> None:
+        """Show decrypted content of a message."""
+
+        self._model.set_content(message, content)
+
+    @pyqtSlot(object, str)
+    def show_decrypted_file(self, transfer: "IncomingTransfer", path: str) -> None:
+        """Show a path of a decrypted file."""
+
+        self._model.set_path(transfer, path)
+
+    @pyqtSlot(object)
+    def show_failed(self, message: "Message") -> None:
+        """Show that a message failed authentication."""
+
+        self._model.set_failed(message)
+
+    @pyqtSlot(object)
+    def show_failed_file(self, transfer: "IncomingTransfer") -> None:
+        """Show that a file failed authentication."""
+
+        self._model.set_file_failed(transfer)
+
+    @pyqtSlot(QModelIndex)
+    def _decrypt_row(self, index: QModelIndex) -> None:
+        transfer = index.data(TRANSFER_ROLE)
+
+        if transfer is not None:
+            self.decrypt_file.emit(transfer)
+        else:
+            self.decrypt.emit(index.data(MESSAGE_ROLE))
+
+
+def _row_text(row: _Row) -> str:
+    if row.failed:
+        return f"{row.sender}: rejected content that failed authentication"
+
+    if row.path is not None:
+        return f"{row.sender}: saved a file to {row.path}"
+
+    if row.transfer is not None:
+        size = row.transfer.offer.size
+        percent = 100 * row.transfer.received // size if size > 0 else 100
+
+        return f"File from {row.sender} ({size} bytes): {percent}%"
+
+    if row.preview is None:
+        return f"New message from {row.sender}"
+
+    # A character cut in half at the end of a preview is left out instead of being
+    # replaced.
+    preview = row.preview[:MESSAGE_PREVIEW_LEN]
+    final = len(preview) == len(row.preview)
+
+    # Some codecs fail regardless of errors, like UTF-16 without a byte order mark.
+    try:
+        text = _decoder(row.encoding).decode(preview, final)
+    except UnicodeError:
+        text = _decoder("utf-8").decode(preview, final)
+
+    return f"{row.sender}: {text}"
+
+
+def _decryptable(index: QModelIndex) -> bool:
+    return index.data(MESSAGE_ROLE) is not None or index.data(TRANSFER_ROLE) is not None
+
 
-        layout.addWidget(QLabel("New message"))
-        layout.addWidget(decrypt_button)
-        decrypt_button.clicked.connect(self.decrypt.emit)
-        self.setLayout(layout)
+def _text_encoding(name: str) -> str:
+    # Encodings are named by peers, unknown ones and codecs that do not decode text,
+    # like zlib, fall back to UTF-8.
+    try:
+        "".encode(name)
+    except LookupError:
+        return "utf-8"
 
+    return name
 
-class MessagesList(QListWidget):
-    """List of received messages."""
 
-    decrypt = pyqtSignal(Message)
+def _decoder(encoding: str) -> codecs.IncrementalDecoder:
+    return codecs.getincrementaldecoder(encoding)(errors="replace")
 
-    @pyqtSlot(Message)
-    def new_message(self, message: Message) -> None:
-        """Add a message to the list."""
 
-        list_item = QListWidgetItem()
-        message_item = MessageItem(message)
+def _style(widget: Optional[QWidget]) -> QStyle:
+    style = widget.style() if widget is not None else None
 
-        list_item.setSizeHint(message_item.sizeHint())
-        message_item.decrypt.connect(self.decrypt.emit)
-        self.addItem(list_item)
-        self.setItemWidget(list_item, message_item)
+    return style if style is not None else cast(QStyle, QApplication.style())
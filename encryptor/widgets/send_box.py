@@ -1,4 +1,10 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPlainTextEdit, QPushButton
+from PyQt5.QtWidgets import (
+    QFileDialog,
+    QWidget,
+    QVBoxLayout,
+    QPlainTextEdit,
+    QPushButton,
+)
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 
 
@@ -6,17 +12,21 @@ class SendBox(QWidget):
     """Box that allows to send messages to the server."""
 
     send = pyqtSignal(str)
+    send_file = pyqtSignal(str)
 
     def __init__(self) -> None:
         super().__init__()
 
         layout = QVBoxLayout()
         send_button = QPushButton("Send message")
+        send_file_button = QPushButton("Send file")
         self._textarea = QPlainTextEdit()
 
         send_button.clicked.connect(self._send_message)
+        send_file_button.clicked.connect(self._send_file)
         layout.addWidget(self._textarea)
         layout.addWidget(send_button)
+        layout.addWidget(send_file_button)
         self.setLayout(layout)
 
     @pyqtSlot()
@@ -24,3 +34,10 @@ class SendBox(QWidget):
         message = self._textarea.toPlainText()
 
         self.send.emit(message)
+
+    @pyqtSlot()
+    def _send_file(self) -> None:
+        path, _ = QFileDialog.getOpenFileName(self, "Send file")
+
+        if path:
+            self.send_file.emit(path)
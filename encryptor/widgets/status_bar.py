@@ -1,12 +1,18 @@
-from typing import Optional
+from typing import Optional, Tuple
 from PyQt5.QtWidgets import QLabel, QStatusBar, QComboBox
-from PyQt5.QtCore import pyqtSignal, pyqtSlot
+from PyQt5.QtCore import QTimer, pyqtSignal, pyqtSlot
+from encryptor import metrics
+from encryptor.constants import METRICS_INTERVAL
 from encryptor.encryption.mode import EncryptionMode
 from encryptor.network.connection import Address
 
 
 class StatusBar(QStatusBar):
-    """Status bar of the application."""
+    """Status bar of the application.
+
+    A panel shows network throughput, mean latencies of encryption and decryption,
+    and number of queued messages and frames over the last `METRICS_INTERVAL`.
+    """
 
     mode_change = pyqtSignal(EncryptionMode)
 
@@ -16,24 +22,24 @@ class StatusBar(QStatusBar):
         self._client_address = QLabel(f"Your IP: {my_addr}")
         self._server_address = QLabel()
         self._combobox = QComboBox()
+        self._metrics = QLabel()
+        self._metrics_timer = QTimer(self)
+        self._last_totals = _metric_totals()
 
         self._server_address.setVisible(False)
-        self._combobox.addItems(
-            [
-                EncryptionMode.ECB.value,
-                EncryptionMode.CBC.value,
-                EncryptionMode.CFB.value,
-                EncryptionMode.OFB.value,
-            ]
-        )
+        self._combobox.addItems([mode.value for mode in EncryptionMode])
         self._combobox.currentIndexChanged.connect(
             lambda mode_index: self.mode_change.emit(
                 EncryptionMode(self._combobox.itemText(mode_index))
             )
         )
         self.addWidget(self._combobox)
+        self.addPermanentWidget(self._metrics)
         self.addPermanentWidget(self._client_address)
         self.addPermanentWidget(self._server_address)
+        self._metrics_timer.timeout.connect(self._update_metrics)
+        self._metrics_timer.start(METRICS_INTERVAL * 1000)
+        self._update_metrics()
 
     @pyqtSlot(Address)
     def update_server_addr(self, addr: Optional[Address]) -> None:
@@ -44,3 +50,43 @@ class StatusBar(QStatusBar):
         else:
             self._server_address.setText(f"Connected to: {addr}")
             self._server_address.setVisible(True)
+
+    @pyqtSlot(Address, int, float)
+    def show_reconnecting(self, addr: Address, attempt: int, delay: float) -> None:
+        """Show that a lost connection to a server is being reconnected."""
+
+        self._server_address.setText(
+            f"Reconnecting to: {addr} (attempt {attempt} in {delay:.0f} s)"
+        )
+        self._server_address.setVisible(True)
+
+    @pyqtSlot()
+    def _update_metrics(self) -> None:
+        totals = _metric_totals()
+        received, sent, encrypted, encrypt_time, decrypted, decrypt_time = (
+            total - last for total, last in zip(totals, self._last_totals)
+        )
+        queued = metrics.QUEUE_SIZE.total() + metrics.SCHEDULED_FRAMES.total()
+        self._last_totals = totals
+
+        # Counters of closed connections are removed, so a difference may be negative.
+        self._metrics.setText(
+            f"In {max(received, 0) / METRICS_INTERVAL / 1024:.1f} KiB/s"
+            f" out {max(sent, 0) / METRICS_INTERVAL / 1024:.1f} KiB/s"
+            f" | encrypt {_mean_ms(encrypt_time, encrypted)}"
+            f" decrypt {_mean_ms(decrypt_time, decrypted)}"
+            f" | queued {queued:.0f}"
+        )
+
+
+def _metric_totals() -> Tuple[float, ...]:
+    return (
+        metrics.BYTES_RECEIVED.total(),
+        metrics.BYTES_SENT.total(),
+        *metrics.ENCRYPT_SECONDS.totals(),
+        *metrics.DECRYPT_SECONDS.totals(),
+    )
+
+
+def _mean_ms(seconds: float, count: float) -> str:
+    return f"{seconds / count * 1000:.2f} ms" if count > 0 else "-"
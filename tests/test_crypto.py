@@ -0,0 +1,95 @@
+# pylint: disable=missing-function-docstring
+import io
+from typing import Iterator, List
+import pytest
+from encryptor.encryption import crypto
+from encryptor.encryption.keys import generate_key, Key, KeyType
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.encryption.session import DecryptionSession, EncryptionSession
+
+# Lengths around block and chunk boundaries of a chunk size used by the tests.
+CHUNK_SIZE = 64
+LENGTHS = [0, 1, 15, 16, 17, 63, 64, 65, 1000]
+
+
+@pytest.fixture(name="key", scope="module", params=KeyType.available(), ids=str)
+def fixture_key(request: pytest.FixtureRequest) -> Key:
+    """Generate a key of every available type, once for all tests."""
+
+    return generate_key(request.param)
+
+
+def content(length: int) -> bytes:
+    """Create content of a given length, which is not all the same byte."""
+
+    return bytes(i * 7 % 251 for i in range(length))
+
+
+def chunks(data: bytes, size: int) -> Iterator[bytes]:
+    """Split bytes into chunks of a given size, like reads of a socket."""
+
+    return (data[i : i + size] for i in range(0, len(data), size))
+
+
+@pytest.mark.parametrize("mode", list(EncryptionMode), ids=str)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_encrypt_stream_matches_encrypt(
+    key: Key, mode: EncryptionMode, length: int
+) -> None:
+    data = content(length)
+
+    streamed = b"".join(
+        crypto.encrypt_stream(io.BytesIO(data), mode, key, chunk_size=CHUNK_SIZE)
+    )
+    encrypted = crypto.encrypt(data, mode, key)
+
+    assert len(streamed) == len(encrypted)
+    assert len(streamed) == crypto.encrypted_length(
+        length, mode, crypto.wrapped_key_len(key)
+    )
+    assert crypto.decrypt(streamed, mode, key) == data
+
+
+@pytest.mark.parametrize("mode", list(EncryptionMode), ids=str)
+@pytest.mark.parametrize("length", LENGTHS)
+def test_decrypt_stream_matches_decrypt(
+    key: Key, mode: EncryptionMode, length: int
+) -> None:
+    data = content(length)
+    encrypted = crypto.encrypt(data, mode, key)
+
+    decrypted = b"".join(
+        crypto.decrypt_stream(chunks(encrypted, 5), mode, key, chunk_size=CHUNK_SIZE)
+    )
+
+    assert decrypted == data
+
+
+@pytest.mark.parametrize("mode", list(EncryptionMode), ids=str)
+def test_session_stream_matches_session_message(key: Key, mode: EncryptionMode) -> None:
+    data = content(1000)
+    encryption = EncryptionSession(key.public_key())
+    decryption = DecryptionSession()
+    key_id, wrapped_key = encryption.rekey()
+    decryption.add_key(key_id, wrapped_key)
+
+    messages: List[bytes] = [
+        encryption.encrypt(data, mode),
+        b"".join(encryption.encrypt_stream(io.BytesIO(data), len(data), mode)),
+    ]
+
+    assert len(messages[0]) == len(messages[1]) == crypto.encrypted_length(1000, mode)
+    assert [decryption.decrypt(key_id, m, mode, key) for m in messages] == [data] * 2
+
+
+@pytest.mark.parametrize(
+    "mode", [EncryptionMode.GCM, EncryptionMode.CHACHA20_POLY1305], ids=str
+)
+def test_authenticated_streams_reject_tampered_data(
+    key: Key, mode: EncryptionMode
+) -> None:
+    encrypted = bytearray(crypto.encrypt(content(100), mode, key))
+    encrypted[-1] ^= 1
+
+    with pytest.raises(ValueError):
+        b"".join(crypto.decrypt_stream(chunks(bytes(encrypted), 16), mode, key))
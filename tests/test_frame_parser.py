@@ -0,0 +1,101 @@
+# pylint: disable=missing-function-docstring
+from typing import List
+import pytest
+from encryptor.network.connection import Address
+from encryptor.network.message import ContentType, FrameParser, Message
+
+ADDR = Address("127.0.0.1", 1)
+
+
+def feed(parser: FrameParser, data: bytes, step: int) -> List[Message]:
+    """Feed bytes to a parser `step` bytes at a time, return parsed messages."""
+
+    messages: List[Message] = []
+    view = memoryview(data)
+
+    while view:
+        buffer = parser.get_buffer()
+        size = min(len(buffer), len(view), step)
+        buffer[:size] = view[:size]
+        view = view[size:]
+        parser.buffer_updated(size)
+
+        message = parser.next_message()
+
+        while message is not None:
+            messages.append(message)
+            message = parser.next_message()
+
+    return messages
+
+
+@pytest.mark.parametrize("version", [1, 2, 3])
+@pytest.mark.parametrize("step", [1, 7, 1 << 20])
+def test_parses_messages_split_anywhere(version: int, step: int) -> None:
+    sent = [
+        Message.of(b"", ContentType.BINARY),
+        Message.of(b"hello", ContentType.BINARY),
+        Message.of(b'{"content_type": "goodbye"}', ContentType.JSON),
+        Message.of(bytes(range(256)) * 1024, ContentType.BINARY, "latin-1"),
+    ]
+
+    received = feed(
+        FrameParser(ADDR), b"".join(message.to_bytes(version) for message in sent), step
+    )
+
+    assert [message.content for message in received] == [m.content for m in sent]
+    assert [message.headers.content_type for message in received] == [
+        message.headers.content_type for message in sent
+    ]
+    assert received[-1].headers.content_encoding == "latin-1"
+
+
+def test_joins_fragments_of_interleaved_streams() -> None:
+    first = Message.of(b"a" * 1000, ContentType.BINARY)
+    second = Message.of(b"b" * 700, ContentType.BINARY)
+    first_fragments = list(first.fragments(1, 300))
+    second_fragments = list(second.fragments(2, 300))
+    frames = [
+        fragment for pair in zip(first_fragments, second_fragments) for fragment in pair
+    ] + first_fragments[len(second_fragments) :]
+
+    received = feed(
+        FrameParser(ADDR), b"".join(frame.to_bytes(3) for frame in frames), 1000
+    )
+
+    assert [message.content for message in received] == [
+        second.content,
+        first.content,
+    ]
+    assert all(not getattr(message.headers, "more", False) for message in received)
+
+
+def test_passes_small_messages_of_a_stream_whole() -> None:
+    message = Message.of(b"small", ContentType.BINARY)
+
+    assert list(message.fragments(1, 300)) == [message]
+
+
+def test_rejects_messages_over_the_limit() -> None:
+    parser = FrameParser(ADDR, max_message_size=10)
+
+    assert feed(parser, Message.of(b"x" * 10, ContentType.BINARY).to_bytes(2), 100)
+
+    with pytest.raises(ValueError):
+        feed(parser, Message.of(b"x" * 11, ContentType.BINARY).to_bytes(2), 100)
+
+
+def test_rejects_fragmented_messages_over_the_limit() -> None:
+    message = Message.of(b"x" * 100, ContentType.BINARY)
+    data = b"".join(fragment.to_bytes(3) for fragment in message.fragments(1, 30))
+
+    with pytest.raises(ValueError):
+        feed(FrameParser(ADDR, max_message_size=50), data, 1000)
+
+
+def test_accepts_any_size_without_a_limit() -> None:
+    message = Message.of(b"x" * 100_000, ContentType.BINARY)
+
+    received = feed(FrameParser(ADDR, max_message_size=None), message.to_bytes(2), 7919)
+
+    assert [m.content for m in received] == [message.content]
@@ -0,0 +1,87 @@
+# pylint: disable=missing-function-docstring
+from typing import List
+import pytest
+from encryptor.compression import available_codecs, negotiate
+from encryptor.constants import PROTOCOL_VERSIONS
+from encryptor.network.connection import Address
+from encryptor.network.exceptions import UnsupportedProtocol
+from encryptor.network.message import (
+    ContentType,
+    Handshake,
+    JSONContentType,
+    JSONMessageContent,
+    Message,
+)
+
+ADDR = Address("127.0.0.1", 4000)
+
+
+def test_handshake_round_trip() -> None:
+    handshake = Handshake(
+        ADDR,
+        "fingerprint",
+        ["zlib"],
+        [1, 2],
+        resumption_token="issued",
+        resume_token="presented",
+        resumed=True,
+        reply=True,
+    )
+
+    received = Handshake.from_message(handshake.to_message())
+
+    assert received == handshake
+    assert received.ret_addr == ADDR
+
+
+def test_default_handshake_round_trip() -> None:
+    handshake = Handshake(ADDR)
+
+    assert Handshake.from_message(handshake.to_message()) == handshake
+    assert handshake.protocol_version == max(PROTOCOL_VERSIONS)
+
+
+@pytest.mark.parametrize(
+    "versions, expected",
+    [([1], 1), ([1, 2], 2), ([2, 1], 2), ([3, 99], 3), ([1, 2, 3, 4], 3)],
+)
+def test_newest_common_protocol_version(versions: List[int], expected: int) -> None:
+    assert Handshake(ADDR, protocol_versions=versions).protocol_version == expected
+
+
+@pytest.mark.parametrize("versions", [[], [0], [99, 100]])
+def test_no_common_protocol_version(versions: List[int]) -> None:
+    with pytest.raises(UnsupportedProtocol):
+        _ = Handshake(ADDR, protocol_versions=versions).protocol_version
+
+
+def test_handshake_without_versions_supports_only_protocol_v1() -> None:
+    content = JSONMessageContent(
+        content_type=JSONContentType.HANDSHAKE, ret_host=ADDR.host, ret_port=ADDR.port
+    )
+
+    handshake = Handshake.from_message(Message.of(content.to_bytes(), ContentType.JSON))
+
+    assert handshake.protocol_version == 1
+    assert handshake.compression == []
+    assert handshake.resumption_token is None
+    assert not handshake.reply
+
+
+def test_handshake_rejects_other_messages() -> None:
+    content = JSONMessageContent(content_type=JSONContentType.GOODBYE)
+
+    with pytest.raises(ValueError):
+        Handshake.from_message(Message.of(content.to_bytes(), ContentType.JSON))
+
+
+def test_negotiates_most_preferred_codec() -> None:
+    codecs = available_codecs()
+
+    assert negotiate(reversed(codecs)) == codecs[0]
+    assert negotiate(["zlib"]) == "zlib"
+
+
+def test_negotiates_no_codec_without_a_common_one() -> None:
+    assert negotiate([]) is None
+    assert negotiate(["brotli"]) is None
@@ -0,0 +1,92 @@
+# pylint: disable=missing-function-docstring
+from typing import Any, Dict
+import pytest
+from encryptor.encryption.mode import EncryptionMode
+from encryptor.network.message import ContentType, MessageHeaders
+
+
+def headers(**extra: Any) -> MessageHeaders:
+    """Create headers of a binary message with given extra headers."""
+
+    return MessageHeaders(
+        byteorder="big",
+        content_length=1234,
+        content_type=ContentType.BINARY,
+        content_encoding="utf-8",
+        **extra,
+    )
+
+
+@pytest.mark.parametrize(
+    "extra",
+    [
+        {},
+        {"byteorder": "little", "content_type": ContentType.JSON},
+        {"content_encoding": "utf-16-le"},
+        {"session_key_id": 7, "encryption_mode": EncryptionMode.GCM},
+        {"session_key_id": 0, "encryption_mode": EncryptionMode.CHACHA20_POLY1305},
+        {"session_key_id": 1, "encryption_mode": EncryptionMode.CBC},
+        {"compression": "zlib"},
+        {"stream_id": 3, "more": True},
+        {"stream_id": 4, "more": False},
+        {
+            "content_type": ContentType.FILE,
+            "transfer_id": "0123456789abcdef0123456789abcdef",
+            "offset": 1 << 40,
+        },
+        {
+            "session_key_id": 2,
+            "encryption_mode": EncryptionMode.GCM,
+            "compression": "zlib",
+            "stream_id": 5,
+            "more": True,
+        },
+    ],
+)
+def test_binary_headers_round_trip(extra: Dict[str, Any]) -> None:
+    original = MessageHeaders(**{**headers().__dict__, **extra})
+    data = MessageHeaders.to_binary(original)
+
+    assert MessageHeaders.from_binary(data) == original
+    assert MessageHeaders.from_bytes(MessageHeaders.to_bytes(original, 3)) == original
+
+
+def test_binary_headers_version() -> None:
+    assert MessageHeaders.to_binary(headers())[0] == 2
+    assert MessageHeaders.to_binary(headers(stream_id=1, more=False))[0] == 3
+
+
+def test_json_headers_round_trip() -> None:
+    original = headers(session_key_id=3, encryption_mode=EncryptionMode.CFB)
+    data = MessageHeaders.to_bytes(original, 1)
+
+    assert data[0] == 0
+    assert MessageHeaders.from_bytes(data) == original
+
+
+def test_unknown_headers_fall_back_to_json() -> None:
+    original = headers(note="not in the binary format")
+
+    with pytest.raises(ValueError):
+        MessageHeaders.to_binary(original)
+
+    data = MessageHeaders.to_bytes(original, 3)
+
+    assert data[0] == 0
+    assert MessageHeaders.from_bytes(data) == original
+
+
+def test_binary_headers_reject_unknown_values() -> None:
+    data = bytearray(MessageHeaders.to_binary(headers()))
+    data[2] = 255
+
+    with pytest.raises(ValueError):
+        MessageHeaders.from_binary(bytes(data))
+
+
+def test_binary_headers_reject_unknown_versions() -> None:
+    data = bytearray(MessageHeaders.to_binary(headers()))
+    data[0] = 9
+
+    with pytest.raises(ValueError):
+        MessageHeaders.from_binary(bytes(data))